@@ -0,0 +1,4 @@
+"""
+Speed Programming Language Benchmarks
+Performance benchmarks for the Speed compiler and standard library
+"""
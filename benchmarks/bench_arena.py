@@ -0,0 +1,104 @@
+"""
+Allocation benchmark.
+
+JIT-compiles (at -O2) a loop that allocates and walks a complete binary
+tree of the given depth over and over, once with each tree built inside an
+`arena { ... }` block (nodes bump-allocated and freed together when the
+block is left) and once with every node coming from malloc, and reports the
+time per node and how much each run raised the process's peak memory.
+Objects outside an arena are never freed yet, so the malloc run's memory
+grows with every tree; it runs last, so its growth does not hide the
+arena's.
+
+Usage: python -m benchmarks.bench_arena [--depth N] [--trees N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import resource
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+SOURCE = """
+class Tree {
+    left: Tree;
+    right: Tree;
+    depth: int;
+}
+
+fn build(depth: int): Tree {
+    if (depth == 0) {
+        return new Tree();
+    }
+    return new Tree(build(depth - 1), build(depth - 1), depth);
+}
+
+fn check(tree: Tree): int {
+    if (tree.depth == 0) {
+        return 1;
+    }
+    return 1 + check(tree.left) + check(tree.right);
+}
+
+public fn trees_arena(trees: int, depth: int): int {
+    let nodes = 0;
+    for (let i = 0; i < trees; i = i + 1) {
+        arena {
+            nodes = nodes + check(build(depth));
+        }
+    }
+    return nodes;
+}
+
+public fn trees_malloc(trees: int, depth: int): int {
+    let nodes = 0;
+    for (let i = 0; i < trees; i = i + 1) {
+        nodes = nodes + check(build(depth));
+    }
+    return nodes;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+
+def peak_memory():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def time_call(function, trees, depth, runs):
+    best = float('inf')
+    before = peak_memory()
+    for _ in range(runs):
+        start = time.perf_counter()
+        nodes = function(trees, depth)
+        best = min(best, time.perf_counter() - start)
+    return best, nodes, peak_memory() - before
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--depth', type=int, default=16, help='Depth of each tree')
+    parser.add_argument('--trees', type=int, default=100, help='Trees to build')
+    parser.add_argument('--runs', type=int, default=3, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    program = JIT(opt_level='2', use_cache=False).load(SOURCE)
+    print(f"{'nodes':<10}{'time':>12}{'per node':>12}{'peak growth':>14}")
+    for mode in ('arena', 'malloc'):
+        function = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64, ctypes.c_int64)(
+            program.engine.get_function_address(f'trees_{mode}'))
+        best, nodes, growth = time_call(function, args.trees, args.depth, args.runs)
+        print(f"{mode:<10}{best * 1000:>10.1f}ms{best / nodes * 1e9:>10.2f}ns"
+              f"{growth / 2**20:>11.1f}MiB")
+
+
+if __name__ == '__main__':
+    main()
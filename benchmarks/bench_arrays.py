@@ -0,0 +1,126 @@
+"""
+Batched math benchmark.
+
+JIT-compiles, at -O2, element-by-element loops written in Speed next to the
+batched float[] functions of the math module, and times both over the
+same million-element arrays handed in from Python. The batched versions are
+vectorized loops; the hand-written reductions are not, because without a
+hint LLVM may not reorder the additions.
+
+Usage: python -m benchmarks.bench_arrays [--n N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import math
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+SOURCE = """
+import { sin, sqrt, sin_into, sqrt_into, sum, dot } from "math"
+
+public fn loop_sum(xs: float[]): float {
+    let total = 0.0;
+    for (let i = 0; i < xs.length; i = i + 1) {
+        total = total + xs[i];
+    }
+    return total;
+}
+public fn batch_sum(xs: float[]): float {
+    return sum(xs);
+}
+
+public fn loop_dot(xs: float[], ys: float[]): float {
+    let total = 0.0;
+    for (let i = 0; i < xs.length; i = i + 1) {
+        total = total + xs[i] * ys[i];
+    }
+    return total;
+}
+public fn batch_dot(xs: float[], ys: float[]): float {
+    return dot(xs, ys);
+}
+
+public fn loop_sin(xs: float[], out: float[]): float {
+    for (let i = 0; i < xs.length; i = i + 1) {
+        out[i] = sin(xs[i]);
+    }
+    return 0.0;
+}
+public fn batch_sin(xs: float[], out: float[]): float {
+    sin_into(xs, out);
+    return 0.0;
+}
+
+public fn loop_sqrt(xs: float[], out: float[]): float {
+    for (let i = 0; i < xs.length; i = i + 1) {
+        out[i] = sqrt(xs[i]);
+    }
+    return 0.0;
+}
+public fn batch_sqrt(xs: float[], out: float[]): float {
+    sqrt_into(xs, out);
+    return 0.0;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+
+class FloatArray(ctypes.Structure):
+    # float[] is passed as its (data, length) pair
+    _fields_ = [('data', ctypes.POINTER(ctypes.c_double)), ('length', ctypes.c_int64)]
+
+
+def make_array(values):
+    buffer = (ctypes.c_double * len(values))(*values)
+    return FloatArray(ctypes.cast(buffer, ctypes.POINTER(ctypes.c_double)), len(values)), buffer
+
+
+KERNELS = {
+    'sum': 1,
+    'dot': 2,
+    'sin': 2,
+    'sqrt': 2,
+}
+
+
+def best_time(func, args, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=1_000_000, help='Array length')
+    parser.add_argument('--runs', type=int, default=20, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    program = JIT(opt_level='2', use_cache=False).load(SOURCE)
+    xs, xs_buffer = make_array([math.sqrt(i) for i in range(args.n)])
+    ys, ys_buffer = make_array([1.0 / (i + 1) for i in range(args.n)])
+
+    print(f"{'kernel':<8}{'loop':>12}{'batched':>12}{'speedup':>10}")
+    for name, arity in KERNELS.items():
+        times = []
+        for variant in ('loop', 'batch'):
+            func_type = ctypes.CFUNCTYPE(ctypes.c_double, *[FloatArray] * arity)
+            func = func_type(program.engine.get_function_address(f'{variant}_{name}'))
+            times.append(best_time(func, (xs, ys)[:arity], args.runs))
+        loop, batch = times
+        print(f"{name:<8}{loop / args.n * 1e9:>10.3f}ns{batch / args.n * 1e9:>10.3f}ns"
+              f"{loop / batch:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
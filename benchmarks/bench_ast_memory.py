@@ -0,0 +1,68 @@
+"""
+AST memory benchmark.
+
+Parses a large generated program in a fresh interpreter and reports how many
+AST nodes it produced, the bytes allocated per node while parsing (measured
+with tracemalloc, so the token list and parser tables are not counted), and
+the process's peak RSS.
+
+Usage: python -m benchmarks.bench_ast_memory [--functions N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+UNIT = """
+fn compute_{i}(a: int, b: int): int {{
+    let total = a * 3 + b / 2 - {i};
+    let scaled: int = (total + a) * (b - 1);
+    let flag = scaled >= total;
+    return scaled - total * 2;
+}}
+"""
+
+# Executed in a child interpreter so that peak RSS belongs to this parse alone.
+CHILD = """
+import json, resource, sys, tracemalloc, warnings
+warnings.simplefilter("ignore")
+from speed.compiler.ast import walk
+from speed.compiler.compiler import Compiler
+source = sys.stdin.read()
+compiler = Compiler()
+parser = compiler.parser.get_parser()
+tokens = list(compiler.lexer.get_lexer().lex(source))
+tracemalloc.start()
+before = tracemalloc.get_traced_memory()[0]
+program = parser.parse(iter(tokens))
+after = tracemalloc.get_traced_memory()[0]
+tracemalloc.stop()
+nodes = sum(1 for _ in walk(program))
+print(json.dumps({
+    "nodes": nodes,
+    "ast_bytes": after - before,
+    "peak_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+}))
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--functions', type=int, default=20000, help='Functions in the program')
+    args = parser.parse_args(argv)
+
+    source = ''.join(UNIT.format(i=i) for i in range(args.functions))
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", CHILD], input=source, cwd=root,
+                         check=True, capture_output=True, text=True).stdout
+    result = json.loads(out.strip().splitlines()[-1])
+    print(f"source: {len(source) / 1e6:.1f} MB  nodes: {result['nodes']}")
+    print(f"AST: {result['ast_bytes'] / 1e6:.1f} MB  "
+          f"({result['ast_bytes'] / result['nodes']:.0f} bytes/node)")
+    print(f"peak RSS: {result['peak_rss_kb'] / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Async networking benchmark.
+
+JIT-compiles (at -O2) an echo server and its clients, all async fns on the
+one event loop in this thread: the server accepts connections and spawns a
+task per connection that echoes one message back, while the clients connect
+in waves of a given number of simultaneous connections. Reports the time
+and connections per second for each number of simultaneous connections.
+
+Usage: python -m benchmarks.bench_async [--connections N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+SOURCE = """
+import { listen, port, accept, connect, recv, send, close } from "net"
+import { group, spawn, gather } from "tasks"
+
+async fn echo(fd: int) {
+    let message = await recv(fd, 4096);
+    await send(fd, message);
+    close(fd);
+}
+
+async fn serve(server: int, connections: int): int {
+    let handlers = group();
+    for (let i = 0; i < connections; i = i + 1) {
+        let fd = await accept(server);
+        if (fd >= 0) {
+            spawn(handlers, echo(fd));
+        }
+    }
+    return await gather(handlers);
+}
+
+async fn request(to: int, replies: Counter) {
+    let fd = await connect("127.0.0.1", to);
+    if (fd >= 0) {
+        await send(fd, "GET / HTTP/1.0");
+        let reply = await recv(fd, 4096);
+        close(fd);
+        if (reply.length > 0) {
+            replies.count = replies.count + 1;
+        }
+    }
+}
+
+class Counter { count: int; }
+
+public fn run(connections: int, concurrency: int): int {
+    let server = listen(0);
+    let to = port(server);
+    let served = serve(server, connections);
+    let replies = new Counter(0);
+    let wave = group();
+    for (let i = 0; i < connections; i = i + 1) {
+        spawn(wave, request(to, replies));
+        if ((i + 1) % concurrency == 0) {
+            await gather(wave);
+        }
+    }
+    await gather(wave);
+    await served;
+    close(server);
+    return replies.count;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--connections', type=int, default=2000, help='Connections per run')
+    parser.add_argument('--runs', type=int, default=3, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    program = JIT(opt_level='2', use_cache=False).load(SOURCE)
+    run = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64, ctypes.c_int64)(
+        program.engine.get_function_address('run'))
+
+    print(f"{'concurrent':<12}{'replies':>8}{'time':>12}{'connections/s':>16}")
+    for concurrency in (1, 16, 256):
+        best = float('inf')
+        for _ in range(args.runs):
+            start = time.perf_counter()
+            replies = run(args.connections, concurrency)
+            best = min(best, time.perf_counter() - start)
+        print(f"{concurrency:<12}{replies:>8}{best * 1000:>10.1f}ms"
+              f"{args.connections / best:>16.0f}")
+
+
+if __name__ == '__main__':
+    main()
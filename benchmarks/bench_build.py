@@ -0,0 +1,59 @@
+"""
+Parallel build benchmark.
+
+Generates a project of many source files, whose functions call public
+functions of the file before them, and builds it into one linked object
+with `speed build` machinery, once per worker count, to show how the build
+scales with the number of processes.
+
+Usage: python -m benchmarks.bench_build [--files N] [--functions N] [-O LEVEL]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.build import Build
+
+
+def write_project(root, files, functions):
+    for i in range(files):
+        lines = []
+        for j in range(functions):
+            # Every file but the first calls into the one before it
+            result = "c - a" if i == 0 else "f%d_%d(c, b) - a" % (i - 1, j)
+            lines.append("public fn f%d_%d(a: int, b: int): int {\n    let c = a * b + %d;\n    return %s;\n}" % (i, j, j, result))
+        with open(os.path.join(root, "unit%d.speed" % i), "w") as f:
+            f.write("\n".join(lines))
+    with open(os.path.join(root, "main.speed"), "w") as f:
+        f.write("fn main(): int {\n    return f%d_0(1, 2);\n}\n" % (files - 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--files', type=int, default=64, help='Source files in the project')
+    parser.add_argument('--functions', type=int, default=100, help='Functions per file')
+    parser.add_argument('-O', dest='opt_level', default='2', help='Optimization level')
+    args = parser.parse_args(argv)
+
+    cpus = os.cpu_count() or 1
+    job_counts = sorted({1, 2, 4, 8, cpus} & set(range(1, cpus + 1)))
+    with tempfile.TemporaryDirectory() as root:
+        write_project(root, args.files, args.functions)
+        output_file = os.path.join(root, "project.o")
+        print(f"{'jobs':<8}{'wall':>12}{'speedup':>10}")
+        baseline = None
+        for jobs in job_counts:
+            start = time.perf_counter()
+            Build(opt_level=args.opt_level, jobs=jobs).write_object([root], output_file)
+            wall = time.perf_counter() - start
+            baseline = baseline or wall
+            print(f"{jobs:<8}{wall * 1000:>10.1f}ms{baseline / wall:>9.2f}x")
+
+
+if __name__ == '__main__':
+    main()
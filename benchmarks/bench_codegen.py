@@ -0,0 +1,65 @@
+"""
+Codegen dispatch benchmark.
+
+Builds a synthetic AST of about 100k nodes directly (no lexing or parsing)
+and measures how fast CodeGenerator turns it into an llvmlite module.
+
+Usage: python -m benchmarks.bench_codegen [--nodes N] [--runs N]
+"""
+
+import argparse
+import time
+
+from speed.compiler.ast import (
+    BinaryOp, Call, FunctionDeclaration, Identifier, Literal, Parameter, Program,
+    ReturnStatement, Type, VariableDeclaration, walk,
+)
+from speed.compiler.codegen import CodeGenerator
+
+OPS = ('+', '-', '*', '+')
+
+
+def make_function(index, terms):
+    expr = Identifier('a')
+    for i in range(terms):
+        operand = Identifier('b') if i % 3 else Literal(i)
+        expr = BinaryOp(OPS[i % len(OPS)], expr, operand)
+    body = [
+        VariableDeclaration('x', None, expr),
+        VariableDeclaration('y', None, BinaryOp('<', Identifier('x'), Literal(index))),
+        ReturnStatement(BinaryOp('*', Identifier('x'), Literal(2))),
+    ]
+    if index:
+        body.insert(2, VariableDeclaration('z', None, Call(f'f{index - 1}', [Identifier('a'), Identifier('x')])))
+    params = [Parameter('a', Type('int')), Parameter('b', Type('int'))]
+    return FunctionDeclaration(f'f{index}', params, Type('int'), body)
+
+
+def make_program(nodes, terms=30):
+    functions = []
+    count = 0
+    while count < nodes:
+        function = make_function(len(functions), terms)
+        count += sum(1 for _ in walk(function))
+        functions.append(function)
+    return Program(functions), count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--nodes', type=int, default=100000, help='Approximate AST size')
+    parser.add_argument('--runs', type=int, default=5, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    program, count = make_program(args.nodes)
+    best = float('inf')
+    for _ in range(args.runs):
+        start = time.perf_counter()
+        CodeGenerator().generate(program)
+        best = min(best, time.perf_counter() - start)
+    print(f"nodes: {count}  codegen: {best * 1000:.1f} ms  "
+          f"throughput: {count / best / 1000:.0f}k nodes/s")
+
+
+if __name__ == '__main__':
+    main()
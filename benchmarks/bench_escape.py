@@ -0,0 +1,95 @@
+"""
+Escape analysis benchmark.
+
+JIT-compiles (at -O2) a tight loop that makes temporary Points - the
+README's `distance` example, a vector sum and a midpoint - once with every
+`new` allocated on the heap and once with the objects EscapeAnalysis shows
+never leave the function put in its stack frame, and reports how many of
+the program's `new`s moved to the stack and the time per loop iteration.
+
+Usage: python -m benchmarks.bench_escape [--n N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.compiler import Compiler
+from speed.compiler.jit import JIT
+
+SOURCE = """
+import { sqrt } from "math"
+
+class Point {
+    x: float;
+    y: float;
+    fn init(x: float, y: float) {
+        this.x = x;
+        this.y = y;
+    }
+    fn plus(other: Point): Point {
+        return new Point(this.x + other.x, this.y + other.y);
+    }
+    fn distance(other: Point): float {
+        let dx = this.x - other.x;
+        let dy = this.y - other.y;
+        return sqrt(dx * dx + dy * dy);
+    }
+}
+
+#[noinline]
+fn midpoint_distance(a: Point, b: Point, to: Point): float {
+    let sum = a.plus(b);
+    let middle = new Point(sum.x / 2, sum.y / 2);
+    return middle.distance(to);
+}
+
+public fn walk(n: int): float {
+    let total = 0.0;
+    let origin = new Point(0, 0);
+    for (let i = 0; i < n; i = i + 1) {
+        let p1 = new Point(i, 1);
+        let p2 = new Point(3, i);
+        total = total + p1.distance(p2) + midpoint_distance(p1, p2, origin);
+    }
+    return total;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+
+def time_call(function, n, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(n)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=10_000_000, help='Loop iterations')
+    parser.add_argument('--runs', type=int, default=3, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'objects':<10}{'on stack':>10}{'time':>12}{'per iteration':>16}")
+    for stack_objects in (False, True):
+        compiler = Compiler(stack_objects=stack_objects)
+        program = JIT(compiler=compiler, opt_level='2', use_cache=False).load(SOURCE)
+        function = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+            program.engine.get_function_address('walk'))
+        best, _ = time_call(function, args.n, args.runs)
+        label = 'stack' if stack_objects else 'heap'
+        print(f"{label:<10}{compiler.codegen.stack_allocated:>10}{best * 1000:>10.1f}ms"
+              f"{best / args.n * 1e9:>14.2f}ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""
+AST constant folding benchmark.
+
+Compiles every program in the test corpus (the *_SOURCE programs of the
+compiler tests and the examples that compile) with and without the AST
+folding pass, and reports the number of IR instructions codegen produced
+and the time the -O2 pipeline then took.
+
+Usage: python -m benchmarks.bench_fold [--runs N]
+"""
+
+import argparse
+import glob
+import os
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.backend import Backend
+from speed.compiler.compiler import Compiler
+from speed.tests import test_compiler
+
+
+def corpus():
+    programs = {name: value for name, value in vars(test_compiler).items()
+                if name.endswith('_SOURCE') and isinstance(value, str)}
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    for path in sorted(glob.glob(os.path.join(root, 'examples', '*.speed'))):
+        with open(path) as f:
+            programs[os.path.basename(path)] = f.read()
+    return programs
+
+
+def measure(source, fold, runs):
+    try:
+        module, stats = Compiler(fold=fold).compile(source, stats=True)
+    except Exception:
+        return None
+    backend = Backend('2')
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        backend.compile(module)
+        best = min(best, time.perf_counter() - start)
+    return stats.instructions, best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=20, help='Samples of -O2 time to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'program':<22}{'instrs':>8}{'folded':>8}{'-O2':>10}{'folded':>10}")
+    total_before = [0, 0.0]
+    total_after = [0, 0.0]
+    for name, source in corpus().items():
+        before = measure(source, False, args.runs)
+        after = measure(source, True, args.runs)
+        if before is None or after is None:
+            print(f"{name:<22}  (does not compile)")
+            continue
+        print(f"{name:<22}{before[0]:>8}{after[0]:>8}{before[1] * 1000:>8.2f}ms{after[1] * 1000:>8.2f}ms")
+        for total, result in ((total_before, before), (total_after, after)):
+            total[0] += result[0]
+            total[1] += result[1]
+    print(f"{'total':<22}{total_before[0]:>8}{total_after[0]:>8}"
+          f"{total_before[1] * 1000:>8.2f}ms{total_after[1] * 1000:>8.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
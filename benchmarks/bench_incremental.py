@@ -0,0 +1,66 @@
+"""
+Incremental compilation benchmark.
+
+Generates a program with many small functions, then compares a full compile
+(including printing the IR) with an incremental rebuild after editing one
+function body, both in the same process and from a fresh IncrementalCompiler
+reading the on-disk cache.
+
+Usage: python -m benchmarks.bench_incremental [--functions N]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.compiler import Compiler
+from speed.compiler.incremental import IncrementalCompiler
+
+
+def make_program(count, edited=None):
+    lines = []
+    for i in range(count):
+        body = "a * b + %d" % (i + 1 if i == edited else i)
+        lines.append("fn f%d(a: int, b: int): int {\n    return %s;\n}" % (i, body))
+    calls = " + ".join("f%d(1, 2)" % i for i in range(min(count, 8)))
+    lines.append("fn main(): int {\n    return %s;\n}" % calls)
+    return "\n".join(lines)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return (time.perf_counter() - start) * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--functions', type=int, default=2000, help='Functions in the program')
+    args = parser.parse_args(argv)
+
+    source = make_program(args.functions)
+    edited = make_program(args.functions, edited=args.functions // 2)
+    compiler = Compiler()
+    compiler.compile("fn warm(): int { return 0; }")
+
+    with tempfile.TemporaryDirectory() as cache:
+        os.environ['SPEED_CACHE_DIR'] = cache
+        full = timed(lambda: str(compiler.compile(edited)))
+        incremental = IncrementalCompiler(compiler)
+        first = timed(lambda: incremental.compile(source))
+        warm = timed(lambda: incremental.compile(edited))
+        fresh = timed(lambda: IncrementalCompiler(compiler).compile(edited))
+
+    print(f"{'scenario':<28}{'time':>12}")
+    print(f"{'full compile':<28}{full:>10.1f}ms")
+    print(f"{'incremental, empty cache':<28}{first:>10.1f}ms")
+    print(f"{'incremental, one edit':<28}{warm:>10.1f}ms")
+    print(f"{'incremental, from disk':<28}{fresh:>10.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,82 @@
+"""
+Call overhead benchmark.
+
+JIT-compiles a loop that calls small helpers on every iteration and times
+it with the Speed-level inliner on and off, at -O0 (where nothing else
+removes the calls) and -O2 (where LLVM inlines internal functions itself,
+unless they are #[noinline], and can then reduce the whole loop to a
+closed form).
+
+Usage: python -m benchmarks.bench_inline [--n N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.compiler import Compiler
+from speed.compiler.jit import JIT
+
+SOURCE = """
+%(hint)s
+fn add(a: int, b: int): int {
+    return a + b;
+}
+%(hint)s
+fn scale(x: int): int {
+    return x * 3 + 1;
+}
+
+public fn run(n: int): int {
+    let total = 0;
+    for (let i = 0; i < n; i = i + 1) {
+        total = add(total, scale(i));
+    }
+    return total;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+CONFIGS = {
+    'calls': ('', False),
+    'inlined': ('', True),
+    'noinline': ('#[noinline]', True),
+}
+
+
+def time_run(opt_level, config, n, runs):
+    hint, inline = CONFIGS[config]
+    jit = JIT(compiler=Compiler(inline=inline), opt_level=opt_level, use_cache=False)
+    program = jit.load(SOURCE % {'hint': hint})
+    run = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64)(
+        program.engine.get_function_address('run'))
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        run(n)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=20_000_000, help='Loop trip count')
+    parser.add_argument('--runs', type=int, default=5, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'level':<8}{'calls':<12}{'time':>12}{'per iteration':>16}")
+    for opt_level in ('0', '2'):
+        for config in CONFIGS:
+            best = time_run(opt_level, config, args.n, args.runs)
+            print(f"-O{opt_level:<6}{config:<12}{best * 1000:>10.1f}ms"
+                  f"{best / args.n * 1e9:>14.3f}ns")
+
+
+if __name__ == '__main__':
+    main()
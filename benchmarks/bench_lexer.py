@@ -0,0 +1,70 @@
+"""
+Lexer throughput benchmark.
+
+Tokenizes a generated Speed source file of the requested size with every
+lexer backend and reports tokens per second.
+
+Usage: python -m benchmarks.bench_lexer [--size-mb N] [--runs N]
+"""
+
+import argparse
+import time
+
+from speed.compiler.lexer import Lexer
+
+UNIT = """
+// Generated function {i}
+fn compute_{i}(a: int, b: float): float {{
+    let total: float = b * 2.5 + a / 3;
+    let label = "value {i}";
+    /* block comment */
+    if (total >= 100.0) {{ return total - 1.0; }}
+    return total != 0.0;
+}}
+"""
+
+
+def generate_source(size_bytes):
+    parts = []
+    total = 0
+    i = 0
+    while total < size_bytes:
+        chunk = UNIT.format(i=i)
+        parts.append(chunk)
+        total += len(chunk)
+        i += 1
+    return ''.join(parts)
+
+
+def time_backend(backend, source, runs):
+    lexer = Lexer(backend).get_lexer()
+    best = None
+    count = 0
+    for _ in range(runs):
+        start = time.perf_counter()
+        count = sum(1 for _ in lexer.lex(source))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return count, best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--size-mb', type=float, default=1.0, help='Generated source size in MB')
+    parser.add_argument('--runs', type=int, default=3, help='Samples per backend')
+    args = parser.parse_args(argv)
+
+    source = generate_source(int(args.size_mb * 1024 * 1024))
+    print(f"source: {len(source) / (1024 * 1024):.2f} MB")
+
+    results = {}
+    for backend in Lexer.BACKENDS:
+        count, elapsed = time_backend(backend, source, args.runs)
+        results[backend] = elapsed
+        print(f"{backend:<8}{count:>10} tokens {elapsed:>8.3f}s {count / elapsed:>14,.0f} tokens/s")
+
+    print(f"speedup (rply / regex): {results['rply'] / results['regex']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
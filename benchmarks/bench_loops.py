@@ -0,0 +1,72 @@
+"""
+Loop hint benchmark.
+
+JIT-compiles a floating-point dot-product loop at -O0 and -O3, with and
+without `#[vectorize]` / `#[unroll(4)]` hints, and times calls to it. The
+language has no arrays yet, so the two vectors are the arithmetic sequences
+x * 0.5 and x * 0.25 computed in the loop.
+
+Usage: python -m benchmarks.bench_loops [--n N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+SOURCE = """
+public fn dot(n: int): float {
+    let sum = 0.0;
+    let x = 0.0;
+    %s
+    for (let i = 0; i < n; i = i + 1) {
+        sum = sum + (x * 0.5) * (x * 0.25);
+        x = x + 1.0;
+    }
+    return sum;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+HINTS = {
+    'none': '',
+    'vectorize': '#[vectorize]',
+    'vectorize+unroll': '#[vectorize, unroll(4)]',
+}
+
+
+def time_dot(opt_level, hints, n, runs):
+    program = JIT(opt_level=opt_level, use_cache=False).load(SOURCE % HINTS[hints])
+    dot = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+        program.engine.get_function_address('dot'))
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        dot(n)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=50_000_000, help='Loop trip count')
+    parser.add_argument('--runs', type=int, default=5, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'level':<8}{'hints':<20}{'time':>12}{'per element':>14}")
+    for opt_level in ('0', '3'):
+        for hints in HINTS:
+            best = time_dot(opt_level, hints, args.n, args.runs)
+            print(f"-O{opt_level:<6}{hints:<20}{best * 1000:>10.1f}ms"
+                  f"{best / args.n * 1e9:>12.3f}ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+"""
+Math intrinsic benchmark.
+
+JIT-compiles a tight loop summing a math function over 0, 1, 2, ... and
+times it with the function called directly, which lowers to an llvm.*
+intrinsic, and through a #[noinline] wrapper, the opaque call the old
+math_<name> thunks amounted to. Intrinsics can be vectorized (the loops
+are #[vectorize]d) and simplified; thunk calls cannot.
+
+Usage: python -m benchmarks.bench_math [--n N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+SOURCE = """
+import { %(name)s } from "math"
+
+#[noinline]
+fn thunk(x: float): float {
+    return %(name)s(x);
+}
+
+public fn run(n: int): float {
+    let sum = 0.0;
+    let x = 0.0;
+    #[vectorize]
+    for (let i = 0; i < n; i = i + 1) {
+        sum = sum + %(call)s(x);
+        x = x + 1.0;
+    }
+    return sum;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+FUNCTIONS = ('sqrt', 'floor', 'abs', 'sin')
+
+
+def time_run(name, path, n, runs):
+    call = 'thunk' if path == 'thunk' else name
+    program = JIT(opt_level='2', use_cache=False).load(SOURCE % {'name': name, 'call': call})
+    run = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+        program.engine.get_function_address('run'))
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        run(n)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=20_000_000, help='Loop trip count')
+    parser.add_argument('--runs', type=int, default=5, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'function':<10}{'thunk':>14}{'intrinsic':>14}{'speedup':>10}")
+    for name in FUNCTIONS:
+        thunk = time_run(name, 'thunk', args.n, args.runs)
+        intrinsic = time_run(name, 'intrinsic', args.n, args.runs)
+        print(f"{name:<10}{thunk / args.n * 1e9:>12.3f}ns{intrinsic / args.n * 1e9:>12.3f}ns"
+              f"{thunk / intrinsic:>9.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""
+File scanning benchmark.
+
+Writes a log file of the given size, then JIT-compiles (at -O2) a scan that
+walks it line by line with line_end/slice - counting lines and the ERROR
+lines among them - and times it on a view from map_file (the file mapped
+in place) and from read_file (copied into memory through fread), with the
+file already in the page cache. The count of newlines with count() is
+timed on both as well.
+
+Usage: python -m benchmarks.bench_mmap [--mb N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import os
+import tempfile
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+SOURCE = """
+import { map_file, read_file, unmap, line_end, slice, count } from "io"
+
+fn scan(data: bytes): int {
+    let lines = 0;
+    let errors = 0;
+    let pos = 0;
+    while (pos < data.length) {
+        let end = line_end(data, pos);
+        let line = slice(data, pos, end);
+        if (line[0] == 69) {
+            errors = errors + 1;
+        }
+        lines = lines + 1;
+        pos = end + 1;
+    }
+    return lines * 1000000 + errors;
+}
+
+public fn scan_mapped(): int {
+    let data = map_file("%(path)s");
+    let result = scan(data);
+    unmap(data);
+    return result;
+}
+public fn scan_read(): int {
+    let data = read_file("%(path)s");
+    let result = scan(data);
+    unmap(data);
+    return result;
+}
+public fn count_mapped(): int {
+    let data = map_file("%(path)s");
+    let result = count(data, 10);
+    unmap(data);
+    return result;
+}
+public fn count_read(): int {
+    let data = read_file("%(path)s");
+    let result = count(data, 10);
+    unmap(data);
+    return result;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+LEVELS = ('INFO', 'DEBUG', 'WARN', 'ERROR')
+
+
+def write_log(path, size):
+    line_number = 0
+    with open(path, 'w') as f:
+        written = 0
+        while written < size:
+            chunk = ''.join(
+                f'{LEVELS[(line_number + i) % 7 % 4]} request {line_number + i} served in '
+                f'{(line_number + i) * 37 % 1000} ms\n' for i in range(10_000))
+            line_number += 10_000
+            f.write(chunk)
+            written += len(chunk)
+
+
+def time_call(function, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mb', type=int, default=512, help='Size of the log file in MiB')
+    parser.add_argument('--runs', type=int, default=5, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'service.log')
+        write_log(path, args.mb << 20)
+        size = os.path.getsize(path)
+        program = JIT(opt_level='2', use_cache=False).load(SOURCE % {'path': path})
+
+        print(f"{'scan':<14}{'time':>12}{'throughput':>14}{'result':>18}")
+        for name in ('scan_mapped', 'scan_read', 'count_mapped', 'count_read'):
+            function = ctypes.CFUNCTYPE(ctypes.c_int64)(
+                program.engine.get_function_address(name))
+            best, result = time_call(function, args.runs)
+            print(f"{name:<14}{best * 1000:>10.1f}ms{size / best / 2**30:>10.2f}GB/s{result:>18}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+"""
+Output benchmark.
+
+Builds executables at -O2 that print N lines - a fixed string, or the loop
+counter - once with the buffered io runtime and once with print lowered to
+a printf("%.*s\\n") (or "%lld\\n") call per line, the way it used to be, and
+times them writing to /dev/null and into a pipe read by this process.
+
+Usage: python -m benchmarks.bench_print [--n N] [--runs N]
+"""
+
+import argparse
+import os
+import subprocess
+import tempfile
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from llvmlite import ir
+from speed.compiler import codegen
+from speed.compiler.compiler import Compiler
+
+SOURCE = """
+import { print } from "io"
+
+fn main(): int {
+    for (let i = 0; i < %(n)d; i = i + 1) {
+        print(%(value)s);
+    }
+    return 0;
+}
+"""
+
+WORKLOADS = {
+    'string': ('"the quick brown fox jumps over the lazy dog"', 'speed.io.print', '%.*s\n'),
+    'int': ('i', 'speed.io.print.int', '%lld\n'),
+}
+
+
+def printf_body(format_text):
+    def build(func, builder):
+        module = func.module
+        text = bytearray(format_text.encode() + b'\0')
+        format_string = ir.GlobalVariable(module, ir.ArrayType(ir.IntType(8), len(text)),
+                                          name='bench.format')
+        format_string.global_constant = True
+        format_string.initializer = ir.Constant(format_string.type.pointee, text)
+        printf = ir.Function(module, ir.FunctionType(
+            ir.IntType(32), [ir.IntType(8).as_pointer()], var_arg=True), name='printf')
+        value = func.args[0]
+        if isinstance(value.type, ir.LiteralStructType):
+            # A string: its length, then its data
+            size = builder.trunc(builder.extract_value(value, 1), ir.IntType(32))
+            arguments = [size, builder.extract_value(value, 0)]
+        else:
+            arguments = [value]
+        builder.call(printf, [builder.bitcast(format_string, ir.IntType(8).as_pointer()),
+                              *arguments])
+        builder.ret_void()
+    return build
+
+
+def build(workload, runtime, n, output_file):
+    value, symbol, format_text = WORKLOADS[workload]
+    original = codegen.STDLIB_BODIES[symbol]
+    if runtime == 'printf':
+        codegen.STDLIB_BODIES[symbol] = printf_body(format_text)
+    try:
+        Compiler().compile_to_executable(SOURCE % {'n': n, 'value': value},
+                                         output_file, opt_level='2')
+    finally:
+        codegen.STDLIB_BODIES[symbol] = original
+
+
+def time_run(program, sink, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        if sink == 'devnull':
+            subprocess.run([program], stdout=subprocess.DEVNULL, check=True)
+        else:
+            process = subprocess.Popen([program], stdout=subprocess.PIPE)
+            while process.stdout.read(1 << 20):
+                pass
+            process.wait()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=10_000_000, help='Lines to print')
+    parser.add_argument('--runs', type=int, default=3, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'lines':<8}{'print':<10}{'stdout':<10}{'time':>12}{'per line':>12}")
+    with tempfile.TemporaryDirectory() as tmp:
+        for workload in WORKLOADS:
+            for runtime in ('printf', 'buffered'):
+                program = os.path.join(tmp, f'{workload}-{runtime}')
+                build(workload, runtime, args.n, program)
+                for sink in ('devnull', 'pipe'):
+                    best = time_run(program, sink, args.runs)
+                    print(f"{workload:<8}{runtime:<10}{sink:<10}{best * 1000:>10.1f}ms"
+                          f"{best / args.n * 1e9:>10.2f}ns")
+
+
+if __name__ == '__main__':
+    main()
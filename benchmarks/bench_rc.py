@@ -0,0 +1,116 @@
+"""
+Reference counting benchmark.
+
+JIT-compiles (at -O2) a loop that makes short-lived objects and passes them
+through small functions, builds a linked list and lets it go, once with every
+reference counted and once with the retains and releases the RetainElider
+shows are not needed left out. Reports the retain/release calls emitted for
+the program each way and the time per loop iteration.
+
+Usage: python -m benchmarks.bench_rc [--n N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.compiler import Compiler
+from speed.compiler.jit import JIT
+
+SOURCE = """
+class Point {
+    x: float;
+    y: float;
+    fn init(x: float, y: float) {
+        this.x = x;
+        this.y = y;
+    }
+    fn plus(other: Point): Point {
+        return new Point(this.x + other.x, this.y + other.y);
+    }
+    fn dot(other: Point): float {
+        return this.x * other.x + this.y * other.y;
+    }
+}
+
+class Link { value: int; next: Link; }
+
+#[noinline]
+fn longest(a: Point, b: Point): Point {
+    if (a.dot(a) > b.dot(b)) {
+        return a;
+    }
+    return b;
+}
+
+fn chain(n: int): int {
+    let head = new Link();
+    for (let i = 1; i <= n; i = i + 1) {
+        head = new Link(i, head);
+    }
+    let sum = 0;
+    let node = head;
+    while (node.value > 0) {
+        sum = sum + node.value;
+        node = node.next;
+    }
+    return sum;
+}
+
+public fn churn(n: int): float {
+    let total = new Point(0, 0);
+    let unit = new Point(1, 1);
+    for (let i = 0; i < n; i = i + 1) {
+        let step = new Point(i, 1);
+        let far = longest(step, unit);
+        total = total.plus(far);
+        if (i % 1000 == 0) {
+            total = total.plus(new Point(chain(100), 0));
+        }
+    }
+    return total.x + total.y;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+
+def time_call(function, n, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(n)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--n', type=int, default=10_000_000, help='Loop iterations')
+    parser.add_argument('--runs', type=int, default=3, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    print(f"{'retains':<10}{'rc ops':>8}{'time':>12}{'per iteration':>16}")
+    counts = {}
+    for elide in (False, True):
+        compiler = Compiler(elide_retains=elide)
+        program = JIT(compiler=compiler, opt_level='2', use_cache=False).load(SOURCE)
+        counts[elide] = compiler.codegen.rc_operations
+        function = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+            program.engine.get_function_address('churn'))
+        best, _ = time_call(function, args.n, args.runs)
+        label = 'elided' if elide else 'all'
+        print(f"{label:<10}{counts[elide]:>8}{best * 1000:>10.1f}ms"
+              f"{best / args.n * 1e9:>14.2f}ns")
+    eliminated = counts[False] - counts[True]
+    print(f"{eliminated} of {counts[False]} retain/release calls eliminated "
+          f"({eliminated / counts[False]:.0%})")
+
+
+if __name__ == '__main__':
+    main()
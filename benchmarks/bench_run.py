@@ -0,0 +1,67 @@
+"""
+JIT run benchmark.
+
+Runs `speed run` in fresh interpreters against an empty compiled-code cache
+(cold) and against a populated one (cached), reporting the startup-to-main
+latency measured by the CLI and the wall time of the whole process.
+
+Usage: python -m benchmarks.bench_run [--functions N] [--runs N]
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def generate_source(functions):
+    parts = []
+    for i in range(functions):
+        parts.append(f"fn f{i}(a: int, b: int): int {{\n"
+                     f"    let c = a * b + {i};\n"
+                     f"    return c - a;\n"
+                     f"}}\n")
+    parts.append("fn main(): int {\n    return f0(1, 2);\n}\n")
+    return ''.join(parts)
+
+
+def run_once(source_file, cache_dir):
+    env = dict(os.environ, SPEED_CACHE_DIR=cache_dir)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-m', 'speed', 'run', '--time-phases', source_file],
+                            env=env, cwd=root, capture_output=True, text=True)
+    wall = time.perf_counter() - start
+    match = re.search(r'startup-to-main: ([\d.]+) ms', result.stderr)
+    if match is None:
+        raise RuntimeError(result.stderr)
+    return float(match.group(1)), wall * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--functions', type=int, default=200, help='Functions in the generated program')
+    parser.add_argument('--runs', type=int, default=5, help='Samples per scenario')
+    args = parser.parse_args(argv)
+
+    cold, cached = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        source_file = os.path.join(tmp, 'bench.speed')
+        with open(source_file, 'w') as f:
+            f.write(generate_source(args.functions))
+        for i in range(args.runs):
+            cache_dir = os.path.join(tmp, f'cache{i}')
+            cold.append(run_once(source_file, cache_dir))
+            cached.append(run_once(source_file, cache_dir))
+
+    print(f"program: {args.functions} functions")
+    print(f"{'scenario':<10}{'startup-to-main':>18}{'process wall':>16}")
+    for name, samples in (('cold', cold), ('cached', cached)):
+        print(f"{name:<10}{min(s[0] for s in samples):>16.2f}ms{min(s[1] for s in samples):>14.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
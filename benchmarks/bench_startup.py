@@ -0,0 +1,84 @@
+"""
+Compiler startup benchmark.
+
+Measures how long it takes to construct a Compiler and run the first compile
+in a fresh interpreter, both with an empty parser-table cache (cold) and with
+the tables already on disk (warm), plus the cost of constructing further
+Compilers inside an already-warm process.
+
+Usage: python -m benchmarks.bench_startup [--runs N]
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+SOURCE = """
+fn add(a: int, b: int): int {
+    return a + b;
+}
+"""
+
+# Executed in a child interpreter so that every sample starts from scratch.
+CHILD = """
+import json, logging, time, warnings
+warnings.simplefilter("ignore")
+t0 = time.perf_counter()
+from speed.compiler.compiler import Compiler
+logging.disable(logging.CRITICAL)
+t1 = time.perf_counter()
+compiler = Compiler()
+t2 = time.perf_counter()
+compiler.compile(%r)
+t3 = time.perf_counter()
+Compiler()
+t4 = time.perf_counter()
+Compiler().compile(%r)
+t5 = time.perf_counter()
+print(json.dumps({
+    "import": t1 - t0,
+    "construct": t2 - t1,
+    "first_compile": t3 - t2,
+    "construct_again": t4 - t3,
+    "compile_again": t5 - t4,
+}))
+""" % (SOURCE, SOURCE)
+
+
+def run_child(cache_home):
+    env = dict(os.environ, XDG_CACHE_HOME=cache_home)
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    out = subprocess.run([sys.executable, "-c", CHILD], env=env, cwd=root,
+                         check=True, capture_output=True, text=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def best(samples, key):
+    return min(sample[key] for sample in samples) * 1000.0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--runs', type=int, default=5, help='Samples per scenario')
+    args = parser.parse_args(argv)
+
+    cold, warm = [], []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as cache_home:
+            cold.append(run_child(cache_home))
+            warm.append(run_child(cache_home))
+
+    print(f"{'scenario':<12}{'Compiler()':>14}{'first compile':>16}{'next Compiler()':>18}{'next compile':>15}")
+    for name, samples in (("cold", cold), ("warm", warm)):
+        print(f"{name:<12}"
+              f"{best(samples, 'construct'):>12.2f}ms"
+              f"{best(samples, 'first_compile'):>14.2f}ms"
+              f"{best(samples, 'construct_again'):>16.2f}ms"
+              f"{best(samples, 'compile_again'):>13.2f}ms")
+
+
+if __name__ == '__main__':
+    main()
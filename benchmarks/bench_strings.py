@@ -0,0 +1,99 @@
+"""
+String building benchmark.
+
+JIT-compiles (at -O2) three ways of building one large string out of short
+pieces and times each for a target size: repeated `s = concat(s, piece)`,
+which copies everything built so far on every step, appending the pieces
+to a StringBuilder, and splitting a built string into the pieces (views into
+it) and joining them again. Concatenation is quadratic, so it is only run up
+to --concat-kb and its time for the full size is extrapolated.
+
+Usage: python -m benchmarks.bench_strings [--mb N] [--concat-kb N] [--runs N]
+"""
+
+import argparse
+import ctypes
+import time
+import warnings
+
+warnings.simplefilter("ignore")
+
+from speed.compiler.jit import JIT
+
+PIECE = "2024-01-01 12:00:00 INFO request served in 12 ms;"
+
+SOURCE = """
+import { length, concat, split, join, builder, append, finish } from "string"
+
+public fn by_concat(pieces: int): int {
+    let text = "";
+    for (let i = 0; i < pieces; i = i + 1) {
+        text = concat(text, "%(piece)s");
+    }
+    return length(text);
+}
+
+public fn by_builder(pieces: int): int {
+    let sb = builder();
+    for (let i = 0; i < pieces; i = i + 1) {
+        append(sb, "%(piece)s");
+    }
+    return length(finish(sb));
+}
+
+public fn by_join(pieces: int): int {
+    let sb = builder();
+    for (let i = 0; i < pieces; i = i + 1) {
+        append(sb, "%(piece)s");
+    }
+    let records = split(finish(sb), ";");
+    return length(join(records, ";"));
+}
+
+fn main(): int {
+    return 0;
+}
+""" % {'piece': PIECE}
+
+PIECE_SIZE = len(PIECE)
+
+
+def time_call(function, pieces, runs):
+    best = float('inf')
+    for _ in range(runs):
+        start = time.perf_counter()
+        size = function(pieces)
+        best = min(best, time.perf_counter() - start)
+    return best, size
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--mb', type=int, default=100, help='Size of the string to build, in MB')
+    parser.add_argument('--concat-kb', type=int, default=256,
+                        help='Largest string built by repeated concat, in KB')
+    parser.add_argument('--runs', type=int, default=3, help='Samples to take the best of')
+    args = parser.parse_args(argv)
+
+    program = JIT(opt_level='2', use_cache=False).load(SOURCE)
+    functions = {
+        name: ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64)(
+            program.engine.get_function_address(name))
+        for name in ('by_concat', 'by_builder', 'by_join')
+    }
+    pieces = args.mb * 1_000_000 // PIECE_SIZE
+    concat_pieces = args.concat_kb * 1000 // PIECE_SIZE
+
+    print(f"{'method':<12}{'size':>12}{'time':>14}{'per byte':>12}")
+    best, size = time_call(functions['by_concat'], concat_pieces, 1)
+    print(f"{'concat':<12}{size:>12}{best * 1000:>12.1f}ms{best / size * 1e9:>10.2f}ns")
+    # Each step copies the whole string so far: time grows with the square
+    estimate = best * (pieces / concat_pieces) ** 2
+    print(f"{'concat':<12}{pieces * PIECE_SIZE:>12}{estimate:>13.0f}s  (extrapolated)")
+    for name in ('by_builder', 'by_join'):
+        best, size = time_call(functions[name], pieces, args.runs)
+        print(f"{name[3:]:<12}{size:>12}{best * 1000:>12.1f}ms{best / size * 1e9:>10.2f}ns")
+
+
+if __name__ == '__main__':
+    main()
@@ -5,7 +5,7 @@ setup(
     version="0.1.0",
     packages=find_packages(),
     install_requires=[
-        "llvmlite>=0.39.0",
+        "llvmlite>=0.50.0",
         "rply>=0.7.8",
     ],
     extras_require={
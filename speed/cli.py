@@ -1,15 +1,83 @@
 import argparse
 import sys
-from .compiler.compiler import Compiler
+import time
+from .compiler.compiler import Compiler, CompileStats
+from .compiler.backend import OPT_LEVELS
+
+def run_main(argv):
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(prog='speed run', description='JIT-compile and run a Speed program')
+    parser.add_argument('input_file', help='Input Speed source file')
+    parser.add_argument('-O', dest='opt_level', choices=OPT_LEVELS, default='2', help='Optimization level (default: 2)')
+    parser.add_argument('--no-cache', action='store_true', help='Do not read or write the compiled-code cache')
+    parser.add_argument('--time-phases', action='store_true', help='Report per-phase times and startup-to-main latency on stderr')
+    args = parser.parse_args(argv)
+
+    try:
+        with open(args.input_file, 'r') as f:
+            source_code = f.read()
+    except FileNotFoundError:
+        print(f"Error: Could not find input file '{args.input_file}'", file=sys.stderr)
+        return 1
+
+    from .compiler.jit import JIT
+    stats = CompileStats() if args.time_phases else None
+    try:
+        program = JIT(opt_level=args.opt_level, use_cache=not args.no_cache).load(source_code, stats=stats)
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+
+    if stats:
+        print(stats.format(), file=sys.stderr)
+        print(f"startup-to-main: {(time.perf_counter() - start) * 1000:.3f} ms", file=sys.stderr)
+    return program.run()
+
+def build_main(argv):
+    start = time.perf_counter()
+    parser = argparse.ArgumentParser(prog='speed build', description='Compile a multi-file Speed program in parallel')
+    parser.add_argument('inputs', nargs='+', help='Speed source files or directories containing them')
+    parser.add_argument('-o', '--output', help='Output file (default: a.out, or a.o with --object)')
+    parser.add_argument('--object', action='store_true', help='Generate one linked object file instead of an executable')
+    parser.add_argument('-O', dest='opt_level', choices=OPT_LEVELS, default='0', help='Optimization level (default: 0)')
+    parser.add_argument('-j', '--jobs', type=int, default=None, help='Worker processes (default: number of CPUs)')
+    args = parser.parse_args(argv)
+
+    from .compiler.build import Build, format_timings
+    output_file = args.output or ('a.o' if args.object else 'a.out')
+    try:
+        build = Build(opt_level=args.opt_level, jobs=args.jobs)
+        if args.object:
+            units = build.write_object(args.inputs, output_file)
+        else:
+            units = build.write_executable(args.inputs, output_file)
+    except Exception as e:
+        print(f"Error: {str(e)}", file=sys.stderr)
+        return 1
+
+    print(format_timings(units, build.link_time, time.perf_counter() - start))
+    print(f"Successfully built {len(units)} files to '{output_file}'")
+    return 0
+
+def main(argv=None):
+    if argv is None:
+        argv = sys.argv[1:]
+    if argv and argv[0] == 'run':
+        return run_main(argv[1:])
+    if argv and argv[0] == 'build':
+        return build_main(argv[1:])
 
-def main():
     parser = argparse.ArgumentParser(description='Speed Programming Language Compiler')
     parser.add_argument('input_file', help='Input Speed source file')
     parser.add_argument('-o', '--output', help='Output file (default: input.ll)')
     parser.add_argument('--object', action='store_true', help='Generate object file instead of LLVM IR')
+    parser.add_argument('--executable', action='store_true', help='Generate a native executable (links with the system C compiler)')
+    parser.add_argument('-O', dest='opt_level', choices=OPT_LEVELS, default='0', help='Optimization level (default: 0)')
+    parser.add_argument('--incremental', action='store_true', help='Reuse cached IR for unchanged top-level declarations')
+    parser.add_argument('--time-phases', action='store_true', help='Report per-phase compile time and IR size on stderr')
     parser.add_argument('--version', action='version', version='Speed 0.1.0')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
     
     # Read input file
     try:
@@ -23,20 +91,31 @@ def main():
     if args.output:
         output_file = args.output
     else:
-        output_file = args.input_file.rsplit('.', 1)[0] + '.ll'
+        stem = args.input_file.rsplit('.', 1)[0]
+        if args.executable:
+            output_file = stem
+        elif args.object:
+            output_file = stem + '.o'
+        else:
+            output_file = stem + '.ll'
     
     # Create compiler
-    compiler = Compiler()
+    compiler = Compiler(incremental=args.incremental)
     
     try:
-        if args.object:
-            compiler.compile_to_object(source_code, output_file)
+        if args.executable:
+            compile_output = compiler.compile_to_executable
+        elif args.object:
+            compile_output = compiler.compile_to_object
         else:
-            compiler.compile_to_file(source_code, output_file)
+            compile_output = compiler.compile_to_file
+        result = compile_output(source_code, output_file, stats=args.time_phases, opt_level=args.opt_level)
+        if args.time_phases:
+            print(result[1].format(), file=sys.stderr)
         print(f"Successfully compiled '{args.input_file}' to '{output_file}'")
     except Exception as e:
         print(f"Error: {str(e)}", file=sys.stderr)
         sys.exit(1)
 
 if __name__ == '__main__':
-    main() 
\ No newline at end of file
+    sys.exit(main()) 
\ No newline at end of file
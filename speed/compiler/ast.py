@@ -1,100 +1,288 @@
 class Node:
-    pass
+    # Nodes are slotted: large programs have hundreds of thousands of them,
+    # and a per-instance __dict__ would be most of the AST's memory.
+    # The source span is a character offset plus a length rather than two
+    # offsets: the start is the int object the token already had, and most
+    # lengths are small enough to be shared small ints, so a span costs
+    # no allocations. Nodes built by hand have no span.
+    __slots__ = ('start', 'length')
+    # Slots that annotate a node rather than hold a child; they start as None
+    _attributes = ('start', 'length')
+    _fields = ()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Child fields in declaration order, for walk() and visitors
+        cls._fields = cls.__mro__[1]._fields + tuple(
+            name for name in cls.__dict__.get('__slots__', ()) if name not in cls._attributes)
+
+    def __new__(cls, *args, **kwargs):
+        node = object.__new__(cls)
+        for name in cls._attributes:
+            setattr(node, name, None)
+        return node
+
+    @property
+    def end(self):
+        if self.start is None:
+            return None
+        return self.start + self.length
+
+    @property
+    def span(self):
+        return self.start, self.end
 
 class Program(Node):
+    __slots__ = ('statements',)
+
     def __init__(self, statements):
         self.statements = statements
 
 class Statement(Node):
-    pass
+    __slots__ = ()
 
 class Expression(Node):
-    pass
+    # The type name the type checker inferred, e.g. 'int' or 'float'
+    __slots__ = ('type',)
+    _attributes = Node._attributes + ('type',)
 
 class Type(Node):
+    __slots__ = ('name',)
+
     def __init__(self, name):
         self.name = name
 
 class Parameter(Node):
+    # borrowed: set by RetainElider when the object passed in needs no
+    # reference of the function's own
+    __slots__ = ('name', 'type', 'borrowed')
+    _attributes = Node._attributes + ('borrowed',)
+
     def __init__(self, name, type):
         self.name = name
         self.type = type
 
 class FunctionDeclaration(Statement):
-    def __init__(self, name, parameters, return_type, body):
+    __slots__ = ('name', 'parameters', 'return_type', 'body', 'attributes', 'public', 'is_async')
+
+    def __init__(self, name, parameters, return_type, body, attributes=None, public=False,
+                 is_async=False):
         self.name = name
         self.parameters = parameters
         self.return_type = return_type
         self.body = body
+        self.attributes = attributes or []
+        # Public functions (and main) are visible outside their module
+        self.public = public
+        # An async fn returns a task for its return type straight away
+        self.is_async = is_async
 
 class ClassDeclaration(Statement):
+    __slots__ = ('name', 'members')
+
     def __init__(self, name, members):
         self.name = name
         self.members = members
 
 class VariableDeclaration(Statement):
+    # borrowed: set by RetainElider when the variable only ever names an
+    # object another variable keeps alive, and by EscapeAnalysis when it
+    # names an object on the stack
+    __slots__ = ('name', 'type', 'initializer', 'borrowed')
+    _attributes = Node._attributes + ('borrowed',)
+
     def __init__(self, name, type, initializer):
         self.name = name
         self.type = type
         self.initializer = initializer
 
 class ReturnStatement(Statement):
+    __slots__ = ('expression',)
+
     def __init__(self, expression):
         self.expression = expression
 
 class IfStatement(Statement):
+    __slots__ = ('condition', 'then_branch', 'else_branch')
+
     def __init__(self, condition, then_branch, else_branch=None):
         self.condition = condition
         self.then_branch = then_branch
         self.else_branch = else_branch
 
 class WhileStatement(Statement):
-    def __init__(self, condition, body):
+    __slots__ = ('condition', 'body', 'attributes')
+
+    def __init__(self, condition, body, attributes=None):
         self.condition = condition
         self.body = body
+        self.attributes = attributes or []
 
 class ForStatement(Statement):
-    def __init__(self, initializer, condition, increment, body):
+    __slots__ = ('initializer', 'condition', 'increment', 'body', 'attributes')
+
+    def __init__(self, initializer, condition, increment, body, attributes=None):
         self.initializer = initializer
         self.condition = condition
         self.increment = increment
         self.body = body
+        self.attributes = attributes or []
+
+class ArenaStatement(Statement):
+    # arena { ... }: objects made with `new` while it runs are freed together
+    # when it is left
+    __slots__ = ('body',)
+
+    def __init__(self, body):
+        self.body = body
+
+class Attribute(Node):
+    # #[name] or #[name(arguments)] in front of a declaration or loop
+    __slots__ = ('name', 'arguments')
+
+    def __init__(self, name, arguments=None):
+        self.name = name
+        self.arguments = arguments or []
 
 class Literal(Expression):
+    __slots__ = ('value',)
+
     def __init__(self, value):
         self.value = value
 
 class BinaryOp(Expression):
+    __slots__ = ('op', 'left', 'right')
+
     def __init__(self, op, left, right):
         self.op = op
         self.left = left
         self.right = right
 
 class UnaryOp(Expression):
+    __slots__ = ('op', 'operand')
+
     def __init__(self, op, operand):
         self.op = op
         self.operand = operand
 
 class Call(Expression):
+    __slots__ = ('function', 'arguments')
+
     def __init__(self, function, arguments):
         self.function = function
         self.arguments = arguments
 
 class Identifier(Expression):
+    # borrowed: set by RetainElider when the variable keeps the object alive
+    # through the call it is an argument of, and by EscapeAnalysis when the
+    # object is on the stack
+    __slots__ = ('name', 'borrowed')
+    _attributes = Expression._attributes + ('borrowed',)
+
     def __init__(self, name):
         self.name = name
 
 class Assignment(Expression):
+    __slots__ = ('name', 'value')
+
     def __init__(self, name, value):
         self.name = name
         self.value = value
 
+class Cast(Expression):
+    # A numeric conversion the type checker made explicit
+    __slots__ = ('expression',)
+
+    def __init__(self, expression, type):
+        self.expression = expression
+        self.type = type
+
+class Index(Expression):
+    # array[index]
+    __slots__ = ('array', 'index')
+
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+class IndexAssignment(Expression):
+    # array[index] = value
+    __slots__ = ('array', 'index', 'value')
+
+    def __init__(self, array, index, value):
+        self.array = array
+        self.index = index
+        self.value = value
+
 class ImportStatement(Statement):
+    __slots__ = ('imports', 'module')
+
     def __init__(self, imports, module):
         self.imports = imports
         self.module = module
 
 class MemberAccess(Expression):
+    __slots__ = ('object_name', 'member_name')
+
     def __init__(self, object_name, member_name):
         self.object_name = object_name
-        self.member_name = member_name 
\ No newline at end of file
+        self.member_name = member_name
+
+class MemberAssignment(Expression):
+    # object.member = value
+    __slots__ = ('object_name', 'member_name', 'value')
+
+    def __init__(self, object_name, member_name, value):
+        self.object_name = object_name
+        self.member_name = member_name
+        self.value = value
+
+class NewExpression(Expression):
+    # new ClassName(arguments)
+    # stack: set by EscapeAnalysis when the object never outlives the
+    # function that makes it
+    __slots__ = ('class_name', 'arguments', 'stack')
+    _attributes = Expression._attributes + ('stack',)
+
+    def __init__(self, class_name, arguments):
+        self.class_name = class_name
+        self.arguments = arguments
+
+class AwaitExpression(Expression):
+    # await task: the task's result, once it is done
+    __slots__ = ('expression',)
+
+    def __init__(self, expression):
+        self.expression = expression
+
+def method_name(class_name, method):
+    """The function a class's method is compiled to."""
+    return f"{class_name}_{method}"
+
+def children(node):
+    """The values of a node's fields, in declaration order."""
+    return [getattr(node, field) for field in node._fields]
+
+def clone(node):
+    """A deep copy of a node and everything below it, spans and types included."""
+    if isinstance(node, list):
+        return [clone(item) for item in node]
+    if not isinstance(node, Node):
+        return node
+    copy = object.__new__(type(node))
+    for name in node._attributes:
+        setattr(copy, name, getattr(node, name))
+    for name in node._fields:
+        setattr(copy, name, clone(getattr(node, name)))
+    return copy
+
+def walk(node):
+    """Yield node and every Node reachable through its fields, depth first."""
+    stack = [node]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, list):
+            stack.extend(reversed(current))
+        elif isinstance(current, Node):
+            yield current
+            stack.extend(reversed(children(current)))
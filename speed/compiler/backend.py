@@ -0,0 +1,140 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import llvmlite.binding as llvm
+
+# Optimization levels accepted by -O: the usual 0-3 plus 's' (optimize for size)
+OPT_LEVELS = ('0', '1', '2', '3', 's')
+
+_initialized = False
+
+def initialize():
+    global _initialized
+    if _initialized:
+        return
+    try:
+        llvm.initialize()
+    except RuntimeError:
+        # Newer llvmlite initialises the core itself and raises here
+        pass
+    llvm.initialize_native_target()
+    llvm.initialize_native_asmprinter()
+    _initialized = True
+
+def find_linker():
+    """Return the system C compiler driver used to link executables, or None."""
+    candidates = [os.environ['CC']] if os.environ.get('CC') else []
+    candidates += ['cc', 'clang', 'gcc']
+    for candidate in candidates:
+        path = shutil.which(candidate)
+        if path:
+            return path
+    return None
+
+def uses_coroutines(llvm_module):
+    """Whether a module has coroutines, which only the pass pipeline lowers."""
+    return any(function.name == 'llvm.coro.begin' for function in llvm_module.functions)
+
+class Backend:
+    """Verifies, optimizes and lowers an llvmlite IR module to native code."""
+
+    def __init__(self, opt_level='0', jit=False):
+        opt_level = str(opt_level)
+        if opt_level not in OPT_LEVELS:
+            raise ValueError(f"Unknown optimization level: {opt_level}")
+        self.opt_level = opt_level
+        initialize()
+
+        codegen_level = 2 if opt_level == 's' else int(opt_level)
+        target = llvm.Target.from_default_triple()
+        if jit:
+            # Code for the in-process JIT may use every feature of this CPU
+            self.target_machine = target.create_target_machine(
+                cpu=llvm.get_host_cpu_name(),
+                features=llvm.get_host_cpu_features().flatten(),
+                opt=codegen_level,
+                jit=True,
+            )
+        else:
+            self.target_machine = target.create_target_machine(opt=codegen_level, reloc='pic')
+
+    def parse(self, module):
+        """Parse and verify an llvmlite.ir module, retargeted to the host."""
+        try:
+            llvm_module = llvm.parse_assembly(str(module))
+            llvm_module.verify()
+        except RuntimeError as e:
+            raise ValueError(f"Invalid LLVM IR: {e}") from e
+        llvm_module.triple = self.target_machine.triple
+        llvm_module.data_layout = str(self.target_machine.target_data)
+        return llvm_module
+
+    def pipeline_options(self):
+        if self.opt_level == 's':
+            # The new pass manager bindings only take a speed level, so -Os is
+            # -O2 without the size-increasing loop transforms and with the
+            # inline threshold clang uses for -Os.
+            pto = llvm.create_pipeline_tuning_options(speed_level=2)
+            pto.loop_unrolling = False
+            pto.loop_vectorization = False
+            pto.slp_vectorization = False
+            pto.inlining_threshold = 75
+            return pto
+        return llvm.create_pipeline_tuning_options(speed_level=int(self.opt_level))
+
+    def promote(self, llvm_module):
+        """Inline #[inline] functions, then promote entry-block allocas to SSA
+        registers (SROA, which subsumes mem2reg)."""
+        pass_builder = llvm.create_pass_builder(
+            self.target_machine, llvm.create_pipeline_tuning_options(speed_level=0))
+        pass_manager = llvm.create_new_module_pass_manager()
+        # alwaysinline is honoured at -O0 too, as clang does
+        pass_manager.add_always_inliner_pass()
+        pass_manager.add_sroa_pass()
+        pass_manager.run(llvm_module, pass_builder)
+        return llvm_module
+
+    def optimize(self, llvm_module):
+        """Run the default module pipeline for this optimization level in place.
+
+        Locals are promoted to registers at every level, -O0 included: codegen
+        keeps each of them in a stack slot, and leaving them there only makes
+        the generated code slower without making it any easier to debug.
+        A module with async fns always goes through the pipeline, which is
+        what splits coroutines into the functions that run them.
+        """
+        self.promote(llvm_module)
+        if self.opt_level == '0' and not uses_coroutines(llvm_module):
+            return llvm_module
+        pass_builder = llvm.create_pass_builder(self.target_machine, self.pipeline_options())
+        pass_builder.getModulePassManager().run(llvm_module, pass_builder)
+        return llvm_module
+
+    def compile(self, module):
+        return self.optimize(self.parse(module))
+
+    def emit_object(self, llvm_module):
+        return self.target_machine.emit_object(llvm_module)
+
+    def write_object(self, llvm_module, output_file):
+        with open(output_file, 'wb') as f:
+            f.write(self.emit_object(llvm_module))
+        return output_file
+
+    def link(self, object_files, output_file, libraries=('m',)):
+        """Link object files into an executable with the system linker."""
+        linker = find_linker()
+        if linker is None:
+            raise RuntimeError("No system linker found (set CC to a C compiler driver)")
+        command = [linker, '-o', output_file, *object_files]
+        command += [f'-l{lib}' for lib in libraries]
+        result = subprocess.run(command, capture_output=True, text=True)
+        if result.returncode != 0:
+            raise RuntimeError(f"Linking failed: {result.stderr.strip()}")
+        return output_file
+
+    def write_executable(self, llvm_module, output_file):
+        with tempfile.TemporaryDirectory() as tmp:
+            object_file = self.write_object(llvm_module, os.path.join(tmp, 'module.o'))
+            return self.link([object_file], output_file)
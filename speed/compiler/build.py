@@ -0,0 +1,174 @@
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+import llvmlite.binding as llvm
+from .backend import Backend
+from .incremental import declaration_from_signature, function_signature, split_top_level
+
+SOURCE_SUFFIX = '.speed'
+# A top-level statement that starts, after any comments, with public
+_PUBLIC = re.compile(r'(?:\s|//[^\n]*|/\*[\s\S]*?\*/)*public\b')
+
+# Per-process state of build workers, set up once by _init_worker
+_worker = {}
+
+def collect_sources(paths):
+    """Expand directories into the .speed files below them, in a stable order."""
+    sources = []
+    for path in paths:
+        if os.path.isdir(path):
+            found = []
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                found += [os.path.join(root, name) for name in files if name.endswith(SOURCE_SUFFIX)]
+            sources += sorted(found)
+        elif os.path.exists(path):
+            sources.append(path)
+        else:
+            raise ValueError(f"Could not find input file '{path}'")
+    if not sources:
+        raise ValueError("No Speed source files to build")
+    return sources
+
+class BuildUnit:
+    """One translation unit compiled by a worker: its bitcode and phase times."""
+
+    def __init__(self, path, bitcode, times):
+        self.path = path
+        self.bitcode = bitcode
+        self.times = times
+
+    @property
+    def total(self):
+        return sum(self.times.values())
+
+def _init_worker(lexer_backend, opt_level):
+    from .compiler import Compiler
+    compiler = Compiler(lexer_backend)
+    # Build the parser tables now rather than inside the first unit's timing
+    compiler.parser.get_parser()
+    _worker['compiler'] = compiler
+    _worker['backend'] = Backend(opt_level)
+
+def _declare_unit(path):
+    """The signatures of the public functions a file defines. Only their
+    statements are parsed; the rest of the file waits for _compile_unit."""
+    compiler = _worker['compiler']
+    signatures = []
+    try:
+        with open(path, 'r') as f:
+            source_code = f.read()
+        for chunk in split_top_level(source_code):
+            if _PUBLIC.match(chunk):
+                tokens = compiler.lexer.get_lexer().lex(chunk)
+                program = compiler.parser.get_parser().parse(tokens)
+                signatures += [function_signature(node) for node in program.statements]
+    except Exception as e:
+        raise ValueError(f"{path}: {e}") from None
+    return signatures
+
+def _compile_unit(path, externs=()):
+    from .compiler import CompileStats
+    compiler = _worker['compiler']
+    backend = _worker['backend']
+    stats = CompileStats()
+    try:
+        with open(path, 'r') as f:
+            source_code = f.read()
+        # Each unit's module is named after its file
+        compiler.module_name = path
+        module, _ = compiler.compile(source_code, stats=stats,
+                                     externs=[declaration_from_signature(signature)
+                                              for signature in externs])
+        with stats.phase('optimize'):
+            llvm_module = backend.compile(module)
+    except Exception as e:
+        # Exceptions cross the process boundary pickled, so keep them plain
+        raise ValueError(f"{path}: {e}") from None
+    return BuildUnit(path, llvm_module.as_bitcode(), stats.times)
+
+class Build:
+    """Compiles a multi-file program in parallel and links it into one module.
+
+    Every file is a translation unit of its own: lexing, parsing, codegen and
+    the per-unit optimization pipeline run in a pool of worker processes, each
+    holding a warm Compiler, and the resulting bitcode is linked in the
+    parent. A first pass over the files collects the signatures of their
+    public functions, which every other unit is compiled against, so units
+    may call the public functions of any file as well as their own and the
+    standard library's; a function defined by more than one unit is a link
+    error.
+    """
+
+    def __init__(self, opt_level='0', jobs=None, lexer_backend='regex'):
+        self.backend = Backend(opt_level)
+        self.jobs = jobs or os.cpu_count() or 1
+        self.lexer_backend = lexer_backend
+        self.link_time = 0.0
+
+    def compile_units(self, paths):
+        """Compile every path to a BuildUnit, in the order given."""
+        initargs = (self.lexer_backend, self.backend.opt_level)
+        if self.jobs == 1 or len(paths) == 1:
+            _init_worker(*initargs)
+            externs = _externs(paths, [_declare_unit(path) for path in paths])
+            return [_compile_unit(path, declared) for path, declared in zip(paths, externs)]
+        with ProcessPoolExecutor(max_workers=min(self.jobs, len(paths)),
+                                 initializer=_init_worker, initargs=initargs) as pool:
+            externs = _externs(paths, list(pool.map(_declare_unit, paths)))
+            return list(pool.map(_compile_unit, paths, externs))
+
+    def link(self, units):
+        """Link the units' bitcode into a single verified llvmlite module."""
+        start = time.perf_counter()
+        linked = None
+        for unit in units:
+            llvm_module = llvm.parse_bitcode(unit.bitcode)
+            if linked is None:
+                linked = llvm_module
+                continue
+            try:
+                linked.link_in(llvm_module)
+            except RuntimeError as e:
+                raise ValueError(f"{unit.path}: {e}") from e
+        linked.verify()
+        self.link_time = time.perf_counter() - start
+        return linked
+
+    def build(self, paths):
+        units = self.compile_units(collect_sources(paths))
+        return units, self.link(units)
+
+    def write_object(self, paths, output_file):
+        units, linked = self.build(paths)
+        self.backend.write_object(linked, output_file)
+        return units
+
+    def write_executable(self, paths, output_file):
+        units, linked = self.build(paths)
+        self.backend.write_executable(linked, output_file)
+        return units
+
+def _externs(paths, signatures):
+    """For each path, the public signatures of all the other files."""
+    return [
+        [signature for other, declared in zip(paths, signatures) if other != path
+         for signature in declared]
+        for path in paths
+    ]
+
+def format_timings(units, link_time=0.0, wall_time=None):
+    """Per-file phase times of a build as a table."""
+    phases = ('lex', 'parse', 'codegen', 'optimize')
+    width = max([len('file')] + [len(unit.path) for unit in units])
+    lines = [f"{'file':<{width}}" + ''.join(f"{name:>11}" for name in phases) + f"{'total':>11}"]
+    for unit in units:
+        row = ''.join(f"{unit.times.get(name, 0.0) * 1000:>9.3f}ms" for name in phases)
+        lines.append(f"{unit.path:<{width}}{row}{unit.total * 1000:>9.3f}ms")
+    cpu_time = sum(unit.total for unit in units)
+    lines.append(f"units: {len(units)}  compile (sum): {cpu_time * 1000:.3f} ms  "
+                 f"link: {link_time * 1000:.3f} ms")
+    if wall_time is not None:
+        lines.append(f"wall: {wall_time * 1000:.3f} ms")
+    return '\n'.join(lines)
@@ -0,0 +1,48 @@
+import hashlib
+import os
+
+_fingerprint = None
+
+def cache_dir(*parts):
+    """Return (and create) a directory under the Speed cache root.
+
+    The root is $SPEED_CACHE_DIR if set, otherwise speed/ under the XDG user
+    cache directory.
+    """
+    root = os.environ.get('SPEED_CACHE_DIR')
+    if not root:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+        root = os.path.join(base, 'speed')
+    path = os.path.join(root, *parts)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+def compiler_fingerprint():
+    """Hash of the compiler and stdlib sources, so caches die with the compiler."""
+    global _fingerprint
+    if _fingerprint is None:
+        package_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        hasher = hashlib.sha256()
+        for subdir in ('compiler', 'stdlib'):
+            directory = os.path.join(package_dir, subdir)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.py'):
+                    hasher.update(name.encode())
+                    with open(os.path.join(directory, name), 'rb') as f:
+                        hasher.update(f.read())
+        _fingerprint = hasher.hexdigest()
+    return _fingerprint
+
+def cache_key(*parts):
+    hasher = hashlib.sha256(compiler_fingerprint().encode())
+    for part in parts:
+        hasher.update(b'\0')
+        hasher.update(part.encode() if isinstance(part, str) else part)
+    return hasher.hexdigest()
+
+def write_atomic(path, data):
+    """Write bytes to path via a rename so readers never see a partial file."""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
@@ -1,28 +1,107 @@
 from llvmlite import ir
 from .ast import *
-import logging
+from .optimizer import EscapeAnalysis, RetainElider
+from .visitor import NodeVisitor
+from ..stdlib.io import IO_BODIES, IO_FUNCTIONS
+from ..stdlib.math import MATH_BODIES, MATH_CONSTANTS, MATH_FUNCTIONS
+from ..stdlib.memory import alloc, arena_enter, arena_exit, rc_release, rc_retain
+from ..stdlib.net import NET_BODIES, NET_FUNCTIONS
+from ..stdlib.runtime import BYTES, VIEW
+from ..stdlib.string import STRING_BODIES, STRING_BUILDER, STRING_FUNCTIONS
+from ..stdlib.tasks import TASK_GROUP, TASKS_BODIES, TASKS_FUNCTIONS, Coroutine, await_task, detach
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+# IRBuilder methods for the arithmetic operators, by operand kind
+INT_OPS = {'+': 'add', '-': 'sub', '*': 'mul', '/': 'sdiv', '%': 'srem'}
+FLOAT_OPS = {'+': 'fadd', '-': 'fsub', '*': 'fmul', '/': 'fdiv', '%': 'frem'}
+COMPARISON_OPS = frozenset(['==', '!=', '<', '>', '<=', '>='])
 
-class CodeGenerator:
-    def __init__(self, module_name="speed_module"):
-        logger.debug(f"Initializing code generator with module name: {module_name}")
-        self.module = ir.Module(name=module_name)
+# LLVM function attributes for #[...] hints on fn
+FUNCTION_ATTRIBUTES = {'inline': 'alwaysinline', 'noinline': 'noinline'}
+
+# Standard library functions by module: the name a program imports maps to
+# its overloads, each the symbol it is declared as, its return type and its
+# parameter types
+STDLIB_FUNCTIONS = {
+    'io': IO_FUNCTIONS,
+    'math': MATH_FUNCTIONS,
+    'string': STRING_FUNCTIONS,
+    'tasks': TASKS_FUNCTIONS,
+    'net': NET_FUNCTIONS,
+}
+
+# Standard library functions whose bodies are generated into every module
+# that calls them, by symbol; everything else is declared and linked
+STDLIB_BODIES = {**IO_BODIES, **MATH_BODIES, **STRING_BODIES, **TASKS_BODIES, **NET_BODIES}
+
+# Standard library float constants by module, inlined at every use
+STDLIB_CONSTANTS = {
+    'math': MATH_CONSTANTS,
+}
+
+# Expressions whose object comes with a reference the receiver takes over;
+# any other object value is borrowed from where it is stored
+OWNING_EXPRESSIONS = (NewExpression, Call, AwaitExpression)
+
+class CodeGenerator(NodeVisitor):
+    """Generates an LLVM module from a checked AST.
+
+    Objects are reference counted. Every variable and field holding an
+    object owns a reference: storing one takes a new reference (the one a
+    `new` or a call returned, or a retain), and the reference it replaces
+    is released, as are a function's variables when it returns. An object
+    passed to a call is retained until the end of the statement, and so
+    are objects a statement makes and does not store. With elide_retains,
+    RetainElider first marks the variables and arguments whose object is
+    kept alive anyway, and they are not counted.
+
+    With stack_objects, objects EscapeAnalysis shows do not outlive the
+    function making them are allocated in its stack frame instead, with a
+    count of 0, and are not counted at all.
+
+    An async fn is an LLVM coroutine: a call runs it until it first has to
+    wait and returns its task, the coroutine's handle. Awaiting a task in
+    an async fn suspends the caller until the task is done; anywhere else
+    the event loop runs until it is.
+    """
+
+    def __init__(self, module_name="speed_module", elide_retains=True, stack_objects=True):
+        # Each module gets its own context so identified struct types from
+        # one compilation never clash with those of another
+        self.module = ir.Module(name=module_name, context=ir.Context())
         self.builder = None
         self.function = None
+        self.last_alloca = None  # Where the next entry-block alloca goes
         self.variables = {}  # Store variable allocations
-        self.strings = []  # Store string constants
+        self.imports = {}  # Imported name -> its stdlib overloads
+        self.constants = {}  # Imported name -> stdlib constant
+        self.strings = {}  # String constants, interned by content
+        self.reassociate = 0  # Depth of enclosing #[vectorize] loops
+        self.fields = {}  # Class struct name -> [(field, type name)], in struct order
+        self.arenas = []  # (mark, locals before it) of the arena blocks being generated
+        self.elide_retains = elide_retains
+        self.stack_objects = stack_objects
+        self.locals = []  # (alloca, class) of the variables to release on return
+        self.object_allocas = []  # Allocas of object variables, null until assigned
+        self.temporaries = []  # (object, class) to release at the end of the statement
+        self.coroutine = None  # The Coroutine of the async fn being generated
+        self.rc_operations = 0  # Retains and releases generated
+        self.stack_allocated = 0  # `new`s given a stack slot instead of the heap
         
         # Define types
         self.types = {
-            'int': ir.IntType(32),
+            'int': ir.IntType(64),
             'float': ir.DoubleType(),
             'bool': ir.IntType(1),
             'void': ir.VoidType(),
-            'string': ir.PointerType(ir.IntType(8))
+            # Text, as its UTF-8 data and length in bytes; not NUL-terminated
+            'string': VIEW,
+            # A read-only (data, length) view of raw bytes, such as a mapped file
+            'bytes': VIEW,
+            'StringBuilder': STRING_BUILDER.as_pointer(),
+            'TaskGroup': TASK_GROUP.as_pointer(),
+            # Any task, as the tasks module takes them
+            'task': BYTES,
         }
-        logger.debug("Types defined")
 
     def get_llvm_type(self, type_node):
         if isinstance(type_node, str):
@@ -32,251 +111,681 @@ class CodeGenerator:
         
         if type_name in self.types:
             return self.types[type_name]
+        elif type_name.endswith('[]'):
+            # Arrays are passed around as a (data, length) pair
+            element = self.get_llvm_type(type_name[:-2])
+            return ir.LiteralStructType([element.as_pointer(), ir.IntType(64)])
+        elif type_name.startswith('task<'):
+            # A task is its coroutine's handle, whatever its result
+            return self.types['task']
         else:
-            # For user-defined types (classes), create a struct type
-            struct_type = ir.global_context.get_identified_type(type_name)
-            if not struct_type.is_literal:
-                # Define the struct fields if not already defined
-                field_types = []  # This should be populated based on class definition
-                struct_type.set_body(*field_types)
-            return struct_type
+            # Objects of a class are pointers to its struct, which gets its
+            # body when the class is declared
+            return self.class_struct(type_name).as_pointer()
+
+    def class_struct(self, class_name):
+        return self.module.context.get_identified_type(f"struct.{class_name}")
 
     def get_llvm_type_from_value(self, value):
-        if isinstance(value, int):
-            return ir.IntType(32)
+        # bool is a subclass of int, so it has to be checked first
+        if isinstance(value, bool):
+            return ir.IntType(1)
+        elif isinstance(value, int):
+            return self.types['int']
         elif isinstance(value, float):
             return ir.DoubleType()
-        elif isinstance(value, bool):
-            return ir.IntType(1)
         elif isinstance(value, str):
             return ir.ArrayType(ir.IntType(8), len(value) + 1)
         else:
             raise ValueError(f"Unsupported literal type: {type(value)}")
 
     def generate(self, node):
-        logger.debug(f"Generating code for node type: {type(node)}")
-        if isinstance(node, Program):
-            logger.debug("Generating program")
-            for stmt in node.statements:
-                self.generate(stmt)
-            return self.module
-        elif isinstance(node, FunctionDeclaration):
-            logger.debug(f"Generating function: {node.name}")
-            return self.generate_function(node)
-        elif isinstance(node, ReturnStatement):
-            logger.debug("Generating return statement")
-            return self.generate_return(node)
-        elif isinstance(node, VariableDeclaration):
-            logger.debug(f"Generating variable declaration: {node.name}")
-            return self.generate_variable_declaration(node)
-        elif isinstance(node, ClassDeclaration):
-            logger.debug(f"Generating class declaration: {node.name}")
-            return self.generate_class_declaration(node)
-        elif isinstance(node, ImportStatement):
-            logger.debug(f"Generating import statement for module: {node.module}")
-            return self.generate_import(node)
-        elif isinstance(node, (Literal, Identifier, BinaryOp, UnaryOp, Call, MemberAccess)):
-            logger.debug(f"Generating expression: {type(node)}")
-            return self.generate_expression(node)
-        else:
-            logger.error(f"Unknown node type: {type(node)}")
-            raise ValueError(f"Unknown node type: {type(node)}")
+        return self.visit(node)
+
+    def generic_visit(self, node):
+        raise ValueError(f"Unknown node type: {type(node)}")
+
+    def visit_Program(self, node):
+        if self.stack_objects:
+            EscapeAnalysis().visit(node)
+        # Classes may be used before they are declared
+        for stmt in node.statements:
+            if isinstance(stmt, ClassDeclaration):
+                self.declare_class(stmt)
+        for stmt in node.statements:
+            self.visit(stmt)
+        return self.module
 
     def generate_statements(self, statements):
         result = None
         for stmt in statements:
-            result = self.generate(stmt)
+            result = self.generate_statement(stmt)
         return result
 
-    def generate_function(self, node):
-        logger.debug(f"Generating function {node.name} with {len(node.parameters)} parameters")
+    def generate_statement(self, stmt):
+        result = self.visit(stmt)
+        if (isinstance(stmt, OWNING_EXPRESSIONS) and self.counted(stmt.type)
+                and not getattr(stmt, 'stack', False)):
+            # An object made and thrown away
+            self.release(result, stmt.type)
+        elif isinstance(stmt, Call) and stmt.type.startswith('task<'):
+            # Nobody will await the task, so it frees itself when done
+            self.builder.call(detach(self.module), [result])
+        self.release_temporaries()
+        return result
+
+    def declare_function(self, node):
+        """Return the ir.Function for a declaration, declaring it if needed."""
+        name = node.name.strip('"')
+        if name in self.module.globals:
+            return self.module.globals[name]
+
         # Get function parameters
         param_types = [self.get_llvm_type(param.type) for param in node.parameters]
         return_type = self.get_llvm_type(node.return_type)
+        if node.is_async:
+            return_type = self.types['task']
+        elif name == 'main' and return_type == self.types['int']:
+            # main is the C entry point, which returns a C int
+            return_type = ir.IntType(32)
         
         # Create function type
         fnty = ir.FunctionType(return_type, param_types)
         
         # Create function without quotes in name
-        func = ir.Function(self.module, fnty, node.name.strip('"'))
+        return ir.Function(self.module, fnty, name)
+
+    def get_string_constant(self, string_val):
+        """Return a string constant over the module's single copy of a literal.
+
+        The copy is NUL-terminated, which strings do not need, but keeps
+        literals usable as C strings when debugging.
+        """
+        string_const = self.strings.get(string_val)
+        if string_const is None:
+            data = bytearray(string_val.encode('utf8') + b'\00')
+            array_type = ir.ArrayType(ir.IntType(8), len(data))
+            string_const = ir.GlobalVariable(self.module, array_type, name=f"str_{len(self.strings)}")
+            string_const.global_constant = True
+            # Only the contents matter, so LLVM may merge equal constants further
+            string_const.linkage = 'private'
+            string_const.unnamed_addr = True
+            string_const.initializer = ir.Constant(array_type, data)
+            self.strings[string_val] = string_const
+        zero = ir.Constant(ir.IntType(32), 0)
+        size = ir.Constant(ir.IntType(64), len(string_const.initializer.constant) - 1)
+        return ir.Constant(VIEW, [string_const.gep([zero, zero]), size])
+
+    def create_entry_alloca(self, llvm_type, name):
+        """Allocate a local in the current function's entry block.
+
+        Locals live in a fixed set of entry-block allocas, whatever block
+        declares them, so a declaration inside a loop does not grow the stack
+        on every iteration and mem2reg/SROA can promote every one of them.
+        """
+        entry = self.function.entry_basic_block
+        builder = ir.IRBuilder(entry)
+        if self.last_alloca is None:
+            builder.position_at_start(entry)
+        else:
+            builder.position_after(self.last_alloca)
+        self.last_alloca = builder.alloca(llvm_type, name=name)
+        # The main builder always appends; inserting above it moved its end
+        self.builder.position_at_end(self.builder.block)
+        return self.last_alloca
+
+    def visit_FunctionDeclaration(self, node):
+        func = self.declare_function(node)
+        if not node.public and func.name != 'main':
+            # Nothing outside the module can call it, so LLVM is free to
+            # inline it everywhere and drop the out-of-line copy
+            func.linkage = 'internal'
+        for attribute in node.attributes:
+            if attribute.name not in FUNCTION_ATTRIBUTES:
+                raise ValueError(f"Unknown function attribute: {attribute.name}")
+            func.attributes.add(FUNCTION_ATTRIBUTES[attribute.name])
+        param_types = func.function_type.args
+        return_type = func.function_type.return_type
+
+        # Functions can be declared inside other bodies (class methods), so
+        # the enclosing function's state is put back afterwards
+        outer = (self.function, self.builder, self.last_alloca, self.arenas, self.locals,
+                 self.object_allocas, self.coroutine)
+        self.function = func
+        self.last_alloca = None
+        self.arenas = []
+        self.locals = []
+        self.object_allocas = []
+        if self.elide_retains:
+            RetainElider().visit(node)
         
         # Create entry block
         block = func.append_basic_block('entry')
         self.builder = ir.IRBuilder(block)
+        self.coroutine = None
+        if node.is_async:
+            # The coroutine's frame holds everything that follows
+            self.coroutine = Coroutine(self.builder, self.result_type(node.return_type.name))
         
         # Store parameters in local variables
         for i, param in enumerate(node.parameters):
-            logger.debug(f"Processing parameter {param.name} of type {param.type.name}")
             # Create alloca without quotes in name
-            alloca = self.builder.alloca(param_types[i], name=param.name.strip('"'))
+            alloca = self.create_entry_alloca(param_types[i], param.name.strip('"'))
             self.builder.store(func.args[i], alloca)
             self.variables[param.name] = alloca
+            if self.counted(param.type.name) and not param.borrowed:
+                self.retain(func.args[i])
+                self.locals.append((alloca, param.type.name))
         
         # Generate function body
-        logger.debug("Generating function body")
         self.generate_statements(node.body)
         
         # Ensure the function returns a value if needed
-        if not block.is_terminated:
-            if return_type == ir.VoidType():
+        if not self.builder.block.is_terminated:
+            self.release_locals()
+            if self.coroutine is not None:
+                result_type = self.coroutine.result_type
+                result = None if result_type is None else ir.Constant(result_type, None)
+                self.coroutine.finish(self.builder, result)
+            elif return_type == ir.VoidType():
                 self.builder.ret_void()
             else:
                 self.builder.ret(ir.Constant(return_type, 0))
-        
+
+        if self.object_allocas:
+            # Object variables start out null, so releasing one that was
+            # never assigned does nothing
+            builder = ir.IRBuilder(func.entry_basic_block)
+            # In a coroutine, once the frame they live in exists
+            builder.position_after(self.last_alloca if self.coroutine is None else self.coroutine.begun)
+            for alloca in self.object_allocas:
+                builder.store(ir.Constant(alloca.type.pointee, None), alloca)
+
+        (self.function, self.builder, self.last_alloca, self.arenas, self.locals,
+         self.object_allocas, self.coroutine) = outer
         return func
 
-    def generate_return(self, node):
-        value = self.generate(node.expression)
+    def visit_ReturnStatement(self, node):
+        value = self.owned_value(node.expression)
+        return_type = self.function.function_type.return_type
+        if value.type != return_type and isinstance(return_type, ir.IntType):
+            # Only main narrows: int is i64 everywhere else
+            value = self.builder.trunc(value, return_type)
+        self.release_temporaries()
+        self.release_locals()
+        # Leaving the function leaves the arena blocks it is in
+        for mark, _ in reversed(self.arenas):
+            self.builder.call(arena_exit(self.module), [mark])
+        if self.coroutine is not None:
+            return self.coroutine.finish(self.builder, value)
         return self.builder.ret(value)
 
-    def generate_expression(self, node):
-        logger.debug(f"Generating expression for node type: {type(node)}")
-        # Convert tokens to AST nodes
-        if hasattr(node, 'gettokentype'):
-            logger.debug(f"Converting token {node.gettokentype()} to AST node")
-            if node.gettokentype() == 'IDENTIFIER':
-                node = Identifier(node.getstr())
-            elif node.gettokentype() in ['INTEGER', 'FLOAT', 'STRING', 'BOOLEAN']:
-                node = Literal(node.value)
-
-        if isinstance(node, Literal):
-            logger.debug(f"Generating literal with value: {node.value} of type {type(node.value)}")
-            if isinstance(node.value, str):
-                # Create string constant without quotes in name
-                string_val = node.value.strip('"')
-                string_const = ir.GlobalVariable(self.module, ir.ArrayType(ir.IntType(8), len(string_val) + 1), 
-                                              name=f"str_{len(self.strings)}")
-                string_const.global_constant = True
-                string_const.initializer = ir.Constant(ir.ArrayType(ir.IntType(8), len(string_val) + 1), 
-                                                     bytearray(string_val.encode('utf8') + b'\00'))
-                self.strings.append(string_const)
-                return string_const
-            else:
-                return ir.Constant(self.get_llvm_type_from_value(node.value), node.value)
-        elif isinstance(node, Identifier):
-            logger.debug(f"Generating identifier reference: {node.name}")
-            # Load value from local variable
-            if node.name not in self.variables:
-                raise ValueError(f"Undefined variable: {node.name}")
-            return self.builder.load(self.variables[node.name])
-        elif isinstance(node, BinaryOp):
-            logger.debug(f"Generating binary operation: {node.op}")
-            left = self.generate_expression(node.left)
-            right = self.generate_expression(node.right)
-            logger.debug(f"Binary operation operands - left: {type(left)}, right: {type(right)}")
-            
-            if node.op in ['+', '-', '*', '/']:
-                if isinstance(left.type, ir.IntType):
-                    if node.op == '+':
-                        return self.builder.add(left, right)
-                    elif node.op == '-':
-                        return self.builder.sub(left, right)
-                    elif node.op == '*':
-                        return self.builder.mul(left, right)
-                    elif node.op == '/':
-                        return self.builder.sdiv(left, right)
-                else:
-                    if node.op == '+':
-                        return self.builder.fadd(left, right)
-                    elif node.op == '-':
-                        return self.builder.fsub(left, right)
-                    elif node.op == '*':
-                        return self.builder.fmul(left, right)
-                    elif node.op == '/':
-                        return self.builder.fdiv(left, right)
-            elif node.op in ['==', '!=', '<', '>', '<=', '>=']:
-                if isinstance(left.type, ir.IntType):
-                    return self.builder.icmp_signed(node.op, left, right)
-                else:
-                    return self.builder.fcmp_ordered(node.op, left, right)
-            else:
-                logger.error(f"Unknown binary operator: {node.op}")
-                raise ValueError(f"Unknown binary operator: {node.op}")
-        elif isinstance(node, UnaryOp):
-            operand = self.generate_expression(node.operand)
-            if node.op == 'NOT':
-                return self.builder.not_(operand)
-            else:
-                raise ValueError(f"Unknown unary operator: {node.op}")
-        elif isinstance(node, Call):
-            func = self.module.get_global(node.function.strip('"'))
-            if func is None:
-                raise ValueError(f"Function {node.function} not found")
-            args = [self.generate_expression(arg) for arg in node.arguments]
-            return self.builder.call(func, args)
-        elif isinstance(node, MemberAccess):
-            # Get the object
-            obj = self.variables.get(node.object_name)
-            if obj is None:
-                raise ValueError(f"Undefined object: {node.object_name}")
-            
-            # Get the member index
-            struct_type = obj.type.pointee
-            try:
-                idx = [name for name, _ in struct_type.elements].index(node.member_name)
-            except ValueError:
-                raise ValueError(f"Member not found: {node.member_name}")
-            
-            # Get pointer to member
-            zero = ir.Constant(ir.IntType(32), 0)
-            indices = [zero, ir.Constant(ir.IntType(32), idx)]
-            ptr = self.builder.gep(obj, indices, inbounds=True)
-            
-            return self.builder.load(ptr)
+    def counted(self, type_name):
+        """Whether values of a type are reference-counted objects."""
+        return f"struct.{type_name}" in self.fields
+
+    def retain(self, obj):
+        self.rc_operations += 1
+        self.builder.call(rc_retain(self.module), [self.builder.bitcast(obj, BYTES)])
+
+    def release(self, obj, class_name):
+        self.rc_operations += 1
+        self.builder.call(self.destructor(class_name), [obj])
+
+    def destructor(self, class_name):
+        """speed.release.Class: release an object, destroying it - and
+        releasing the objects in its fields - if that was the last reference."""
+        name = f"speed.release.{class_name}"
+        func = self.module.globals.get(name)
+        if func is not None:
+            return func
+        struct_type = self.class_struct(class_name)
+        func = ir.Function(self.module, ir.FunctionType(ir.VoidType(), [struct_type.as_pointer()]),
+                           name=name)
+        func.linkage = 'internal'
+        builder = ir.IRBuilder(func.append_basic_block('entry'))
+        entry = builder.block
+        loop = func.append_basic_block('release')
+        builder.branch(loop)
+        builder.position_at_end(loop)
+        obj = builder.phi(struct_type.as_pointer())
+        obj.add_incoming(func.args[0], entry)
+        memory = builder.bitcast(obj, BYTES)
+        last = builder.call(rc_release(self.module), [memory])
+        with builder.if_then(builder.not_(last), likely=True):
+            builder.ret_void()
+        fields = [
+            (builder.load(builder.gep(obj, self.field_indices(index), inbounds=True)), type_name)
+            for index, (_, type_name) in enumerate(self.fields[struct_type.name])
+            if self.counted(type_name)
+        ]
+        free = self.module.globals.get('free') or ir.Function(
+            self.module, ir.FunctionType(ir.VoidType(), [BYTES]), name='free')
+        builder.call(free, [memory])
+        if fields and fields[-1][1] == class_name:
+            # The rest of a list is released in the same frame, so a long
+            # chain of objects does not grow the stack
+            *fields, (rest, _) = fields
+            for value, type_name in fields:
+                builder.call(self.destructor(type_name), [value])
+            obj.add_incoming(rest, builder.block)
+            builder.branch(loop)
+            return func
+        for value, type_name in fields:
+            builder.call(self.destructor(type_name), [value])
+        builder.ret_void()
+        return func
+
+    def owned_value(self, node):
+        """Generate a value to store: a new object comes with the reference
+        the store takes, any other is retained."""
+        value = self.visit(node)
+        if self.counted(node.type) and not isinstance(node, OWNING_EXPRESSIONS):
+            self.retain(value)
+        return value
+
+    def argument_value(self, node):
+        """Generate an argument, kept alive until the end of the statement."""
+        value = self.visit(node)
+        if (not self.counted(node.type) or getattr(node, 'borrowed', False)
+                or getattr(node, 'stack', False)):
+            return value
+        if not isinstance(node, OWNING_EXPRESSIONS):
+            self.retain(value)
+        self.temporaries.append((value, node.type))
+        return value
+
+    def release_temporaries(self):
+        temporaries, self.temporaries = self.temporaries, []
+        for value, class_name in reversed(temporaries):
+            self.release(value, class_name)
+
+    def release_locals(self, start=0):
+        for alloca, class_name in reversed(self.locals[start:]):
+            self.release(self.builder.load(alloca), class_name)
+
+    def visit_Token(self, node):
+        # Bare rply tokens are converted to the AST nodes they stand for
+        if node.gettokentype() == 'IDENTIFIER':
+            return self.visit_Identifier(Identifier(node.getstr()))
+        elif node.gettokentype() in ['INTEGER', 'FLOAT', 'STRING', 'BOOLEAN']:
+            return self.visit_Literal(Literal(node.value))
+        raise ValueError(f"Unknown expression type: {node.gettokentype()}")
+
+    def visit_Literal(self, node):
+        if isinstance(node.value, str):
+            return self.get_string_constant(node.value.strip('"'))
+        return ir.Constant(self.get_llvm_type_from_value(node.value), node.value)
+
+    def visit_Identifier(self, node):
+        # Load value from local variable
+        if node.name not in self.variables:
+            if node.name in self.constants:
+                return self.constants[node.name]
+            raise ValueError(f"Undefined variable: {node.name}")
+        return self.builder.load(self.variables[node.name])
+
+    def visit_BinaryOp(self, node):
+        left = self.visit(node.left)
+        right = self.visit(node.right)
+
+        if node.op in COMPARISON_OPS:
+            if isinstance(left.type, ir.IntType):
+                return self.builder.icmp_signed(node.op, left, right)
+            return self.builder.fcmp_ordered(node.op, left, right)
+
+        ops = INT_OPS if isinstance(left.type, ir.IntType) else FLOAT_OPS
+        if node.op not in ops:
+            raise ValueError(f"Unknown binary operator: {node.op}")
+        result = getattr(self.builder, ops[node.op])(left, right)
+        if self.reassociate and ops is FLOAT_OPS:
+            # #[vectorize] allows floating-point reductions to be reordered,
+            # which the vectorizer needs to split them across lanes
+            result.flags.append('reassoc')
+        return result
+
+    def visit_UnaryOp(self, node):
+        operand = self.visit(node.operand)
+        if node.op == 'NOT':
+            return self.builder.not_(operand)
+        raise ValueError(f"Unknown unary operator: {node.op}")
+
+    def visit_Cast(self, node):
+        value = self.visit(node.expression)
+        target = self.get_llvm_type(node.type)
+        if isinstance(value.type, ir.IntType) and isinstance(target, ir.DoubleType):
+            return self.builder.sitofp(value, target)
+        raise ValueError(f"Cannot convert {node.expression.type} to {node.type}")
+
+    def visit_Call(self, node):
+        name = node.function.strip('"')
+        args = [self.argument_value(arg) for arg in node.arguments]
+        if name in self.imports:
+            func = self.resolve_overload(name, node.arguments, args)
         else:
-            logger.error(f"Unknown expression type: {type(node)}")
-            raise ValueError(f"Unknown expression type: {type(node)}")
+            func = self.module.get_global(name)
+        if func is None:
+            raise ValueError(f"Function {node.function} not found")
+        return self.builder.call(func, args)
 
-    def generate_import(self, node):
-        # For now, just declare the imported functions
+    def resolve_overload(self, name, nodes, args):
+        """The stdlib function an imported name means for these arguments.
+
+        Overloads are told apart by their LLVM types and, where those are
+        the same (string and bytes), by the types the checker inferred.
+        """
+        arg_types = [arg.type for arg in args]
+        matches = [
+            overload for overload in self.imports[name]
+            if [self.get_llvm_type(t) for t in overload[2]] == arg_types
+        ]
+        if not matches:
+            raise ValueError(f"No overload of {name} takes ({', '.join(map(str, arg_types))})")
+        inferred = [node.type for node in nodes]
+        symbol, return_type, param_types = next(
+            (overload for overload in matches if overload[2] == inferred), matches[0])
+        return self.stdlib_function(symbol, return_type, param_types)
+
+    def stdlib_function(self, symbol, return_type, param_types):
+        """Declare a stdlib function, generating its body if it has one here."""
+        func = self.module.globals.get(symbol)
+        if func is not None:
+            return func
+        fnty = ir.FunctionType(self.get_llvm_type(return_type),
+                               [self.get_llvm_type(t) for t in param_types])
+        func = ir.Function(self.module, fnty, name=symbol)
+        body = STDLIB_BODIES.get(symbol)
+        if body is not None:
+            # Every module calling it has a copy; the linker keeps one
+            func.linkage = 'linkonce_odr'
+            body(func, ir.IRBuilder(func.append_basic_block('entry')))
+        return func
+
+    def visit_Index(self, node):
+        value = self.builder.load(self.element_pointer(node.array, node.index))
+        if node.array.type in ('string', 'bytes'):
+            # Bytes read as ints from 0 to 255
+            return self.builder.zext(value, self.types['int'])
+        return value
+
+    def visit_IndexAssignment(self, node):
+        pointer = self.element_pointer(node.array, node.index)
+        value = self.visit(node.value)
+        self.builder.store(value, pointer)
+        return value
+
+    def element_pointer(self, array, index):
+        data = self.builder.extract_value(self.visit(array), 0)
+        return self.builder.gep(data, [self.visit(index)], inbounds=True)
+
+    def visit_MemberAccess(self, node):
+        obj = self.object_value(node.object_name)
+        if isinstance(obj.type, ir.LiteralStructType) and node.member_name == 'length':
+            # Arrays, strings and byte views are the only literal structs
+            return self.builder.extract_value(obj, 1)
+        return self.builder.load(self.field_pointer(obj, node.member_name))
+
+    def visit_MemberAssignment(self, node):
+        pointer = self.field_pointer(self.object_value(node.object_name), node.member_name)
+        return self.store_object(self.owned_value(node.value), pointer, node.type)
+
+    def store_object(self, value, pointer, type_name):
+        """Store into a variable or field, releasing the object it held."""
+        if not self.counted(type_name):
+            self.builder.store(value, pointer)
+            return value
+        old = self.builder.load(pointer)
+        self.builder.store(value, pointer)
+        self.release(old, type_name)
+        return value
+
+    def object_value(self, obj):
+        """The value of the object of a member access: a variable's name or
+        an expression."""
+        if not isinstance(obj, str):
+            return self.argument_value(obj)
+        if obj not in self.variables:
+            raise ValueError(f"Undefined object: {obj}")
+        return self.builder.load(self.variables[obj])
+
+    def field_pointer(self, obj, member_name):
+        struct_type = getattr(obj.type, 'pointee', None)
+        names = [name for name, _ in self.fields.get(getattr(struct_type, 'name', None), ())]
+        if member_name not in names:
+            raise ValueError(f"Member not found: {member_name}")
+        return self.builder.gep(obj, self.field_indices(names.index(member_name)), inbounds=True)
+
+    def field_indices(self, index):
+        # Past the reference count every object starts with
+        return [ir.Constant(ir.IntType(32), 0), ir.Constant(ir.IntType(32), index + 1)]
+
+    def visit_NewExpression(self, node):
+        struct_type = self.class_struct(node.class_name)
+        if struct_type.name not in self.fields:
+            raise ValueError(f"Unknown class: {node.class_name}")
+        object_type = struct_type.as_pointer()
+        if node.stack:
+            # A count of 0, like an arena object: never retained or freed
+            self.stack_allocated += 1
+            obj = self.create_entry_alloca(struct_type, node.class_name)
+            self.builder.store(ir.Constant(struct_type, None), obj)
+        else:
+            # The struct's size, as a constant LLVM folds for the target
+            size = ir.Constant(object_type, None).gep([ir.Constant(ir.IntType(32), 1)])
+            memory = self.builder.call(alloc(self.module), [size.ptrtoint(self.types['int'])])
+            obj = self.builder.bitcast(memory, object_type)
+        init = self.module.globals.get(method_name(node.class_name, 'init'))
+        if init is not None:
+            args = [self.argument_value(arg) for arg in node.arguments]
+            self.builder.call(init, [obj, *args])
+        else:
+            # Without an init, the arguments are the fields in order
+            for index, arg in enumerate(node.arguments):
+                field = self.builder.gep(obj, self.field_indices(index), inbounds=True)
+                self.builder.store(self.owned_value(arg), field)
+        return obj
+
+    def visit_AwaitExpression(self, node):
+        if self.arenas:
+            # The arena could be left and reused while the task waits
+            raise ValueError("Cannot await inside an arena block")
+        task = self.visit(node.expression)
+        return await_task(self.builder, task, self.result_type(node.type), self.coroutine)
+
+    def result_type(self, type_name):
+        """The LLVM type of a task's result, None for void."""
+        return None if type_name == 'void' else self.get_llvm_type(type_name)
+
+    def visit_ArenaStatement(self, node):
+        # Everything `new` makes until the block is left comes from the
+        # arena, and is freed at once when it is left
+        start = len(self.locals)
+        mark = self.builder.call(arena_enter(self.module), [])
+        self.arenas.append((mark, start))
+        self.generate_statements(node.body)
+        self.arenas.pop()
+        if not self.builder.block.is_terminated:
+            # The block's variables let go of their objects before the arena
+            # frees them, and are cleared for when the block runs again
+            self.release_locals(start)
+            for alloca, _ in self.locals[start:]:
+                self.builder.store(ir.Constant(alloca.type.pointee, None), alloca)
+            self.builder.call(arena_exit(self.module), [mark])
+        del self.locals[start:]
+
+    def visit_ImportStatement(self, node):
+        # Declare the imported functions; the runtime defines them, except
+        # for those generated on first call
+        functions = STDLIB_FUNCTIONS.get(node.module, {})
+        constants = STDLIB_CONSTANTS.get(node.module, {})
         for imp in node.imports:
-            if node.module == "io":
-                if imp == "print":
-                    fnty = ir.FunctionType(self.types['void'], [self.types['string']])
-                    ir.Function(self.module, fnty, name="print")
-            elif node.module == "math":
-                if imp in ["sin", "cos"]:
-                    fnty = ir.FunctionType(self.types['float'], [self.types['float']])
-                    ir.Function(self.module, fnty, name=f"math_{imp}")
-            elif node.module == "string":
-                if imp == "length":
-                    fnty = ir.FunctionType(self.types['int'], [self.types['string']])
-                    ir.Function(self.module, fnty, name="string_length")
-                elif imp in ["concat", "split", "join"]:
-                    fnty = ir.FunctionType(self.types['string'], [self.types['string'], self.types['string']])
-                    ir.Function(self.module, fnty, name=f"string_{imp}")
-
-    def generate_variable_declaration(self, node):
-        logger.debug(f"Generating variable declaration: {node.name}")
+            if imp in constants:
+                self.constants[imp] = ir.Constant(self.types['float'], constants[imp])
+            if imp not in functions:
+                continue
+            self.imports[imp] = functions[imp]
+            for symbol, return_type, param_types in functions[imp]:
+                if symbol not in STDLIB_BODIES:
+                    self.stdlib_function(symbol, return_type, param_types)
+
+    def visit_Assignment(self, node):
+        if node.name not in self.variables:
+            raise ValueError(f"Undefined variable: {node.name}")
+        return self.store_object(self.owned_value(node.value), self.variables[node.name], node.type)
+
+    def generate_condition(self, node):
+        """Generate an expression as an i1, comparing numbers against zero."""
+        value = self.visit(node)
+        self.release_temporaries()
+        if value.type == ir.IntType(1):
+            return value
+        zero = ir.Constant(value.type, 0)
+        if isinstance(value.type, ir.IntType):
+            return self.builder.icmp_signed('!=', value, zero)
+        return self.builder.fcmp_ordered('!=', value, zero)
+
+    def new_block(self, name):
+        # Blocks are created when they are first branched to but placed when
+        # code is emitted into them, so the IR reads in source order
+        return ir.Block(parent=self.function, name=name)
+
+    def start_block(self, block):
+        self.function.blocks.append(block)
+        self.builder.position_at_end(block)
+
+    def branch_to(self, block):
+        # Blocks that already returned keep their terminator
+        if not self.builder.block.is_terminated:
+            self.builder.branch(block)
+
+    def visit_IfStatement(self, node):
+        condition = self.generate_condition(node.condition)
+        then_block = self.new_block('if.then')
+        else_block = self.new_block('if.else') if node.else_branch else None
+        end_block = self.new_block('if.end')
+        self.builder.cbranch(condition, then_block, else_block or end_block)
+
+        self.start_block(then_block)
+        self.generate_statements(node.then_branch)
+        self.branch_to(end_block)
+        if else_block:
+            self.start_block(else_block)
+            self.generate_statements(node.else_branch)
+            self.branch_to(end_block)
+        self.start_block(end_block)
+
+    def visit_WhileStatement(self, node):
+        self.generate_loop(node)
+
+    def visit_ForStatement(self, node):
+        self.generate_statement(node.initializer)
+        self.generate_loop(node, node.increment)
+
+    def generate_loop(self, node, increment=None):
+        """Emit a loop in canonical form: preheader, header, body, latch, exit.
+
+        The condition is tested in the header and the latch holds the
+        increment and the only backedge, which carries the loop's
+        llvm.loop metadata when it has #[unroll]/#[vectorize] hints.
+        """
+        preheader = self.new_block('loop.preheader')
+        header = self.new_block('loop.header')
+        body = self.new_block('loop.body')
+        latch = self.new_block('loop.latch')
+        exit_block = self.new_block('loop.exit')
+        loop_id = self.loop_metadata(node.attributes)
+        vectorize = any(attribute.name == 'vectorize' for attribute in node.attributes)
+
+        self.builder.branch(preheader)
+        self.start_block(preheader)
+        self.builder.branch(header)
+
+        self.start_block(header)
+        self.builder.cbranch(self.generate_condition(node.condition), body, exit_block)
+
+        self.reassociate += vectorize
+        self.start_block(body)
+        self.generate_statements(node.body)
+        self.branch_to(latch)
+
+        self.start_block(latch)
+        if increment is not None:
+            self.generate_statement(increment)
+        backedge = self.builder.branch(header)
+        self.reassociate -= vectorize
+        if loop_id is not None:
+            backedge.set_metadata('llvm.loop', loop_id)
+
+        self.start_block(exit_block)
+
+    def loop_metadata(self, attributes):
+        """Build the llvm.loop node for a loop's hints, or None without any."""
+        hints = []
+        for attribute in attributes:
+            count = attribute.arguments[0] if attribute.arguments else None
+            if attribute.name == 'unroll':
+                if count is None:
+                    hints.append(['llvm.loop.unroll.enable'])
+                else:
+                    hints.append(['llvm.loop.unroll.count', ir.Constant(ir.IntType(32), count)])
+            elif attribute.name == 'nounroll':
+                hints.append(['llvm.loop.unroll.disable'])
+            elif attribute.name == 'vectorize':
+                hints.append(['llvm.loop.vectorize.enable', ir.Constant(ir.IntType(1), True)])
+                if count is not None:
+                    hints.append(['llvm.loop.vectorize.width', ir.Constant(ir.IntType(32), count)])
+            else:
+                raise ValueError(f"Unknown loop attribute: {attribute.name}")
+        if not hints:
+            return None
+
+        operands = [self.module.add_metadata(hint) for hint in hints]
+        # A loop ID must be unique and refer to itself, which add_metadata
+        # (deduplicating by operands) cannot express, so it is made directly
+        loop_id = ir.values.MDValue(self.module, [], name=str(len(self.module.metadata)))
+        loop_id.operands = (loop_id, *operands)
+        return loop_id
+
+    def visit_VariableDeclaration(self, node):
         if node.initializer is None:
             # For class fields without initializers
             return None
-        value = self.generate_expression(node.initializer)
+        class_name = node.initializer.type
+        if node.borrowed or not self.counted(class_name):
+            value = self.visit(node.initializer)
+        else:
+            value = self.owned_value(node.initializer)
         var_type = self.get_llvm_type(node.type.name) if node.type else value.type
-        var = self.builder.alloca(var_type, name=node.name)
-        self.builder.store(value, var)
+        var = self.create_entry_alloca(var_type, node.name)
         self.variables[node.name] = var
+        if node.borrowed or not self.counted(class_name):
+            self.builder.store(value, var)
+            return var
+        self.locals.append((var, class_name))
+        self.object_allocas.append(var)
+        # Run again (in a loop), the declaration replaces an object
+        self.store_object(value, var, class_name)
         return var
 
-    def generate_class_declaration(self, node):
-        # Create struct type for class
-        struct_type = ir.global_context.get_identified_type(f"struct.{node.name}")
-        
-        # Collect field types
-        field_types = []
-        field_names = []
+    def declare_class(self, node):
+        """Give a class's struct its fields and declare its methods."""
+        struct_type = self.class_struct(node.name)
+        if struct_type.name in self.fields:
+            return struct_type
+        fields = [member for member in node.members if isinstance(member, VariableDeclaration)]
+        # Every object starts with its reference count
+        struct_type.set_body(self.types['int'], *[self.get_llvm_type(field.type) for field in fields])
+        self.fields[struct_type.name] = [(field.name, field.type.name) for field in fields]
+        # Methods (the type checker made them functions) can call each other
+        # and be called before the class's code is generated
         for member in node.members:
-            if isinstance(member, VariableDeclaration):
-                field_types.append(self.types[member.type.name])
-                field_names.append(member.name)
-        
-        # Set struct body with named elements
-        struct_type.set_body(*field_types, packed=False)
-        struct_type.elements = list(zip(field_names, field_types))
-        
-        # Generate methods
+            if isinstance(member, FunctionDeclaration):
+                self.declare_function(member)
+        return struct_type
+
+    def visit_ClassDeclaration(self, node):
+        struct_type = self.declare_class(node)
         for member in node.members:
             if isinstance(member, FunctionDeclaration):
-                self.generate(member)
-        
+                self.visit(member)
         return struct_type 
\ No newline at end of file
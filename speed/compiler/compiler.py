@@ -1,40 +1,206 @@
+import time
+from contextlib import contextmanager, nullcontext
 from .lexer import Lexer
 from .parser import Parser
 from .codegen import CodeGenerator
+from .backend import Backend
+from .incremental import IncrementalCompiler, called_functions
+from .optimizer import ConstantFolder, Inliner
+from .typecheck import TypeChecker
+from .ast import FunctionDeclaration, walk
+
+class CompileStats:
+    """Wall time per compiler phase plus the size of what each phase produced."""
+
+    PHASES = ('lex', 'parse', 'check', 'inline', 'fold', 'codegen', 'optimize', 'emit', 'link', 'load')
 
-class Compiler:
     def __init__(self):
-        self.lexer = Lexer()
+        self.times = {}
+        self.tokens = 0
+        self.nodes = 0
+        self.functions = 0
+        self.instructions = 0
+        self.rc_operations = 0
+        self.stack_allocated = 0
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.times[name] = self.times.get(name, 0.0) + time.perf_counter() - start
+
+    def count_module(self, module):
+        self.functions = 0
+        self.instructions = 0
+        for func in module.functions:
+            if func.is_declaration:
+                continue
+            self.functions += 1
+            for block in func.blocks:
+                self.instructions += len(block.instructions)
+
+    @property
+    def total(self):
+        return sum(self.times.values())
+
+    def format(self):
+        lines = [f"{'phase':<10}{'time (ms)':>12}"]
+        for name in self.PHASES:
+            if name in self.times:
+                lines.append(f"{name:<10}{self.times[name] * 1000:>12.3f}")
+        lines.append(f"{'total':<10}{self.total * 1000:>12.3f}")
+        lines.append(f"tokens: {self.tokens}  nodes: {self.nodes}  "
+                     f"functions: {self.functions}  instructions: {self.instructions}  "
+                     f"rc operations: {self.rc_operations}  "
+                     f"stack objects: {self.stack_allocated}")
+        return '\n'.join(lines)
+
+class Compiler:
+    def __init__(self, lexer_backend='regex', incremental=False, fold=True, inline=True,
+                 elide_retains=True, stack_objects=True):
+        self.lexer = Lexer(lexer_backend)
         self.parser = Parser()
-        self.codegen = CodeGenerator()
+        # Reference counting left out where the RetainElider shows it is not needed
+        # and objects put on the stack where EscapeAnalysis shows they can be
+        self.elide_retains = elide_retains
+        self.stack_objects = stack_objects
+        # Name of the LLVM module each compile() generates
+        self.module_name = 'speed_module'
+        # The generator of the last compile(), holding its module
+        self.codegen = None
+        # Small functions are expanded into their callers before folding
+        self.inline = inline
+        # Constant folding and dead-code removal on the AST before codegen
+        self.fold = fold
+        # compile_to_* outputs go through the per-declaration cache when set
+        self.incremental = IncrementalCompiler(self) if incremental else None
+
+    def compile(self, source_code, stats=False, externs=()):
+        """Compile source code to an LLVM module.
+
+        With stats=True (or a CompileStats to accumulate into), returns
+        (module, CompileStats) instead. Tokens are then materialised up front
+        so lexing and parsing can be timed apart. externs are bodiless
+        declarations of functions defined elsewhere that the program may call.
+        """
+        if stats and not isinstance(stats, CompileStats):
+            stats = CompileStats()
+        # A generator of its own for every call: generating into the module of
+        # the last one would give its functions a second body
+        self.codegen = CodeGenerator(module_name=self.module_name,
+                                     elide_retains=self.elide_retains,
+                                     stack_objects=self.stack_objects)
+        parser = self.parser.get_parser()
 
-    def compile(self, source_code):
         # Tokenize the source code
-        tokens = self.lexer.get_lexer().lex(source_code)
-        
+        with self._phase(stats, 'lex'):
+            tokens = self.lexer.get_lexer().lex(source_code)
+            if stats:
+                tokens = list(tokens)
+        if stats:
+            stats.tokens = len(tokens)
+
         # Parse the tokens into an AST
-        ast = self.parser.get_parser().parse(tokens)
-        
+        with self._phase(stats, 'parse'):
+            ast = parser.parse(iter(tokens))
+        if stats:
+            stats.nodes = sum(1 for _ in walk(ast))
+
+        with self._phase(stats, 'check'):
+            ast = self._checker(externs).visit(ast)
+
+        if self.inline:
+            with self._phase(stats, 'inline'):
+                ast = Inliner().visit(ast)
+
+        if self.fold:
+            with self._phase(stats, 'fold'):
+                ast = ConstantFolder().visit(ast)
+
         # Generate LLVM IR from the AST
-        self.codegen.generate(ast)
-        
-        # Return the LLVM module
-        return self.codegen.module
+        with self._phase(stats, 'codegen'):
+            self._declare_externs(ast, externs)
+            self.codegen.generate(ast)
+        if not stats:
+            return self.codegen.module
+
+        stats.count_module(self.codegen.module)
+        stats.rc_operations = self.codegen.rc_operations
+        stats.stack_allocated = self.codegen.stack_allocated
+        return self.codegen.module, stats
 
-    def compile_to_file(self, source_code, output_file):
+    def options(self):
+        """The options that change the IR compile() generates, for cache keys."""
+        return [self.inline, self.fold, self.elide_retains, self.stack_objects]
+
+    def _checker(self, externs):
+        checker = TypeChecker()
+        for node in externs:
+            checker.declare_function(node)
+        return checker
+
+    def _declare_externs(self, ast, externs):
+        # Only the ones still called once inlining and folding are done, and
+        # not shadowed by a function of the program's own
+        if externs:
+            called = called_functions(ast) - {
+                stmt.name for stmt in ast.statements if isinstance(stmt, FunctionDeclaration)}
+            for node in externs:
+                if node.name in called:
+                    self.codegen.declare_function(node)
+
+    def _compile_for_output(self, source_code, stats):
+        if self.incremental:
+            stats = CompileStats() if stats else None
+            return self.incremental.compile(source_code, stats=stats), stats
+        if stats:
+            return self.compile(source_code, stats=True)
+        return self.compile(source_code), None
+
+    def _phase(self, stats, name):
+        return stats.phase(name) if stats else nullcontext()
+
+    def _result(self, output_file, stats):
+        return (output_file, stats) if stats else output_file
+
+    def compile_to_file(self, source_code, output_file, stats=False, opt_level='0'):
         # Compile the source code
-        module = self.compile(source_code)
-        
+        module, stats = self._compile_for_output(source_code, stats)
+
+        # Unoptimized IR is written as generated; otherwise run the pipeline
+        if str(opt_level) != '0':
+            with self._phase(stats, 'optimize'):
+                module = Backend(opt_level).compile(module)
+
         # Write the LLVM IR to a file
-        with open(output_file, 'w') as f:
-            f.write(str(module))
-        
-        return output_file
+        with self._phase(stats, 'emit'):
+            with open(output_file, 'w') as f:
+                f.write(str(module))
 
-    def compile_to_object(self, source_code, output_file):
-        # Compile the source code
-        module = self.compile(source_code)
-        
-        # TODO: Implement LLVM IR to object file compilation
-        # This will require integration with LLVM's native compilation pipeline
-        raise NotImplementedError("Object file compilation not yet implemented") 
\ No newline at end of file
+        return self._result(output_file, stats)
+
+    def compile_to_object(self, source_code, output_file, stats=False, opt_level='0'):
+        module, stats = self._compile_for_output(source_code, stats)
+        backend = Backend(opt_level)
+
+        with self._phase(stats, 'optimize'):
+            llvm_module = backend.compile(module)
+
+        with self._phase(stats, 'emit'):
+            backend.write_object(llvm_module, output_file)
+
+        return self._result(output_file, stats)
+
+    def compile_to_executable(self, source_code, output_file, stats=False, opt_level='0'):
+        module, stats = self._compile_for_output(source_code, stats)
+        backend = Backend(opt_level)
+
+        with self._phase(stats, 'optimize'):
+            llvm_module = backend.compile(module)
+
+        with self._phase(stats, 'link'):
+            backend.write_executable(llvm_module, output_file)
+
+        return self._result(output_file, stats)
@@ -0,0 +1,431 @@
+import hashlib
+import json
+import os
+import re
+from contextlib import nullcontext
+from llvmlite import ir
+from .ast import (
+    Call, ClassDeclaration, FunctionDeclaration, ImportStatement, NewExpression, Parameter, Program,
+    Type, VariableDeclaration, clone, walk,
+)
+from .codegen import CodeGenerator
+from .optimizer import ConstantFolder, EscapeAnalysis, Inliner
+from .typecheck import TypeChecker, task_type
+from .cache import cache_dir, cache_key, write_atomic
+
+# Just enough of the lexical structure to find top-level statement boundaries
+# without tokenizing the whole file: strings and comments are skipped so that
+# braces and semicolons inside them do not count
+_BOUNDARY = re.compile(r'"[^"]*"|//[^\n]*|/\*[\s\S]*?\*/|[{};]')
+_CONTINUATION = re.compile(r'\s*(?:from\s*"[^"]*"(?:\s*;)?|else\b)')
+# Unnamed metadata (loop hints) is numbered per module, so each piece's
+# references are shifted past the nodes of the pieces before it
+_METADATA_REF = re.compile(r'!(\d+)\b')
+# Globals every unit that uses them defines identically
+_SHARED_LINKAGE = ('linkonce_odr', 'appending')
+# The class names inside a type name such as Point[] or task<Point>
+_TYPE_NAME = re.compile(r'\w+')
+_DESTRUCTOR = 'speed.release.'
+
+def split_top_level(source_code):
+    """Split source code into the text of its top-level statements."""
+    chunks = []
+    depth = 0
+    start = 0
+    pos = 0
+    while True:
+        match = _BOUNDARY.search(source_code, pos)
+        if match is None:
+            break
+        pos = match.end()
+        text = match.group()
+        if text == '{':
+            depth += 1
+        elif text == '}':
+            depth -= 1
+            if depth == 0:
+                # 'import { ... } from "x";' and '} else {' continue the statement
+                continuation = _CONTINUATION.match(source_code, pos)
+                if continuation:
+                    pos = continuation.end()
+                    if continuation.group().strip() == 'else':
+                        continue
+                chunks.append(source_code[start:pos])
+                start = pos
+        elif text == ';' and depth == 0:
+            chunks.append(source_code[start:pos])
+            start = pos
+    if source_code[start:].strip():
+        chunks.append(source_code[start:])
+    return [chunk for chunk in chunks if chunk.strip()]
+
+def called_functions(node):
+    """Names of the free functions called anywhere inside a declaration."""
+    return {
+        child.function for child in walk(node)
+        if isinstance(child, Call) and isinstance(child.function, str)
+    }
+
+def named_types(node):
+    """Names of the types written anywhere inside a declaration."""
+    names = set()
+    for child in walk(node):
+        if isinstance(child, Type):
+            names.add(child.name)
+        elif isinstance(child, NewExpression):
+            names.add(child.class_name)
+    return names
+
+def function_signature(node):
+    """A function's name, parameters and what callers get back, as JSON."""
+    return [
+        node.name,
+        [[param.name, param.type.name] for param in node.parameters],
+        # Callers of an async fn get its task
+        task_type(node.return_type.name) if node.is_async else node.return_type.name,
+    ]
+
+def describe_unit(node):
+    """What other units need to know about a top-level statement."""
+    signature = function_signature(node) if isinstance(node, FunctionDeclaration) else None
+    layout = None
+    escaping = None
+    if isinstance(node, ClassDeclaration):
+        # What code using the class sees: its fields and method signatures
+        layout = [
+            [member.name, member.type and member.type.name]
+            if isinstance(member, VariableDeclaration) else
+            [member.name, [param.type.name for param in member.parameters],
+             member.return_type.name, member.is_async]
+            for member in node.members
+        ]
+        # Which parameters of its methods let their object escape, which
+        # decides where code using the class can put its objects. The
+        # methods are analysed as functions taking `this`, as once checked.
+        methods = clone(node)
+        TypeChecker().declare_class(methods)
+        analysis = EscapeAnalysis()
+        analysis.visit(Program([methods]))
+        escaping = {name: sorted(indexes) for name, indexes in analysis.escaping.items()}
+    return {
+        'import': isinstance(node, ImportStatement),
+        'name': getattr(node, 'name', type(node).__name__),
+        'signature': signature,
+        'layout': layout,
+        'escaping': escaping,
+        'calls': sorted(called_functions(node)),
+        'types': sorted(named_types(node)),
+        'inlinable': isinstance(node, FunctionDeclaration) and _inlinable(node),
+    }
+
+def _inlinable(node):
+    # Whether the Inliner would expand calls to it; it only looks at syntax
+    inliner = Inliner()
+    inliner.consider(node)
+    return node.name in inliner.candidates
+
+def inlined_functions(name, infos):
+    """The functions whose bodies can end up in a unit when calls are
+    inlined: the inlinable functions it calls, and those they call in turn."""
+    inlined = set()
+    pending = list(infos[name]['calls'])
+    while pending:
+        callee = pending.pop()
+        if callee in inlined or callee not in infos or not infos[callee]['inlinable']:
+            continue
+        inlined.add(callee)
+        pending.extend(infos[callee]['calls'])
+    inlined.discard(name)
+    return sorted(inlined)
+
+def used_classes(type_names, classes):
+    """The classes a unit naming these types can use: those named, and the
+    classes their fields and methods name in turn."""
+    used = set()
+    pending = [name for type_name in type_names for name in _TYPE_NAME.findall(type_name)]
+    while pending:
+        name = pending.pop()
+        if name in used or name not in classes:
+            continue
+        used.add(name)
+        pending.extend(name for type_name in classes[name]['types']
+                       for name in _TYPE_NAME.findall(type_name))
+    return sorted(used)
+
+def _signature_types(signature):
+    _, parameters, return_type = signature
+    return [param_type for _, param_type in parameters] + [return_type]
+
+def declaration_from_signature(signature):
+    """A bodiless FunctionDeclaration to declare a signature with."""
+    name, parameters, return_type = signature
+    return FunctionDeclaration(
+        name, [Parameter(param, Type(param_type)) for param, param_type in parameters],
+        Type(return_type), [])
+
+def _signature_key(signature):
+    # Callers only see the name and types; parameter names do not matter
+    name, parameters, return_type = signature
+    return json.dumps([name, [param_type for _, param_type in parameters], return_type])
+
+def _hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+class IncrementalCompiler:
+    """Compiles a program one top-level declaration at a time.
+
+    The source is split into top-level statements, each identified by the
+    hash of its text. A unit's generated IR is keyed on that hash, the
+    imports, the signatures of the functions it calls, the text of those
+    that get inlined into it and the layouts of the classes it uses, and is
+    stored in memory and under the cache
+    directory along with the unit's own signature and call list. A class's
+    key part also holds what its methods call and which of their parameters
+    escape, since that decides whether its objects can go on the stack.
+    After an edit only the changed declarations (and users of changed
+    signatures, inlined bodies or classes) are lexed, parsed and sent
+    through the same passes as Compiler.compile; everything else is
+    reassembled from the stored IR.
+    """
+
+    def __init__(self, compiler, use_disk_cache=True):
+        self.compiler = compiler
+        self.use_disk_cache = use_disk_cache
+        self.memory_cache = {}
+        self.rebuilt = []
+        self.reused = []
+
+    def compile(self, source_code, stats=None):
+        """Compile source code to the textual LLVM IR of the whole module."""
+        with _phase(stats, 'lex'):
+            chunks = [(_hash(chunk), chunk) for chunk in split_top_level(source_code)]
+
+        # Signatures and call lists, parsing only statements not seen before
+        parsed = {}
+        infos = {}
+        for chunk_hash, chunk in chunks:
+            info_key = cache_key(chunk_hash)
+            info = self._lookup('info', info_key)
+            if info is None:
+                with _phase(stats, 'parse'):
+                    parsed[chunk_hash] = self._parse_chunk(chunk)
+                info = describe_unit(parsed[chunk_hash])
+                self._store('info', info_key, info)
+            infos[chunk_hash] = info
+
+        imports = [(chunk_hash, chunk) for chunk_hash, chunk in chunks if infos[chunk_hash]['import']]
+        units = [(chunk_hash, chunk) for chunk_hash, chunk in chunks if not infos[chunk_hash]['import']]
+        signatures = {
+            infos[chunk_hash]['name']: infos[chunk_hash]['signature']
+            for chunk_hash, _ in units if infos[chunk_hash]['signature']
+        }
+        # Functions by name, for the inliner
+        functions = {infos[chunk_hash]['name']: (chunk_hash, chunk)
+                     for chunk_hash, chunk in units if infos[chunk_hash]['signature']}
+        function_infos = {name: infos[chunk_hash] for name, (chunk_hash, _) in functions.items()}
+        classes = {infos[chunk_hash]['name']: (chunk_hash, chunk)
+                   for chunk_hash, chunk in units if infos[chunk_hash]['layout'] is not None}
+        class_infos = {name: infos[chunk_hash] for name, (chunk_hash, _) in classes.items()}
+        imports_key = _hash(''.join(chunk_hash for chunk_hash, _ in imports))
+        options_key = json.dumps(self.compiler.options())
+        import_nodes = None
+
+        self.rebuilt = []
+        self.reused = []
+        pieces = []
+        for chunk_hash, chunk in units:
+            info = infos[chunk_hash]
+            inlined = []
+            if self.compiler.inline and info['name'] in function_infos:
+                inlined = inlined_functions(info['name'], function_infos)
+            # Everything the unit or the bodies inlined into it call
+            called = set(info['calls']).union(*(function_infos[name]['calls'] for name in inlined))
+            callees = sorted(name for name in called if name in signatures)
+            # The classes named in those, or in what the callees take and return
+            type_names = set(info['types']).union(
+                *(function_infos[name]['types'] for name in inlined),
+                *(_signature_types(signatures[name]) for name in callees))
+            used = [name for name in used_classes(type_names, class_infos)
+                    if not (info['layout'] is not None and name == info['name'])]
+            key = cache_key(chunk_hash, imports_key, options_key,
+                            *(_signature_key(signatures[name]) for name in callees),
+                            *(functions[name][0] for name in inlined),
+                            *(json.dumps([name, class_infos[name]['layout'], class_infos[name]['escaping'],
+                                          class_infos[name]['calls']]) for name in used))
+            piece = self._lookup('ir', key)
+            if piece is None:
+                if import_nodes is None:
+                    import_nodes = [self._parse_chunk(chunk) for _, chunk in imports]
+                with _phase(stats, 'parse'):
+                    unit = self._parsed((chunk_hash, chunk), parsed)
+                    bodies = [self._parsed(functions[name], parsed) for name in inlined]
+                    class_nodes = [self._parsed(classes[name], parsed) for name in used]
+                with _phase(stats, 'codegen'):
+                    piece = self._generate_unit(
+                        unit, import_nodes,
+                        [declaration_from_signature(signatures[name]) for name in callees], bodies,
+                        class_nodes)
+                self._store('ir', key, piece)
+                self.rebuilt.append(info['name'])
+            else:
+                self.reused.append(info['name'])
+            pieces.append(piece)
+
+        with _phase(stats, 'link'):
+            if import_nodes is None:
+                import_nodes = [self._parse_chunk(chunk) for _, chunk in imports]
+            module_text = self._assemble(import_nodes, pieces)
+        if stats:
+            stats.functions = sum(len(piece['defines']) for piece in pieces)
+            stats.rc_operations = sum(piece['rc_operations'] for piece in pieces)
+            stats.stack_allocated = sum(piece['stack_allocated'] for piece in pieces)
+        return module_text
+
+    def _parse_chunk(self, chunk):
+        tokens = self.compiler.lexer.get_lexer().lex(chunk)
+        program = self.compiler.parser.get_parser().parse(tokens)
+        if len(program.statements) != 1:
+            raise ValueError(f"Expected one top-level statement, found {len(program.statements)}")
+        return program.statements[0]
+
+    def _parsed(self, chunk, parsed):
+        """A fresh AST of a chunk for the passes to change, parsing it once."""
+        chunk_hash, text = chunk
+        if chunk_hash not in parsed:
+            parsed[chunk_hash] = self._parse_chunk(text)
+        return clone(parsed[chunk_hash])
+
+    def _generate_unit(self, unit, imports, callees, inlined=(), classes=()):
+        """Generate a unit's IR, given the declarations of the functions it
+        calls, the full declarations of those inlined into it and of the
+        classes it uses."""
+        unit_name = getattr(unit, 'name', type(unit).__name__)
+        # Escape analysis is run below instead, where it sees the classes
+        codegen = CodeGenerator(module_name=unit_name,
+                                elide_retains=self.compiler.elide_retains,
+                                stack_objects=False)
+        checker = TypeChecker()
+        for stmt in imports:
+            codegen.generate(stmt)
+            checker.visit(stmt)
+        for callee in callees:
+            codegen.declare_function(callee)
+            checker.declare_function(callee)
+        for node in classes:
+            # Only the struct and the method declarations; the methods are
+            # generated in the class's own unit
+            checker.declare_class(node)
+            codegen.declare_class(node)
+        # The inlined functions are checked and expanded along with the
+        # unit, the same passes Compiler.compile runs, but only the unit is
+        # generated
+        program = checker.visit(Program([*inlined, unit]))
+        if self.compiler.inline:
+            program = Inliner().visit(program)
+        unit = Program(program.statements[-1:])
+        if self.compiler.fold:
+            unit = ConstantFolder().visit(unit)
+        if self.compiler.stack_objects:
+            # Whether an object can go on the stack depends on its class and
+            # on what its init does with it
+            EscapeAnalysis().visit(Program([*classes, *unit.statements]))
+        codegen.generate(unit)
+
+        piece = {'types': [], 'globals': [], 'declares': {}, 'defines': [], 'metadata': [],
+                 'rc_operations': codegen.rc_operations,
+                 'stack_allocated': codegen.stack_allocated}
+        values = list(codegen.module.globals.values())
+        # Module-level constants of different units would collide once the
+        # pieces are put together, so they get unit-qualified private names;
+        # stdlib runtime state is the same in every unit and stays shared
+        for value in values:
+            if not isinstance(value, ir.Function) and value.linkage not in _SHARED_LINKAGE:
+                value.name = f"{unit_name}.{value.name}"
+                value.linkage = 'private'
+            elif isinstance(value, ir.Function) and value.name.startswith(_DESTRUCTOR):
+                # Every unit releasing a class's objects generates the same
+                # destructor, so one copy is kept like the stdlib bodies
+                value.linkage = 'linkonce_odr'
+        for struct_type in codegen.module.get_identified_types().values():
+            piece['types'].append(struct_type.get_declaration())
+        for value in values:
+            if not isinstance(value, ir.Function):
+                piece['globals'].append(str(value))
+            elif value.is_declaration:
+                piece['declares'][value.name] = str(value)
+            else:
+                piece['defines'].append([value.name, str(value)])
+        piece['metadata'] = [
+            line for line in str(codegen.module).splitlines() if _METADATA_REF.match(line)]
+        return piece
+
+    def _assemble(self, imports, pieces):
+        header = CodeGenerator()
+        for stmt in imports:
+            header.generate(stmt)
+
+        types = {}
+        declares = {name: str(value) for name, value in header.module.globals.items()}
+        global_lines = []
+        define_lines = []
+        metadata_lines = []
+        defined = set()
+        global_names = set()
+        for piece in pieces:
+            for line in piece['types']:
+                types.setdefault(line.split(' = ', 1)[0], line)
+            for line in piece['globals']:
+                name, definition = line.split(' = ', 1)
+                if name in global_names and definition.startswith(_SHARED_LINKAGE):
+                    continue
+                global_names.add(name)
+                global_lines.append(line)
+            for name, text in piece['declares'].items():
+                declares.setdefault(name, text)
+            renumber = _renumber_metadata(len(metadata_lines))
+            for name, text in piece['defines']:
+                if name in defined and text.startswith('define linkonce_odr'):
+                    # Stdlib bodies generated into every unit that calls them
+                    continue
+                defined.add(name)
+                define_lines.append(renumber(text))
+            metadata_lines += [renumber(line) for line in piece['metadata']]
+
+        lines = [
+            f'; ModuleID = "{header.module.name}"',
+            f'target triple = "{header.module.triple}"',
+            f'target datalayout = "{header.module.data_layout}"',
+            '',
+        ]
+        lines += types.values()
+        lines += global_lines
+        lines += [text for name, text in declares.items() if name not in defined]
+        lines += define_lines
+        lines += metadata_lines
+        return '\n'.join(lines)
+
+    def _lookup(self, kind, key):
+        value = self.memory_cache.get((kind, key))
+        if value is None and self.use_disk_cache:
+            path = os.path.join(cache_dir('incremental'), f'{key}.{kind}.json')
+            if os.path.exists(path):
+                with open(path) as f:
+                    value = json.load(f)
+                self.memory_cache[kind, key] = value
+        return value
+
+    def _store(self, kind, key, value):
+        self.memory_cache[kind, key] = value
+        if self.use_disk_cache:
+            write_atomic(os.path.join(cache_dir('incremental'), f'{key}.{kind}.json'),
+                         json.dumps(value).encode())
+
+def _renumber_metadata(offset):
+    def renumber(text):
+        if not offset:
+            return text
+        return _METADATA_REF.sub(lambda match: f'!{int(match.group(1)) + offset}', text)
+    return renumber
+
+def _phase(stats, name):
+    return stats.phase(name) if stats else nullcontext()
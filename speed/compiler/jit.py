@@ -0,0 +1,127 @@
+import ctypes
+import json
+import os
+from contextlib import nullcontext
+import llvmlite.binding as llvm
+from llvmlite import ir
+from .backend import Backend
+from .cache import cache_dir, cache_key, write_atomic
+
+FLUSH_SYMBOL = 'speed.io.flush'
+
+# ctypes equivalents of the return types main may be declared with
+MAIN_RETURN_TYPES = {
+    'void': None,
+    'i1': ctypes.c_bool,
+    'i32': ctypes.c_int32,
+    'i64': ctypes.c_int64,
+    'double': ctypes.c_double,
+}
+
+class JITProgram:
+    """A program loaded into an MCJIT engine, ready to have main called."""
+
+    def __init__(self, engine, main_address, return_type):
+        # The engine owns the code pages, so it must outlive every call
+        self.engine = engine
+        self.return_type = return_type
+        restype = MAIN_RETURN_TYPES[return_type]
+        self.main = ctypes.CFUNCTYPE(restype)(main_address)
+        # Static destructors do not run for loaded objects, so the buffered
+        # stdout writer (if the program uses it) is flushed by hand
+        flush_address = engine.get_function_address(FLUSH_SYMBOL)
+        self.flush = ctypes.CFUNCTYPE(None)(flush_address) if flush_address else None
+
+    def run(self):
+        """Call main and return a process exit code."""
+        result = self.main()
+        if self.flush:
+            self.flush()
+        _flush_c_stdio()
+        if self.return_type == 'void' or result is None:
+            return 0
+        return int(result) & 0xFF
+
+class JIT:
+    """Compiles Speed source in process with MCJIT.
+
+    Machine code for each (source, optimization level, compiler options,
+    host CPU, compiler version) is cached on disk as an object file, so
+    rerunning an unchanged program skips lexing, parsing, codegen and
+    optimization and only has to load and relocate the object.
+    """
+
+    def __init__(self, compiler=None, opt_level='2', use_cache=True):
+        if compiler is None:
+            from .compiler import Compiler
+            compiler = Compiler()
+        self.compiler = compiler
+        self.backend = Backend(opt_level, jit=True)
+        self.use_cache = use_cache
+
+    def cache_paths(self, source_code):
+        key = cache_key(source_code, self.backend.opt_level, llvm.get_host_cpu_name(),
+                        llvm.get_host_cpu_features().flatten(), json.dumps(self.compiler.options()))
+        base = os.path.join(cache_dir('jit'), key)
+        return base + '.o', base + '.json'
+
+    def load(self, source_code, stats=None):
+        """Return a JITProgram for the source, compiling it only on a cache miss."""
+        object_path = info_path = None
+        if self.use_cache:
+            object_path, info_path = self.cache_paths(source_code)
+            if os.path.exists(object_path) and os.path.exists(info_path):
+                with _phase(stats, 'load'):
+                    with open(info_path) as f:
+                        info = json.load(f)
+                    with open(object_path, 'rb') as f:
+                        return self._load_object(f.read(), info)
+
+        if stats:
+            module, _ = self.compiler.compile(source_code, stats=stats)
+        else:
+            module = self.compiler.compile(source_code)
+        info = {'main_return': _main_return_type(module)}
+
+        with _phase(stats, 'optimize'):
+            llvm_module = self.backend.compile(module)
+
+        with _phase(stats, 'emit'):
+            object_code = self.backend.emit_object(llvm_module)
+
+        if object_path:
+            write_atomic(object_path, object_code)
+            write_atomic(info_path, json.dumps(info).encode())
+
+        with _phase(stats, 'load'):
+            return self._load_object(object_code, info)
+
+    def _load_object(self, object_code, info):
+        engine = llvm.create_mcjit_compiler(llvm.parse_assembly(""), self.backend.target_machine)
+        engine.add_object_file(llvm.ObjectFileRef.from_data(object_code))
+        engine.finalize_object()
+        return JITProgram(engine, engine.get_function_address('main'), info['main_return'])
+
+    def run(self, source_code, stats=None):
+        return self.load(source_code, stats=stats).run()
+
+def _phase(stats, name):
+    return stats.phase(name) if stats else nullcontext()
+
+def _main_return_type(module):
+    try:
+        main = module.get_global('main')
+    except KeyError:
+        main = None
+    if not isinstance(main, ir.Function):
+        raise ValueError("Program has no main function")
+    if main.args:
+        raise ValueError("main must not take parameters when run with the JIT")
+    return_type = str(main.function_type.return_type)
+    if return_type not in MAIN_RETURN_TYPES:
+        raise ValueError(f"Unsupported return type for main: {return_type}")
+    return return_type
+
+def _flush_c_stdio():
+    # JIT-compiled code writes through the C library's stdio buffers
+    ctypes.CDLL(None).fflush(None)
@@ -1,9 +1,132 @@
+import re
 from rply import LexerGenerator
+from rply.errors import LexingError
+from rply.token import SourcePosition, Token
+
+# Reserved words; anything else matching the identifier pattern is an IDENTIFIER
+KEYWORDS = {
+    'fn': 'FUNCTION',
+    'class': 'CLASS',
+    'let': 'LET',
+    'const': 'CONST',
+    'if': 'IF',
+    'else': 'ELSE',
+    'while': 'WHILE',
+    'for': 'FOR',
+    'return': 'RETURN',
+    'import': 'IMPORT',
+    'from': 'FROM',
+    'as': 'AS',
+    'public': 'PUBLIC',
+    'private': 'PRIVATE',
+    'protected': 'PROTECTED',
+    'static': 'STATIC',
+    'async': 'ASYNC',
+    'await': 'AWAIT',
+    'new': 'NEW',
+    'arena': 'ARENA',
+    'int': 'TYPE_INT',
+    'float': 'TYPE_FLOAT',
+    'string': 'TYPE_STRING',
+    'bool': 'TYPE_BOOL',
+    'void': 'TYPE_VOID',
+    'any': 'TYPE_ANY',
+    'true': 'BOOLEAN',
+    'false': 'BOOLEAN',
+}
+
+# Operators and delimiters, longest first so the alternation is maximal munch
+OPERATORS = {
+    '==': 'EQUALS',
+    '!=': 'NOT_EQUALS',
+    '<=': 'LESS_EQUALS',
+    '>=': 'GREATER_EQUALS',
+    '&&': 'AND',
+    '||': 'OR',
+    '|>': 'PIPE',
+    '=>': 'ARROW',
+    '+': 'PLUS',
+    '-': 'MINUS',
+    '*': 'MULTIPLY',
+    '/': 'DIVIDE',
+    '%': 'MODULO',
+    '=': 'ASSIGN',
+    '<': 'LESS_THAN',
+    '>': 'GREATER_THAN',
+    '!': 'NOT',
+    '(': 'LPAREN',
+    ')': 'RPAREN',
+    '{': 'LBRACE',
+    '}': 'RBRACE',
+    '[': 'LBRACKET',
+    ']': 'RBRACKET',
+    ',': 'COMMA',
+    ':': 'COLON',
+    ';': 'SEMICOLON',
+    '.': 'DOT',
+    '#': 'HASH',
+}
+
+class RegexLexer:
+    """Single-pass lexer driven by one combined master pattern.
+
+    Every rule is an alternative of a single compiled regex, so each token
+    costs one match attempt instead of one per rule. Keywords are matched as
+    identifiers and resolved through KEYWORDS, and operators through
+    OPERATORS. Tokens are rply Tokens, produced lazily.
+    """
+
+    pattern = re.compile('|'.join([
+        r'(?P<SKIP>(?:\s+|//[^\n]*|/\*[\s\S]*?\*/)+)',
+        r'(?P<FLOAT>\d+\.\d+)',
+        r'(?P<INTEGER>\d+)',
+        r'(?P<STRING>"[^"]*")',
+        r'(?P<NAME>[a-zA-Z_][a-zA-Z0-9_]*)',
+        '(?P<OP>' + '|'.join(re.escape(op) for op in OPERATORS) + ')',
+        r'(?P<ERROR>.)',
+    ]))
+
+    def lex(self, source):
+        keywords = KEYWORDS
+        operators = OPERATORS
+        lineno = 1
+        line_start = 0
+        for match in self.pattern.finditer(source):
+            kind = match.lastgroup
+            value = match.group()
+            start = match.start()
+            if kind == 'SKIP':
+                newlines = value.count('\n')
+                if newlines:
+                    lineno += newlines
+                    line_start = start + value.rindex('\n') + 1
+                continue
+            if kind == 'NAME':
+                kind = keywords.get(value, 'IDENTIFIER')
+            elif kind == 'OP':
+                kind = operators[value]
+            elif kind == 'ERROR':
+                raise LexingError(f"Unexpected character {value!r}",
+                                  SourcePosition(start, lineno, start - line_start + 1))
+            yield Token(kind, value, SourcePosition(start, lineno, start - line_start + 1))
+            if kind == 'STRING' and '\n' in value:
+                lineno += value.count('\n')
+                line_start = start + value.rindex('\n') + 1
 
 class Lexer:
-    def __init__(self):
-        self.lexer = LexerGenerator()
-        self._add_tokens()
+    # 'regex' is the combined single-pass engine above; 'rply' keeps the
+    # original rule-by-rule LexerGenerator for comparison.
+    BACKENDS = ('regex', 'rply')
+
+    def __init__(self, backend='regex'):
+        if backend not in self.BACKENDS:
+            raise ValueError(f"Unknown lexer backend: {backend}")
+        self.backend = backend
+        if backend == 'rply':
+            self.lexer = LexerGenerator()
+            self._add_tokens()
+        else:
+            self.lexer = RegexLexer()
 
     def _add_tokens(self):
         # Keywords
@@ -26,6 +149,7 @@ class Lexer:
         self.lexer.add('ASYNC', r'async')
         self.lexer.add('AWAIT', r'await')
         self.lexer.add('NEW', r'new')
+        self.lexer.add('ARENA', r'arena')
 
         # Types
         self.lexer.add('TYPE_INT', r'int')
@@ -72,6 +196,7 @@ class Lexer:
         self.lexer.add('COLON', r':')
         self.lexer.add('SEMICOLON', r';')
         self.lexer.add('DOT', r'\.')
+        self.lexer.add('HASH', r'#')
 
         # Ignore whitespace
         self.lexer.ignore(r'\s+')
@@ -79,4 +204,6 @@ class Lexer:
         self.lexer.ignore(r'/\*[\s\S]*?\*/')
 
     def get_lexer(self):
-        return self.lexer.build() 
\ No newline at end of file
+        if self.backend == 'rply':
+            return self.lexer.build()
+        return self.lexer 
\ No newline at end of file
@@ -0,0 +1,505 @@
+import math
+from collections import Counter
+from .ast import (
+    ArenaStatement, Assignment, AwaitExpression, Call, ClassDeclaration, ForStatement,
+    FunctionDeclaration, Identifier, IfStatement, IndexAssignment, Literal, MemberAccess,
+    MemberAssignment, NewExpression, Node, ReturnStatement, Statement, VariableDeclaration,
+    WhileStatement, children, clone, method_name, walk,
+)
+from .visitor import NodeTransformer, NodeVisitor
+
+# Largest callee, in AST nodes of its return expression, inlined without #[inline]
+INLINE_THRESHOLD = 16
+
+def _wrap_i64(value):
+    # int is i64 in codegen, so folded arithmetic wraps the way the IR would
+    return (value + 2**63) % 2**64 - 2**63
+
+def _sdiv(a, b):
+    # LLVM's sdiv truncates toward zero, Python's // floors
+    quotient = abs(a) // abs(b)
+    return quotient if (a < 0) == (b < 0) else -quotient
+
+def _srem(a, b):
+    return a - b * _sdiv(a, b)
+
+INT_FOLDS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': _sdiv,
+    '%': _srem,
+}
+
+FLOAT_FOLDS = {
+    '+': lambda a, b: a + b,
+    '-': lambda a, b: a - b,
+    '*': lambda a, b: a * b,
+    '/': lambda a, b: a / b,
+    '%': math.fmod,
+}
+
+COMPARISON_FOLDS = {
+    '==': lambda a, b: a == b,
+    '!=': lambda a, b: a != b,
+    '<': lambda a, b: a < b,
+    '>': lambda a, b: a > b,
+    '<=': lambda a, b: a <= b,
+    '>=': lambda a, b: a >= b,
+}
+
+def _kind(node):
+    """'int', 'float' or 'bool' for a numeric Literal, otherwise None."""
+    if not isinstance(node, Literal):
+        return None
+    if isinstance(node.value, bool):
+        return 'bool'
+    if isinstance(node.value, int):
+        return 'int'
+    if isinstance(node.value, float):
+        return 'float'
+    return None
+
+def _terminates(statement):
+    """Whether control never continues past the statement."""
+    if isinstance(statement, ReturnStatement):
+        return True
+    if isinstance(statement, ArenaStatement):
+        return any(_terminates(stmt) for stmt in statement.body)
+    if isinstance(statement, IfStatement) and statement.else_branch:
+        return (any(_terminates(stmt) for stmt in statement.then_branch)
+                and any(_terminates(stmt) for stmt in statement.else_branch))
+    return False
+
+class ConstantFolder(NodeTransformer):
+    """Folds constant expressions and removes dead code before codegen.
+
+    Arithmetic and comparisons on two literals of the same type become a
+    literal (division by zero is left for the program to hit at run time),
+    `if` statements with a constant condition are replaced by the branch
+    taken, loops whose condition is constant false disappear, and
+    statements after a return (or an if/else whose branches all return)
+    are dropped.
+    """
+
+    def __init__(self):
+        self.folded = 0
+        self.removed = 0
+
+    def visit_BinaryOp(self, node):
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        kind = _kind(node.left)
+        if kind is None or kind != _kind(node.right):
+            return node
+        a, b = node.left.value, node.right.value
+
+        if node.op in COMPARISON_FOLDS:
+            if kind == 'bool' and node.op not in ('==', '!='):
+                return node
+            return self._literal(COMPARISON_FOLDS[node.op](a, b), node)
+        if kind == 'bool' or node.op not in INT_FOLDS:
+            return node
+        if node.op in ('/', '%') and b == 0:
+            return node
+        if kind == 'int':
+            return self._literal(_wrap_i64(INT_FOLDS[node.op](a, b)), node)
+        return self._literal(FLOAT_FOLDS[node.op](a, b), node)
+
+    def visit_UnaryOp(self, node):
+        node.operand = self.visit(node.operand)
+        if node.op == 'NOT' and _kind(node.operand) == 'bool':
+            return self._literal(not node.operand.value, node)
+        return node
+
+    def visit_IfStatement(self, node):
+        node = self.generic_visit(node)
+        if _kind(node.condition) != 'bool':
+            return node
+        self.removed += 1
+        if node.condition.value:
+            return node.then_branch
+        return node.else_branch or None
+
+    def visit_WhileStatement(self, node):
+        node = self.generic_visit(node)
+        if _kind(node.condition) == 'bool' and not node.condition.value:
+            self.removed += 1
+            return None
+        return node
+
+    def visit_ForStatement(self, node):
+        node = self.generic_visit(node)
+        if _kind(node.condition) == 'bool' and not node.condition.value:
+            # The initializer still runs once
+            self.removed += 1
+            return [node.initializer]
+        return node
+
+    def transform_list(self, items):
+        items = super().transform_list(items)
+        for index, item in enumerate(items):
+            if _terminates(item):
+                self.removed += len(items) - index - 1
+                return items[:index + 1]
+        return items
+
+    def _literal(self, value, node):
+        self.folded += 1
+        literal = Literal(value)
+        literal.type = node.type
+        literal.start = node.start
+        literal.length = node.length
+        return literal
+
+def fold_constants(node):
+    """Run ConstantFolder over an AST, returning the transformed tree."""
+    return ConstantFolder().visit(node)
+
+def _has_effects(node):
+    return any(isinstance(child, (Call, Assignment, IndexAssignment, MemberAssignment, NewExpression,
+                                  AwaitExpression))
+               for child in walk(node))
+
+def _uses(node, name):
+    return sum(1 for child in walk(node) if isinstance(child, Identifier) and child.name == name)
+
+class _Substitute(NodeTransformer):
+    """Replaces parameter references in a cloned callee body with arguments."""
+
+    def __init__(self, arguments):
+        self.arguments = arguments
+
+    def visit_Identifier(self, node):
+        if node.name in self.arguments:
+            return clone(self.arguments[node.name])
+        return node
+
+class Inliner(NodeTransformer):
+    """Expands calls to small functions in place at the Speed level.
+
+    A function is inlined when its body is a single `return <expression>;`
+    whose expression has at most `threshold` nodes (any size with
+    #[inline]) and it is not marked #[noinline]. The arguments are
+    substituted for the parameters, which is only done when it cannot
+    change what the program computes: an argument that calls or assigns
+    must be used exactly once, be the only such argument and go into a
+    body that calls nothing itself, and an argument that is not a literal
+    or a variable may not be duplicated.
+    Calls inside an inlined body are expanded in turn, except recursive
+    ones. Runs after the type checker, whose types the copies keep.
+    """
+
+    def __init__(self, threshold=INLINE_THRESHOLD):
+        self.threshold = threshold
+        self.candidates = {}  # Function name -> (parameter names, return expression)
+        self.expanded = {}  # Function name -> expression with nested calls inlined
+        self.expanding = set()
+        self.inlined = 0
+
+    def visit_Program(self, node):
+        for stmt in node.statements:
+            if isinstance(stmt, FunctionDeclaration):
+                self.consider(stmt)
+        return self.generic_visit(node)
+
+    def consider(self, node):
+        """Record a declaration as an inlining candidate if it qualifies."""
+        hints = {attribute.name for attribute in node.attributes}
+        if 'noinline' in hints or node.is_async or len(node.body) != 1:
+            # An async fn's calls make tasks rather than compute its result
+            return
+        stmt = node.body[0]
+        if not isinstance(stmt, ReturnStatement):
+            return
+        nodes = list(walk(stmt.expression))
+        if len(nodes) > self.threshold and 'inline' not in hints:
+            return
+        if any(isinstance(child, AwaitExpression) for child in nodes):
+            # Awaiting in a caller that is async suspends it instead of
+            # running the event loop
+            return
+        if any(isinstance(child, MemberAccess) for child in nodes):
+            # The object of a member access is a variable name, not an
+            # expression a parameter could be substituted into
+            return
+        self.candidates[node.name] = ([param.name for param in node.parameters], stmt.expression)
+
+    def visit_Call(self, node):
+        node.arguments = self.transform_list(node.arguments)
+        expression = self.expand(node.function)
+        if expression is None:
+            return node
+        parameters, _ = self.candidates[node.function]
+        if not self._substitutable(parameters, node.arguments, expression):
+            return node
+        body = _Substitute(dict(zip(parameters, node.arguments))).visit(clone(expression))
+        body.start = node.start
+        body.length = node.length
+        self.inlined += 1
+        return body
+
+    def expand(self, name):
+        """A candidate's return expression with its own calls inlined, or None."""
+        if name not in self.candidates or name in self.expanding:
+            return None
+        if name not in self.expanded:
+            _, expression = self.candidates[name]
+            self.expanding.add(name)
+            self.expanded[name] = self.visit(clone(expression))
+            self.expanding.discard(name)
+        return self.expanded[name]
+
+    def _substitutable(self, parameters, arguments, expression):
+        effects = 0
+        for name, argument in zip(parameters, arguments):
+            uses = _uses(expression, name)
+            if _has_effects(argument):
+                effects += 1
+                if uses != 1:
+                    return False
+            elif uses > 1 and not isinstance(argument, (Literal, Identifier)):
+                return False
+        # With a call in the arguments, anything else that may have effects
+        # could end up running in a different order
+        return effects == 0 or (effects == 1 and not _has_effects(expression))
+
+def inline_calls(node, threshold=INLINE_THRESHOLD):
+    """Run Inliner over an AST, returning the transformed tree."""
+    return Inliner(threshold).visit(node)
+
+class RetainElider(NodeVisitor):
+    """Marks the object references in a function that need no counting.
+
+    Codegen gives every variable holding an object a reference of its own
+    and retains each object passed to a call until the call is over. No
+    other function can change a function's variables, so within one
+    function much of that is redundant:
+
+    - a parameter that is never assigned is kept alive by the caller for
+      the whole call, except in an async fn, which outlives the call;
+    - a variable declared once and never assigned, from such a parameter or
+      from a variable declared once outside any loop and never assigned,
+      names the same object for as long as that one does;
+    - a variable passed to a call keeps its object alive until the call
+      returns, unless the arguments themselves assign to it.
+
+    Those Parameters, VariableDeclarations and Identifiers are marked
+    `borrowed`, and codegen leaves out their retains and releases. Objects
+    read from fields are always counted: a call may store into the field
+    and drop the object it held.
+    """
+
+    def __init__(self):
+        self.borrowed = 0
+
+    def visit_FunctionDeclaration(self, node):
+        nodes = list(walk(node.body))
+        assigned = {child.name for child in nodes if isinstance(child, Assignment)}
+        declarations = [child for child in nodes if isinstance(child, VariableDeclaration)]
+        declared = Counter(declaration.name for declaration in declarations)
+        in_loops = {
+            child.name for loop in nodes if isinstance(loop, (WhileStatement, ForStatement))
+            for child in walk(loop.body) if isinstance(child, VariableDeclaration)
+        }
+
+        unchanging = set()
+        for param in node.parameters:
+            if param.name not in assigned:
+                if not node.is_async:
+                    self._borrow(param)
+                unchanging.add(param.name)
+        for declaration in declarations:
+            if declaration.name in assigned or declared[declaration.name] != 1:
+                continue
+            initializer = declaration.initializer
+            if isinstance(initializer, Identifier) and initializer.name in unchanging:
+                self._borrow(declaration)
+            if declaration.name not in in_loops:
+                unchanging.add(declaration.name)
+
+        variables = {param.name for param in node.parameters} | set(declared)
+        for call in nodes:
+            if not isinstance(call, (Call, NewExpression)):
+                continue
+            reassigned = {child.name for child in walk(call.arguments)
+                          if isinstance(child, Assignment)}
+            for argument in call.arguments:
+                if (isinstance(argument, Identifier) and argument.name in variables
+                        and argument.name not in reassigned):
+                    self._borrow(argument)
+
+    def _borrow(self, node):
+        node.borrowed = True
+        self.borrowed += 1
+
+class EscapeAnalysis(NodeVisitor):
+    """Finds the objects made with `new` that never outlive the function
+    that makes them, so codegen can put them in its stack frame.
+
+    An object escapes when it is returned, stored in a variable or field
+    (other than the one variable a `let` makes it for), or passed to a
+    function that lets the parameter escape. Reading and assigning its
+    fields and calling its methods do not let it escape. Which parameters
+    escape is worked out for every function of the program together,
+    assuming none do and adding those that do until nothing changes, so
+    recursive functions are handled; a call to a function that is not in
+    the program lets every argument escape, as does a call to an async fn,
+    whose task may run on after the caller has returned.
+
+    Objects of classes with object fields stay on the heap: nothing would
+    release the objects in their fields. The NewExpressions found are
+    marked `stack`, and the variables holding them and their uses as
+    arguments `borrowed`, so they are not reference counted either.
+    """
+
+    def __init__(self):
+        self.stack_allocated = 0
+
+    def visit_Program(self, node):
+        classes = {stmt.name: stmt for stmt in node.statements if isinstance(stmt, ClassDeclaration)}
+        functions = [stmt for stmt in node.statements if isinstance(stmt, FunctionDeclaration)]
+        for declaration in classes.values():
+            functions += [member for member in declaration.members
+                          if isinstance(member, FunctionDeclaration)]
+        names = Counter(function.name for function in functions)
+        # Overloads share a name, so their calls cannot be told apart here
+        self.functions = {function.name: function for function in functions
+                          if names[function.name] == 1}
+        self.escaping = {name: set() for name in self.functions}
+        changed = True
+        while changed:
+            changed = False
+            for name, function in self.functions.items():
+                self._scan(function)
+                escaping = {index for index, param in enumerate(function.parameters)
+                            if param.name in self.escaped or function.is_async}
+                if escaping != self.escaping[name]:
+                    self.escaping[name] = escaping
+                    changed = True
+
+        self.movable = {
+            name for name, declaration in classes.items()
+            if not any(isinstance(member, VariableDeclaration) and member.type.name in classes
+                       for member in declaration.members)
+            and 0 not in self.escaping.get(method_name(name, 'init'), ())
+            and (method_name(name, 'init') in self.functions
+                 or names[method_name(name, 'init')] == 0)
+        }
+        for function in functions:
+            self._mark(function)
+        return node
+
+    def _scan(self, function):
+        self.escaped = set()  # Variables whose object escapes
+        self.assigned = set()
+        self.contained = []  # NewExpressions whose object does not escape
+        self.declared = {}  # Variable -> the NewExpressions declaring it
+        self.arguments = []  # Identifiers passed where they do not escape
+        for stmt in function.body:
+            self._statement(stmt)
+
+    def _mark(self, function):
+        self._scan(function)
+        objects = list(self.contained)
+        stack_variables = set()
+        for name, news in self.declared.items():
+            if len(news) != 1 or name in self.escaped or name in self.assigned:
+                continue
+            declaration, new = news[0]
+            if new is not None and new.class_name in self.movable:
+                stack_variables.add(name)
+                declaration.borrowed = True
+                objects.append(new)
+        for new in objects:
+            if new.class_name in self.movable:
+                new.stack = True
+                self.stack_allocated += 1
+        for argument in self.arguments:
+            if argument.name in stack_variables:
+                argument.borrowed = True
+
+    def _statement(self, node):
+        if isinstance(node, NewExpression):
+            # Made and thrown away
+            self._contain(node)
+        elif isinstance(node, Node):
+            self.visit(node)
+
+    def _contain(self, node):
+        self.contained.append(node)
+        self._new_arguments(node)
+
+    def _argument(self, node):
+        """Visit an expression whose object, if any, does not escape."""
+        if isinstance(node, Identifier):
+            self.arguments.append(node)
+        elif isinstance(node, NewExpression):
+            self._contain(node)
+        elif isinstance(node, str):
+            pass
+        else:
+            self.visit(node)
+
+    def _call_arguments(self, name, arguments):
+        escaping = self.escaping.get(name)
+        for index, argument in enumerate(arguments):
+            if escaping is None or index in escaping:
+                self.visit(argument)
+            else:
+                self._argument(argument)
+
+    def _new_arguments(self, node):
+        init = method_name(node.class_name, 'init')
+        if init in self.functions:
+            # The object itself is the init's first parameter
+            escaping = {index - 1 for index in self.escaping[init]}
+            for index, argument in enumerate(node.arguments):
+                if index in escaping:
+                    self.visit(argument)
+                else:
+                    self._argument(argument)
+        else:
+            # Stored in the fields
+            for argument in node.arguments:
+                self.visit(argument)
+
+    def generic_visit(self, node):
+        for value in children(node):
+            if isinstance(value, list):
+                for item in value:
+                    if isinstance(node, Statement):
+                        self._statement(item)
+                    elif isinstance(item, Node):
+                        self.visit(item)
+            elif isinstance(value, Node):
+                self.visit(value)
+
+    def visit_Identifier(self, node):
+        self.escaped.add(node.name)
+
+    def visit_NewExpression(self, node):
+        self._new_arguments(node)
+
+    def visit_Call(self, node):
+        self._call_arguments(node.function, node.arguments)
+
+    def visit_MemberAccess(self, node):
+        self._argument(node.object_name)
+
+    def visit_MemberAssignment(self, node):
+        self._argument(node.object_name)
+        self.visit(node.value)
+
+    def visit_Assignment(self, node):
+        self.assigned.add(node.name)
+        self.visit(node.value)
+
+    def visit_VariableDeclaration(self, node):
+        if isinstance(node.initializer, NewExpression):
+            self.declared.setdefault(node.name, []).append((node, node.initializer))
+            self._new_arguments(node.initializer)
+        else:
+            self.declared.setdefault(node.name, []).append((node, None))
+            if node.initializer is not None:
+                self.visit(node.initializer)
@@ -1,13 +1,55 @@
+import warnings
 from rply import ParserGenerator
+from rply.errors import ParserGeneratorWarning
 from .ast import *
-import logging
 
-logging.basicConfig(level=logging.DEBUG)
-logger = logging.getLogger(__name__)
+def _start(item):
+    if isinstance(item, Node):
+        return item.start
+    if isinstance(item, list):
+        return _start(item[0]) if item else None
+    source_pos = getattr(item, 'source_pos', None)
+    return source_pos.idx if source_pos else None
+
+def _end(item):
+    if isinstance(item, Node):
+        return item.end
+    if isinstance(item, list):
+        return _end(item[-1]) if item else None
+    source_pos = getattr(item, 'source_pos', None)
+    return source_pos.idx + len(item.getstr()) if source_pos else None
+
+def _set_span(node, first, last):
+    start = _start(first)
+    end = _end(last)
+    if start is not None and end is not None:
+        node.start = start
+        node.length = end - start
+
+def _with_span(func):
+    # Nodes made by a production span the symbols it matched; nodes passed
+    # through from a sub-production keep the span they already have
+    def production(p):
+        node = func(p)
+        if isinstance(node, Node) and node.start is None and p:
+            _set_span(node, p[0], p[-1])
+        return node
+    return production
 
 class Parser:
+    # Cache id handed to rply: built LALR tables are stored on disk under the
+    # user cache directory, keyed by a hash of the grammar, so only the first
+    # run after a grammar change pays for table generation.
+    CACHE_ID = "speed-parser"
+
+    # The built LRParser is stateless between parses, so one instance is
+    # shared by every Parser (and therefore every Compiler) in the process.
+    _shared_parser = None
+
     def __init__(self):
-        logger.debug("Initializing parser")
+        self.pg = None
+
+    def _create_generator(self):
         self.pg = ParserGenerator(
             # A list of all token names, accepted by the parser.
             ['INTEGER', 'FLOAT', 'STRING', 'BOOLEAN', 'IDENTIFIER',
@@ -16,59 +58,129 @@ class Parser:
              'LESS_EQUALS', 'GREATER_EQUALS', 'AND', 'OR', 'NOT',
              'PIPE', 'ARROW',
              'LPAREN', 'RPAREN', 'LBRACE', 'RBRACE', 'LBRACKET', 'RBRACKET',
-             'COMMA', 'COLON', 'SEMICOLON', 'DOT',
+             'COMMA', 'COLON', 'SEMICOLON', 'DOT', 'HASH',
              'FUNCTION', 'CLASS', 'LET', 'CONST', 'IF', 'ELSE', 'WHILE',
              'FOR', 'RETURN', 'IMPORT', 'FROM', 'AS', 'PUBLIC', 'PRIVATE',
-             'PROTECTED', 'STATIC', 'ASYNC', 'AWAIT', 'NEW',
+             'PROTECTED', 'STATIC', 'ASYNC', 'AWAIT', 'NEW', 'ARENA',
              'TYPE_INT', 'TYPE_FLOAT', 'TYPE_STRING', 'TYPE_BOOL',
              'TYPE_VOID', 'TYPE_ANY'],
+            # Lowest precedence first
             precedence=[
+                ('left', ['AND', 'OR']),
+                ('left', ['EQUALS', 'NOT_EQUALS', 'LESS_THAN', 'GREATER_THAN', 'LESS_EQUALS', 'GREATER_EQUALS']),
                 ('left', ['PLUS', 'MINUS']),
                 ('left', ['MULTIPLY', 'DIVIDE', 'MODULO']),
-                ('left', ['EQUALS', 'NOT_EQUALS', 'LESS_THAN', 'GREATER_THAN', 'LESS_EQUALS', 'GREATER_EQUALS']),
-                ('left', ['AND', 'OR']),
-            ]
+                # `await f() + 1` awaits the call, `await a.f()` the method call
+                ('right', ['AWAIT']),
+                # Postfix member access and indexing bind tightest
+                ('left', ['DOT', 'LBRACKET']),
+            ],
+            cache_id=self.CACHE_ID
         )
-        logger.debug("Setting up grammar")
         self._setup_grammar()
+        self.pg.productions = [
+            (name, symbols, _with_span(func), precedence)
+            for name, symbols, func, precedence in self.pg.productions
+        ]
 
     def _setup_grammar(self):
-        logger.debug("Setting up grammar rules")
         @self.pg.production('program : statements')
         def program(p):
-            logger.debug("Parsing program")
             return Program(p[0])
 
         @self.pg.production('statements : statement')
         @self.pg.production('statements : statements statement')
         def statements(p):
-            logger.debug(f"Parsing statements, length: {len(p)}")
             if len(p) == 1:
                 return [p[0]]
-            return p[0] + [p[1]]
+            p[0].append(p[1])
+            return p[0]
 
         @self.pg.production('statement : import_statement')
         @self.pg.production('statement : function_declaration')
         @self.pg.production('statement : class_declaration')
         @self.pg.production('statement : variable_declaration')
         @self.pg.production('statement : return_statement')
+        @self.pg.production('statement : assignment_statement')
+        @self.pg.production('statement : if_statement')
+        @self.pg.production('statement : loop_statement')
+        @self.pg.production('statement : arena_statement')
         @self.pg.production('statement : expression')
+        @self.pg.production('statement : expression SEMICOLON')
         def statement(p):
-            logger.debug(f"Parsing statement of type: {type(p[0]).__name__}")
             return p[0]
 
+        @self.pg.production('statement : attributes loop_statement')
+        @self.pg.production('statement : attributes function_declaration')
+        def attributed_statement(p):
+            p[1].attributes = p[0]
+            return p[1]
+
+        @self.pg.production('attributes : attribute_group')
+        @self.pg.production('attributes : attributes attribute_group')
+        def attributes(p):
+            if len(p) == 1:
+                return p[0]
+            p[0].extend(p[1])
+            return p[0]
+
+        @self.pg.production('attribute_group : HASH LBRACKET attribute_list RBRACKET')
+        def attribute_group(p):
+            return p[2]
+
+        @self.pg.production('attribute_list : attribute')
+        @self.pg.production('attribute_list : attribute_list COMMA attribute')
+        def attribute_list(p):
+            if len(p) == 1:
+                return [p[0]]
+            p[0].append(p[2])
+            return p[0]
+
+        @self.pg.production('attribute : IDENTIFIER')
+        @self.pg.production('attribute : IDENTIFIER LPAREN INTEGER RPAREN')
+        def attribute(p):
+            if len(p) == 1:
+                return Attribute(p[0].getstr())
+            return Attribute(p[0].getstr(), [int(p[2].getstr())])
+
+        @self.pg.production('assignment_statement : assignment SEMICOLON')
+        def assignment_statement(p):
+            return p[0]
+
+        @self.pg.production('assignment : IDENTIFIER ASSIGN expression')
+        @self.pg.production('assignment : index ASSIGN expression')
+        @self.pg.production('assignment : member_access ASSIGN expression')
+        def assignment(p):
+            if isinstance(p[0], Index):
+                return IndexAssignment(p[0].array, p[0].index, p[2])
+            if isinstance(p[0], MemberAccess):
+                return MemberAssignment(p[0].object_name, p[0].member_name, p[2])
+            return Assignment(p[0].getstr(), p[2])
+
+        @self.pg.production('index : expression LBRACKET expression RBRACKET')
+        def index(p):
+            return Index(p[0], p[2])
+
         @self.pg.production('expression : IDENTIFIER')
+        def identifier(p):
+            return Identifier(p[0].getstr())
+
         @self.pg.production('expression : literal')
         @self.pg.production('expression : binary_operation')
         @self.pg.production('expression : unary_operation')
         @self.pg.production('expression : function_call')
         @self.pg.production('expression : member_access')
+        @self.pg.production('expression : index')
         @self.pg.production('expression : new_expression')
+        @self.pg.production('expression : await_expression')
         @self.pg.production('expression : LPAREN expression RPAREN')
         def expression(p):
-            logger.debug(f"Parsing expression: {[token.gettokentype() if hasattr(token, 'gettokentype') else type(token) for token in p]}")
             if len(p) == 3:  # Parenthesized expression
-                return p[1]
+                # The parentheses belong to the span, so enclosing nodes cover them
+                node = p[1]
+                if isinstance(node, Node):
+                    _set_span(node, p[0], p[2])
+                return node
             return p[0]
 
         @self.pg.production('literal : INTEGER')
@@ -76,12 +188,20 @@ class Parser:
         @self.pg.production('literal : STRING')
         @self.pg.production('literal : BOOLEAN')
         def literal(p):
+            token_type = p[0].gettokentype()
+            if token_type == 'INTEGER':
+                return Literal(int(p[0].value))
+            elif token_type == 'FLOAT':
+                return Literal(float(p[0].value))
+            elif token_type == 'BOOLEAN':
+                return Literal(p[0].value == 'true')
             return Literal(p[0].value)
 
         @self.pg.production('binary_operation : expression PLUS expression')
         @self.pg.production('binary_operation : expression MINUS expression')
         @self.pg.production('binary_operation : expression MULTIPLY expression')
         @self.pg.production('binary_operation : expression DIVIDE expression')
+        @self.pg.production('binary_operation : expression MODULO expression')
         @self.pg.production('binary_operation : expression EQUALS expression')
         @self.pg.production('binary_operation : expression NOT_EQUALS expression')
         @self.pg.production('binary_operation : expression LESS_THAN expression')
@@ -89,12 +209,12 @@ class Parser:
         @self.pg.production('binary_operation : expression LESS_EQUALS expression')
         @self.pg.production('binary_operation : expression GREATER_EQUALS expression')
         def binary_operation(p):
-            logger.debug(f"Parsing binary operation: {p[1].gettokentype()} with operands {type(p[0])} and {type(p[2])}")
             op_map = {
                 'PLUS': '+',
                 'MINUS': '-',
                 'MULTIPLY': '*',
                 'DIVIDE': '/',
+                'MODULO': '%',
                 'EQUALS': '==',
                 'NOT_EQUALS': '!=',
                 'LESS_THAN': '<',
@@ -132,12 +252,18 @@ class Parser:
 
         @self.pg.production('member_access : expression DOT IDENTIFIER')
         def member_access(p):
-            return MemberAccess(p[0], p[2].getstr())
+            # Members are looked up on named variables
+            obj = p[0].name if isinstance(p[0], Identifier) else p[0]
+            return MemberAccess(obj, p[2].getstr())
 
         @self.pg.production('new_expression : NEW IDENTIFIER LPAREN arguments RPAREN')
         def new_expression(p):
             return NewExpression(p[1].getstr(), p[3])
 
+        @self.pg.production('await_expression : AWAIT expression')
+        def await_expression(p):
+            return AwaitExpression(p[1])
+
         @self.pg.production('variable_declaration : LET IDENTIFIER COLON type ASSIGN expression SEMICOLON')
         @self.pg.production('variable_declaration : LET IDENTIFIER ASSIGN expression SEMICOLON')
         def variable_declaration(p):
@@ -147,9 +273,34 @@ class Parser:
                 return VariableDeclaration(p[1].getstr(), None, p[3])
 
         @self.pg.production('function_declaration : FUNCTION IDENTIFIER LPAREN parameters RPAREN COLON type LBRACE statements RBRACE')
+        @self.pg.production('function_declaration : PUBLIC FUNCTION IDENTIFIER LPAREN parameters RPAREN COLON type LBRACE statements RBRACE')
         def function_declaration(p):
+            if len(p) == 11:
+                return FunctionDeclaration(p[2].getstr(), p[4], p[7], p[9], public=True)
             return FunctionDeclaration(p[1].getstr(), p[3], p[6], p[8])
 
+        # Without a return type a function returns void, like a method's init
+        @self.pg.production('function_declaration : FUNCTION IDENTIFIER LPAREN parameters RPAREN LBRACE statements RBRACE')
+        @self.pg.production('function_declaration : PUBLIC FUNCTION IDENTIFIER LPAREN parameters RPAREN LBRACE statements RBRACE')
+        def void_function_declaration(p):
+            if len(p) == 9:
+                return FunctionDeclaration(p[2].getstr(), p[4], Type('void'), p[7], public=True)
+            return FunctionDeclaration(p[1].getstr(), p[3], Type('void'), p[6])
+
+        @self.pg.production('function_declaration : ASYNC FUNCTION IDENTIFIER LPAREN parameters RPAREN COLON type LBRACE statements RBRACE')
+        @self.pg.production('function_declaration : PUBLIC ASYNC FUNCTION IDENTIFIER LPAREN parameters RPAREN COLON type LBRACE statements RBRACE')
+        @self.pg.production('function_declaration : ASYNC FUNCTION IDENTIFIER LPAREN parameters RPAREN LBRACE statements RBRACE')
+        @self.pg.production('function_declaration : PUBLIC ASYNC FUNCTION IDENTIFIER LPAREN parameters RPAREN LBRACE statements RBRACE')
+        def async_function_declaration(p):
+            public = p[0].gettokentype() == 'PUBLIC'
+            rest = p[3:] if public else p[2:]
+            if len(rest) == 9:
+                return_type, body = rest[5], rest[7]
+            else:
+                return_type, body = Type('void'), rest[5]
+            return FunctionDeclaration(rest[0].getstr(), rest[2], return_type, body, public=public,
+                                       is_async=True)
+
         @self.pg.production('parameters : parameter_list')
         @self.pg.production('parameters : ')
         def parameters(p):
@@ -175,24 +326,46 @@ class Parser:
         @self.pg.production('type : TYPE_VOID')
         @self.pg.production('type : TYPE_ANY')
         @self.pg.production('type : IDENTIFIER')
-        def type(p):
-            logger.debug(f"Parsing type: {p[0].gettokentype()}")
+        @self.pg.production('type : type LBRACKET RBRACKET')
+        def type_annotation(p):
+            if len(p) == 3:
+                return Type(p[0].name + '[]')
             return Type(p[0].getstr())
 
-        @self.pg.production('if_statement : IF LPAREN expression RPAREN LBRACE statements RBRACE')
-        @self.pg.production('if_statement : IF LPAREN expression RPAREN LBRACE statements RBRACE ELSE LBRACE statements RBRACE')
+        # Conditions need no parentheses: `if (x) {` is just a parenthesized expression
+        @self.pg.production('if_statement : IF expression LBRACE statements RBRACE')
+        @self.pg.production('if_statement : IF expression LBRACE statements RBRACE ELSE LBRACE statements RBRACE')
         def if_statement(p):
-            if len(p) == 7:
-                return IfStatement(p[2], p[5])
-            return IfStatement(p[2], p[5], p[9])
+            if len(p) == 5:
+                return IfStatement(p[1], p[3])
+            return IfStatement(p[1], p[3], p[7])
+
+        @self.pg.production('loop_statement : while_statement')
+        @self.pg.production('loop_statement : for_statement')
+        def loop_statement(p):
+            return p[0]
 
-        @self.pg.production('while_statement : WHILE LPAREN expression RPAREN LBRACE statements RBRACE')
+        @self.pg.production('while_statement : WHILE expression LBRACE statements RBRACE')
         def while_statement(p):
-            return WhileStatement(p[2], p[5])
+            return WhileStatement(p[1], p[3])
 
-        @self.pg.production('for_statement : FOR LPAREN variable_declaration expression SEMICOLON expression RPAREN LBRACE statements RBRACE')
+        @self.pg.production('for_statement : FOR LPAREN for_initializer expression SEMICOLON for_increment RPAREN LBRACE statements RBRACE')
+        @self.pg.production('for_statement : FOR for_initializer expression SEMICOLON for_increment LBRACE statements RBRACE')
         def for_statement(p):
-            return ForStatement(p[2], p[3], p[5], p[8])
+            if len(p) == 10:
+                return ForStatement(p[2], p[3], p[5], p[8])
+            return ForStatement(p[1], p[2], p[4], p[6])
+
+        @self.pg.production('for_initializer : variable_declaration')
+        @self.pg.production('for_initializer : assignment_statement')
+        @self.pg.production('for_increment : assignment')
+        @self.pg.production('for_increment : expression')
+        def for_clause(p):
+            return p[0]
+
+        @self.pg.production('arena_statement : ARENA LBRACE statements RBRACE')
+        def arena_statement(p):
+            return ArenaStatement(p[2])
 
         @self.pg.production('return_statement : RETURN expression SEMICOLON')
         def return_statement(p):
@@ -223,8 +396,8 @@ class Parser:
                 return p[0]
 
         @self.pg.production('import_statement : IMPORT LBRACE import_items RBRACE FROM STRING')
+        @self.pg.production('import_statement : IMPORT LBRACE import_items RBRACE FROM STRING SEMICOLON')
         def import_statement(p):
-            logger.debug(f"Parsing import statement with items: {p[2]}")
             return ImportStatement(p[2], p[5].getstr().strip('"'))
 
         @self.pg.production('import_items : IDENTIFIER')
@@ -232,13 +405,19 @@ class Parser:
         def import_items(p):
             if len(p) == 1:
                 return [p[0].getstr()]
-            return p[0] + [p[2].getstr()]
+            p[0].append(p[2].getstr())
+            return p[0]
 
         @self.pg.error
         def error_handle(token):
-            logger.error(f"Parser error: Unexpected token {token.gettokentype()} with value {token.getstr()}")
             raise ValueError(f"Unexpected token {token.gettokentype()} with value {token.getstr()}")
 
     def get_parser(self):
-        logger.debug("Building parser")
-        return self.pg.build() 
\ No newline at end of file
+        if Parser._shared_parser is None:
+            self._create_generator()
+            # Unused tokens and known conflicts are reported on every build,
+            # which would otherwise end up in the output of every CLI run
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', ParserGeneratorWarning)
+                Parser._shared_parser = self.pg.build()
+        return Parser._shared_parser 
\ No newline at end of file
@@ -0,0 +1,400 @@
+from .ast import (
+    Cast, ClassDeclaration, FunctionDeclaration, Identifier, Index, Literal, MemberAccess,
+    Parameter, Type, VariableDeclaration,
+)
+from .codegen import COMPARISON_OPS, STDLIB_CONSTANTS, STDLIB_FUNCTIONS, method_name
+from .visitor import NodeTransformer
+
+NUMERIC = ('int', 'float')
+# Types with a length that can be indexed, besides arrays, and the type of
+# their elements; they are read-only
+SEQUENCES = {'string': 'int', 'bytes': 'int'}
+CONDITION_TYPES = ('bool', 'int', 'float')
+
+def task_type(result_type):
+    """The type of a task an async fn returns for its result."""
+    return f"task<{result_type}>"
+
+def task_result(type_name):
+    """The result type of a task type, or None for any other type."""
+    if type_name is not None and type_name.startswith('task<') and type_name.endswith('>'):
+        return type_name[5:-1]
+    return None
+
+def converts(source, target):
+    """Whether a value of one type is implicitly accepted as another: ints
+    widen to float, and any task is a `task` (as the task modules take)."""
+    return ((source == 'int' and target == 'float')
+            or (target == 'task' and task_result(source) is not None))
+
+def literal_type(value):
+    # bool is a subclass of int, so it has to be checked first
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, int):
+        return 'int'
+    if isinstance(value, float):
+        return 'float'
+    if isinstance(value, str):
+        return 'string'
+    raise ValueError(f"Unsupported literal type: {type(value)}")
+
+class TypeChecker(NodeTransformer):
+    """Infers a static type for every expression and checks its uses.
+
+    Each Expression gets its type name in `type`: literals and annotations
+    give the types, `let` without an annotation (or annotated `any`) takes
+    the type of its initializer, and operators and calls compute theirs.
+    Where an int meets a float - mixed arithmetic, or an int passed,
+    assigned or returned where a float is declared - the int is wrapped in
+    a Cast (integer literals are converted on the spot), so codegen always
+    sees operands of the same type and never has to check at run time.
+    Every other mismatch is a ValueError.
+
+    Methods become functions named Class_method taking the object as their
+    first parameter, `this`, and method calls become calls to them with the
+    object as the first argument.
+
+    An async fn's calls have the type task<T> for its return type T, and
+    awaiting one gives a T.
+    """
+
+    def __init__(self):
+        self.functions = {}  # Function name -> [(parameter types, return type)], one per overload
+        self.classes = {}  # Class name -> {field: type}
+        self.constants = {}  # Imported constant name -> value
+        self.variables = {}
+        self.function = None
+        self.return_type = None  # What the function being checked returns
+        self.conversions = 0
+
+    def declare_function(self, node):
+        """Make a function's signature known to calls checked afterwards."""
+        parameters = [self._declared_type(param.type, f"parameter {param.name}")
+                      for param in node.parameters]
+        return_type = self._declared_type(node.return_type, f"return type of {node.name}")
+        if node.is_async:
+            if node.name == 'main':
+                raise ValueError("main cannot be async")
+            return_type = task_type(return_type)
+        self.functions[node.name] = [(parameters, return_type)]
+
+    def _declared_type(self, type_node, what):
+        if type_node.name == 'any':
+            raise ValueError(f"The {what} needs a static type")
+        return type_node.name
+
+    def declare_class(self, node):
+        """Make a class's fields and methods known, turning the methods into
+        functions that take the object as `this`."""
+        self.classes[node.name] = {
+            member.name: member.type.name for member in node.members
+            if isinstance(member, VariableDeclaration) and member.type is not None
+        }
+        members = []
+        for member in node.members:
+            if isinstance(member, FunctionDeclaration):
+                if member.name == 'init' and member.return_type.name != 'void':
+                    raise ValueError(f"The init of {node.name} cannot return a value")
+                method = FunctionDeclaration(
+                    method_name(node.name, member.name),
+                    [Parameter('this', Type(node.name))] + member.parameters,
+                    member.return_type, member.body, member.attributes, member.public,
+                    member.is_async)
+                method.start = member.start
+                method.length = member.length
+                self.declare_function(method)
+                member = method
+            members.append(member)
+        node.members = members
+
+    def visit_Program(self, node):
+        # Functions and classes may be used before they are declared
+        for stmt in node.statements:
+            if isinstance(stmt, FunctionDeclaration):
+                self.declare_function(stmt)
+            elif isinstance(stmt, ClassDeclaration):
+                self.declare_class(stmt)
+        node.statements = self.transform_list(node.statements)
+        return node
+
+    def visit_ImportStatement(self, node):
+        if node.module not in STDLIB_FUNCTIONS:
+            raise ValueError(f"Unknown module: {node.module}")
+        functions = STDLIB_FUNCTIONS[node.module]
+        constants = STDLIB_CONSTANTS.get(node.module, {})
+        for name in node.imports:
+            if name not in functions and name not in constants:
+                raise ValueError(f"Module {node.module} has no {name}")
+            if name in constants:
+                self.constants[name] = constants[name]
+            if name in functions:
+                self.functions[name] = [(parameters, return_type)
+                                        for _, return_type, parameters in functions[name]]
+        return node
+
+    def visit_FunctionDeclaration(self, node):
+        self.declare_function(node)
+        (parameters, _), = self.functions[node.name]
+        outer = (self.function, self.return_type, self.variables)
+        self.function = node.name
+        self.return_type = node.return_type.name
+        self.variables = {param.name: param_type
+                          for param, param_type in zip(node.parameters, parameters)}
+        node.body = self.transform_list(node.body)
+        self.function, self.return_type, self.variables = outer
+        return node
+
+    def visit_ClassDeclaration(self, node):
+        if node.name not in self.classes:
+            self.declare_class(node)
+        node.members = [self.visit(member) if isinstance(member, FunctionDeclaration) else member
+                        for member in node.members]
+        return node
+
+    def visit_VariableDeclaration(self, node):
+        declared = node.type.name if node.type is not None and node.type.name != 'any' else None
+        if node.initializer is None:
+            if declared is None:
+                raise ValueError(f"Cannot infer the type of {node.name} without an initializer")
+            self.variables[node.name] = declared
+            return node
+        node.initializer = self.visit(node.initializer)
+        if declared is None:
+            declared = node.initializer.type
+            if declared == 'void':
+                raise ValueError(f"Cannot assign the result of a void call to {node.name}")
+        else:
+            node.initializer = self.convert(node.initializer, declared, f"the initializer of {node.name}")
+        self.variables[node.name] = declared
+        return node
+
+    def visit_Assignment(self, node):
+        if node.name not in self.variables:
+            raise ValueError(f"Undefined variable: {node.name}")
+        node.type = self.variables[node.name]
+        node.value = self.convert(self.visit(node.value), node.type, f"the assignment to {node.name}")
+        return node
+
+    def visit_ReturnStatement(self, node):
+        if self.function is None:
+            raise ValueError("Return outside of a function")
+        return_type = self.return_type
+        node.expression = self.visit(node.expression)
+        if return_type == 'void':
+            raise ValueError(f"Function {self.function} returns void but returns a value")
+        node.expression = self.convert(node.expression, return_type, f"the return of {self.function}")
+        return node
+
+    def visit_IfStatement(self, node):
+        node = self.generic_visit(node)
+        self.check_condition(node.condition, 'if')
+        return node
+
+    def visit_WhileStatement(self, node):
+        node = self.generic_visit(node)
+        self.check_condition(node.condition, 'while')
+        return node
+
+    def visit_ForStatement(self, node):
+        node = self.generic_visit(node)
+        self.check_condition(node.condition, 'for')
+        return node
+
+    def check_condition(self, condition, statement):
+        if condition.type not in CONDITION_TYPES:
+            raise ValueError(f"The condition of {statement} cannot be {condition.type}")
+
+    def visit_Literal(self, node):
+        node.type = literal_type(node.value)
+        return node
+
+    def visit_Identifier(self, node):
+        if node.name not in self.variables and node.name in self.constants:
+            # Imported constants become literals, so they fold like any other
+            literal = Literal(self.constants[node.name])
+            literal.type = literal_type(literal.value)
+            literal.start = node.start
+            literal.length = node.length
+            return literal
+        if node.name not in self.variables:
+            raise ValueError(f"Undefined variable: {node.name}")
+        node.type = self.variables[node.name]
+        return node
+
+    def visit_Cast(self, node):
+        node.expression = self.visit(node.expression)
+        return node
+
+    def visit_BinaryOp(self, node):
+        node.left = self.visit(node.left)
+        node.right = self.visit(node.right)
+        left, right = node.left.type, node.right.type
+        if left in NUMERIC and right in NUMERIC:
+            operand_type = 'float' if 'float' in (left, right) else 'int'
+            node.left = self.convert(node.left, operand_type, f"operator {node.op}")
+            node.right = self.convert(node.right, operand_type, f"operator {node.op}")
+            node.type = 'bool' if node.op in COMPARISON_OPS else operand_type
+            return node
+        if left == right == 'bool' and node.op in ('==', '!='):
+            node.type = 'bool'
+            return node
+        raise ValueError(f"Unsupported operand types for {node.op}: {left} and {right}")
+
+    def visit_UnaryOp(self, node):
+        node.operand = self.visit(node.operand)
+        if node.op == 'NOT' and node.operand.type == 'bool':
+            node.type = 'bool'
+            return node
+        raise ValueError(f"Unsupported operand type for {node.op}: {node.operand.type}")
+
+    def visit_Call(self, node):
+        receiver = []
+        if isinstance(node.function, MemberAccess):
+            receiver = [self.method_receiver(node)]
+        elif not isinstance(node.function, str):
+            raise ValueError("Only named functions can be called")
+        overloads = self.functions.get(node.function)
+        if overloads is None:
+            raise ValueError(f"Function {node.function} not found")
+        node.arguments = receiver + [self.visit(arg) for arg in node.arguments]
+        parameters, node.type = self.resolve_overload(node.function, overloads, node.arguments)
+        node.arguments = [
+            self.convert(arg, param_type, f"argument {i + 1} of {node.function}")
+            for i, (arg, param_type) in enumerate(zip(node.arguments, parameters))
+        ]
+        return node
+
+    def method_receiver(self, node):
+        """Point a method call at the method's function, returning the
+        object it is called on, checked."""
+        target = node.function
+        receiver, class_name = self.object_type(target)
+        method = method_name(class_name, target.member_name)
+        if class_name not in self.classes or method not in self.functions:
+            raise ValueError(f"Method not found: {target.member_name}")
+        node.function = method
+        return receiver
+
+    def object_type(self, node):
+        """The checked object of a member access or assignment, and its type."""
+        if isinstance(node.object_name, str):
+            receiver = Identifier(node.object_name)
+            receiver.start = node.start
+            receiver.length = len(node.object_name)
+            if node.object_name not in self.variables:
+                raise ValueError(f"Undefined object: {node.object_name}")
+        else:
+            receiver = node.object_name
+        receiver = self.visit(receiver)
+        if not isinstance(node.object_name, str):
+            node.object_name = receiver
+        return receiver, receiver.type
+
+    def visit_AwaitExpression(self, node):
+        node.expression = self.visit(node.expression)
+        node.type = task_result(node.expression.type)
+        if node.type is None:
+            raise ValueError(f"Cannot await {node.expression.type}")
+        return node
+
+    def visit_NewExpression(self, node):
+        fields = self.classes.get(node.class_name)
+        if fields is None:
+            raise ValueError(f"Unknown class: {node.class_name}")
+        node.arguments = [self.visit(arg) for arg in node.arguments]
+        init = method_name(node.class_name, 'init')
+        if init in self.functions:
+            (parameters, _), = self.functions[init]
+            parameters = parameters[1:]
+        elif node.arguments:
+            # Without an init, the arguments are the fields in order
+            parameters = list(fields.values())
+        else:
+            parameters = []
+        parameters, _ = self.resolve_overload(f"new {node.class_name}", [(parameters, 'void')], node.arguments)
+        node.arguments = [
+            self.convert(arg, param_type, f"argument {i + 1} of new {node.class_name}")
+            for i, (arg, param_type) in enumerate(zip(node.arguments, parameters))
+        ]
+        node.type = node.class_name
+        return node
+
+    def resolve_overload(self, name, overloads, arguments):
+        """The (parameters, return type) a call resolves to: an exact match
+        if there is one, otherwise the first that implicit conversions fit."""
+        arg_types = [arg.type for arg in arguments]
+        if len(overloads) == 1 and len(overloads[0][0]) != len(arg_types):
+            raise ValueError(f"Function {name} takes {len(overloads[0][0])} arguments "
+                             f"but {len(arg_types)} were given")
+        for parameters, return_type in overloads:
+            if parameters == arg_types:
+                return parameters, return_type
+        for parameters, return_type in overloads:
+            if len(parameters) == len(arg_types) and all(
+                    arg == param or converts(arg, param)
+                    for arg, param in zip(arg_types, parameters)):
+                return parameters, return_type
+        raise ValueError(f"No overload of {name} takes ({', '.join(arg_types)})")
+
+    def visit_Index(self, node):
+        node.array = self.visit(node.array)
+        node.index = self.convert(self.visit(node.index), 'int', "an array index")
+        if node.array.type in SEQUENCES:
+            node.type = SEQUENCES[node.array.type]
+            return node
+        if node.array.type is None or not node.array.type.endswith('[]'):
+            raise ValueError(f"Cannot index {node.array.type}")
+        node.type = node.array.type[:-2]
+        return node
+
+    def visit_IndexAssignment(self, node):
+        index = self.visit_Index(Index(node.array, node.index))
+        if index.array.type in SEQUENCES:
+            raise ValueError(f"Cannot assign to an element of {index.array.type}")
+        node.array, node.index, node.type = index.array, index.index, index.type
+        node.value = self.convert(self.visit(node.value), node.type, "an array element")
+        return node
+
+    def visit_MemberAccess(self, node):
+        _, class_name = self.object_type(node)
+        if (class_name.endswith('[]') or class_name in SEQUENCES) and node.member_name == 'length':
+            node.type = 'int'
+            return node
+        fields = self.classes.get(class_name)
+        if fields is None or node.member_name not in fields:
+            raise ValueError(f"Member not found: {node.member_name}")
+        node.type = fields[node.member_name]
+        return node
+
+    def visit_MemberAssignment(self, node):
+        _, class_name = self.object_type(node)
+        fields = self.classes.get(class_name)
+        if fields is None or node.member_name not in fields:
+            raise ValueError(f"Cannot assign to {node.member_name} of {class_name}")
+        node.type = fields[node.member_name]
+        node.value = self.convert(self.visit(node.value), node.type, f"the assignment to {node.member_name}")
+        return node
+
+    def convert(self, node, target, what):
+        """Return node as a value of the target type, or raise ValueError."""
+        if node.type == target:
+            return node
+        if not converts(node.type, target):
+            raise ValueError(f"Cannot convert {node.type} to {target} in {what}")
+        if target == 'task':
+            # Every task is the same pointer
+            return node
+        self.conversions += 1
+        if isinstance(node, Literal):
+            converted = Literal(float(node.value))
+        else:
+            converted = Cast(node, target)
+        converted.type = target
+        converted.start = node.start
+        converted.length = node.length
+        return converted
+
+def check_types(node):
+    """Run TypeChecker over an AST, returning the typed tree."""
+    return TypeChecker().visit(node)
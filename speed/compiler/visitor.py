@@ -0,0 +1,75 @@
+from .ast import Node, children
+
+class NodeVisitor:
+    """Base class for passes over the AST.
+
+    visit(node) calls the visit_<ClassName> method for the node's class, or
+    for the nearest base class that has one, falling back to generic_visit.
+    The method chosen for each node type is looked up once and kept in a
+    dispatch table per visitor class, so dispatch costs one dict lookup no
+    matter how many node kinds a pass handles.
+    """
+
+    _dispatch = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._dispatch = {}
+
+    def visit(self, node):
+        try:
+            method = self._dispatch[type(node)]
+        except KeyError:
+            method = self._resolve(type(node))
+        return method(self, node)
+
+    @classmethod
+    def _resolve(cls, node_type):
+        method = cls.generic_visit
+        for klass in node_type.__mro__:
+            found = getattr(cls, f'visit_{klass.__name__}', None)
+            if found is not None:
+                method = found
+                break
+        cls._dispatch[node_type] = method
+        return method
+
+    def generic_visit(self, node):
+        """Visit every child node; passes override this to reject unknown nodes."""
+        for value in children(node):
+            if isinstance(value, Node):
+                self.visit(value)
+            elif isinstance(value, list):
+                for item in value:
+                    if isinstance(item, Node):
+                        self.visit(item)
+
+class NodeTransformer(NodeVisitor):
+    """A NodeVisitor whose visit methods return the node to put in its place.
+
+    Returning None removes the node; inside a list, returning a list splices
+    its items in. generic_visit transforms the children of nodes without a
+    handler of their own.
+    """
+
+    def generic_visit(self, node):
+        for field in node._fields:
+            value = getattr(node, field)
+            if isinstance(value, Node):
+                setattr(node, field, self.visit(value))
+            elif isinstance(value, list):
+                setattr(node, field, self.transform_list(value))
+        return node
+
+    def transform_list(self, items):
+        result = []
+        for item in items:
+            if not isinstance(item, Node):
+                result.append(item)
+                continue
+            new = self.visit(item)
+            if isinstance(new, list):
+                result.extend(new)
+            elif new is not None:
+                result.append(new)
+        return result
@@ -1,174 +1,393 @@
+import sys
 from llvmlite import ir
+from .runtime import (
+    BYTES, DOUBLE, FLOAT_FORMAT, I32, I64, I8, VIEW, array_parts, c_string, clamp, libc,
+    linkonce_function, linkonce_global, loop, slice_view, view, with_c_string,
+)
 
-def create_print_function(module):
-    # Create print function type
-    print_type = ir.FunctionType(ir.VoidType(), [ir.PointerType(ir.IntType(8))])
-    
-    # Create print function
-    print_func = ir.Function(module, print_type, name="print")
-    
-    # Create entry block
-    block = print_func.append_basic_block(name="entry")
-    builder = ir.IRBuilder(block)
-    
-    # Get printf function
-    printf_type = ir.FunctionType(ir.IntType(32), [ir.PointerType(ir.IntType(8))], var_arg=True)
-    printf = ir.Function(module, printf_type, name="printf")
-    
-    # Create format string
-    format_str = builder.global_string("%s\n")
-    
-    # Call printf
-    builder.call(printf, [format_str, print_func.args[0]])
-    
-    # Return void
+# Output goes through one buffer in user space, written to stdout with a
+# single write(2) when it fills, on flush(), and when the program exits.
+# When stdout is a terminal the buffer is also flushed at the end of every
+# line, so interactive output still shows up as it is printed.
+IO_BUFFER_SIZE = 1 << 16
+STDOUT = 1
+# Room reserved in the buffer for one formatted number
+NUMBER_WIDTH = 32
+
+# The imported name's overloads: symbol, return type and parameter types,
+# in Speed type names. Their bodies are generated into the modules that
+# call them (see IO_BODIES).
+IO_FUNCTIONS = {
+    'print': [
+        ('speed.io.print', 'void', ['string']),
+        ('speed.io.print.int', 'void', ['int']),
+        ('speed.io.print.float', 'void', ['float']),
+        ('speed.io.print.bytes', 'void', ['bytes']),
+    ],
+    'write': [
+        ('speed.io.write', 'void', ['string']),
+        ('speed.io.write.int', 'void', ['int']),
+        ('speed.io.write.float', 'void', ['float']),
+        ('speed.io.write.bytes', 'void', ['bytes']),
+    ],
+    'write_lines': [('speed.io.write_lines', 'void', ['string[]'])],
+    'flush': [('speed.io.flush', 'void', [])],
+    'map_file': [('speed.io.map_file', 'bytes', ['string'])],
+    'read_file': [('speed.io.read_file', 'bytes', ['string'])],
+    'unmap': [('speed.io.unmap', 'void', ['bytes'])],
+    'line_end': [('speed.io.line_end', 'int', ['bytes', 'int'])],
+    'chunk_end': [('speed.io.chunk_end', 'int', ['bytes', 'int', 'int'])],
+    'slice': [('speed.io.slice', 'bytes', ['bytes', 'int', 'int'])],
+    'count': [('speed.io.count', 'int', ['bytes', 'int'])],
+}
+
+# Types print and write take as a run of bytes rather than a value to format
+TEXT = ('string', 'bytes')
+
+# open(2), lseek(2), mmap(2) and madvise(2) flags; Linux and macOS agree
+O_RDONLY = 0
+SEEK_SET = 0
+SEEK_END = 2
+PROT_READ = 1
+PROT_WRITE = 2
+MAP_PRIVATE = 2
+MAP_ANONYMOUS = 0x1000 if sys.platform == 'darwin' else 0x20
+MADV_SEQUENTIAL = 2
+
+_VOID = ir.VoidType()
+
+def _state(module):
+    """The buffer and how much of it is used, shared by every module."""
+    buffer = linkonce_global(module, 'speed.io.buffer', ir.ArrayType(I8, IO_BUFFER_SIZE), None)
+    used = linkonce_global(module, 'speed.io.used', I64, 0)
+    return buffer, used
+
+def _at(builder, buffer, offset):
+    return builder.gep(buffer, [ir.Constant(I32, 0), offset], inbounds=True)
+
+def _build_write_all(func, builder):
+    # write(2) may take less than it was given
+    data, size = func.args
+    write = libc(func.module, 'write', I64, [I32, BYTES, I64])
+    header = func.append_basic_block('header')
+    body = func.append_basic_block('body')
+    done = func.append_basic_block('done')
+    entry = builder.block
+    builder.branch(header)
+    builder.position_at_end(header)
+    offset = builder.phi(I64)
+    offset.add_incoming(ir.Constant(I64, 0), entry)
+    builder.cbranch(builder.icmp_signed('<', offset, size), body, done)
+    builder.position_at_end(body)
+    written = builder.call(write, [ir.Constant(I32, STDOUT), builder.gep(data, [offset]),
+                                   builder.sub(size, offset)])
+    offset.add_incoming(builder.add(offset, written), body)
+    # An error (or a closed stdout) drops the rest rather than spinning
+    builder.cbranch(builder.icmp_signed('>', written, ir.Constant(I64, 0)), header, done)
+    builder.position_at_end(done)
+    builder.ret_void()
+
+def _write_all(module):
+    return linkonce_function(module, 'speed.io.write_all', _VOID, [BYTES, I64], _build_write_all)
+
+def _build_flush(func, builder):
+    buffer, used = _state(func.module)
+    start = _at(builder, buffer, ir.Constant(I64, 0))
+    builder.call(_write_all(func.module), [start, builder.load(used)])
+    builder.store(ir.Constant(I64, 0), used)
+    builder.ret_void()
+    # Executables flush at exit; the JIT calls speed.io.flush after main
+    entry_type = ir.LiteralStructType([I32, func.type, BYTES])
+    dtors_type = ir.ArrayType(entry_type, 1)
+    dtors = ir.GlobalVariable(func.module, dtors_type, name='llvm.global_dtors')
+    dtors.linkage = 'appending'
+    dtors.initializer = ir.Constant(dtors_type, [
+        ir.Constant(entry_type, [ir.Constant(I32, 65535), func, ir.Constant(BYTES, None)])])
+
+def _flush(module):
+    return linkonce_function(module, 'speed.io.flush', _VOID, [], _build_flush)
+
+def _build_reserve(func, builder):
+    # Make room for size bytes, returning where they go; None when they
+    # are more than the buffer holds and were written out directly
+    size, = func.args
+    buffer, used = _state(func.module)
+    capacity = ir.Constant(I64, IO_BUFFER_SIZE)
+    entry = builder.block
+    current = builder.load(used)
+    fits = builder.icmp_unsigned('<=', builder.add(current, size), capacity)
+    with builder.if_then(builder.not_(fits), likely=False):
+        builder.call(_flush(func.module), [])
+        spilled = builder.block
+    offset = builder.phi(I64)
+    offset.add_incoming(current, entry)
+    offset.add_incoming(ir.Constant(I64, 0), spilled)
+    builder.ret(offset)
+
+def _reserve(module):
+    return linkonce_function(module, 'speed.io.reserve', I64, [I64], _build_reserve)
+
+def _build_append(func, builder):
+    data, size = func.args
+    buffer, used = _state(func.module)
+    with builder.if_then(builder.icmp_unsigned('>=', size, ir.Constant(I64, IO_BUFFER_SIZE)),
+                         likely=False):
+        builder.call(_flush(func.module), [])
+        builder.call(_write_all(func.module), [data, size])
+        builder.ret_void()
+    offset = builder.call(_reserve(func.module), [size])
+    memcpy = libc(func.module, 'memcpy', BYTES, [BYTES, BYTES, I64])
+    builder.call(memcpy, [_at(builder, buffer, offset), data, size])
+    builder.store(builder.add(offset, size), used)
+    builder.ret_void()
+
+def _append(module):
+    return linkonce_function(module, 'speed.io.append', _VOID, [BYTES, I64], _build_append)
+
+def _append_text(builder, text):
+    """Append a string or a bytes view, returning its data and size."""
+    data, size = array_parts(builder, text)
+    builder.call(_append(builder.module), [data, size])
+    return data, size
+
+def _build_append_int(func, builder):
+    # Digits are produced backwards into a scratch area, then copied
+    value, = func.args
+    scratch = builder.alloca(ir.ArrayType(I8, NUMBER_WIDTH))
+    negative = builder.icmp_signed('<', value, ir.Constant(I64, 0))
+    # Work on the negated value for negatives, so the minimum does not overflow
+    magnitude = builder.select(negative, value, builder.neg(value))
+    entry = builder.block
+    body = func.append_basic_block('digits')
+    done = func.append_basic_block('done')
+    builder.branch(body)
+    builder.position_at_end(body)
+    remaining = builder.phi(I64)
+    position = builder.phi(I64)
+    remaining.add_incoming(magnitude, entry)
+    position.add_incoming(ir.Constant(I64, NUMBER_WIDTH), entry)
+    digit = builder.neg(builder.srem(remaining, ir.Constant(I64, 10)))
+    next_position = builder.sub(position, ir.Constant(I64, 1))
+    character = builder.add(builder.trunc(digit, I8), ir.Constant(I8, ord('0')))
+    builder.store(character, _at(builder, scratch, next_position))
+    quotient = builder.sdiv(remaining, ir.Constant(I64, 10))
+    remaining.add_incoming(quotient, body)
+    position.add_incoming(next_position, body)
+    builder.cbranch(builder.icmp_signed('!=', quotient, ir.Constant(I64, 0)), body, done)
+    builder.position_at_end(done)
+    start = builder.select(negative, builder.sub(next_position, ir.Constant(I64, 1)), next_position)
+    with builder.if_then(negative):
+        builder.store(ir.Constant(I8, ord('-')), _at(builder, scratch, start))
+    size = builder.sub(ir.Constant(I64, NUMBER_WIDTH), start)
+    builder.call(_append(func.module), [_at(builder, scratch, start), size])
+    builder.ret_void()
+
+def _build_append_float(func, builder):
+    # snprintf formats straight into the buffer
+    value, = func.args
+    module = func.module
+    buffer, used = _state(module)
+    format_string = c_string(builder, 'speed.float_format', FLOAT_FORMAT)
+    snprintf = libc(module, 'snprintf', I32, [BYTES, I64, BYTES], var_arg=True)
+    offset = builder.call(_reserve(module), [ir.Constant(I64, NUMBER_WIDTH)])
+    size = builder.call(snprintf, [
+        _at(builder, buffer, offset), ir.Constant(I64, NUMBER_WIDTH),
+        format_string, value])
+    builder.store(builder.add(offset, builder.sext(size, I64)), used)
     builder.ret_void()
-    
-    return print_func
-
-def create_readline_function(module):
-    # Create readline function type
-    readline_type = ir.FunctionType(ir.PointerType(ir.IntType(8)), [])
-    
-    # Create readline function
-    readline_func = ir.Function(module, readline_type, name="readline")
-    
-    # Create entry block
-    block = readline_func.append_basic_block(name="entry")
-    builder = ir.IRBuilder(block)
-    
-    # Get gets function
-    gets_type = ir.FunctionType(ir.PointerType(ir.IntType(8)), [ir.PointerType(ir.IntType(8))])
-    gets = ir.Function(module, gets_type, name="gets")
-    
-    # Allocate buffer
-    buffer = builder.alloca(ir.ArrayType(ir.IntType(8), 1024))
-    buffer_ptr = builder.gep(buffer, [ir.Constant(ir.IntType(32), 0), ir.Constant(ir.IntType(32), 0)])
-    
-    # Call gets
-    result = builder.call(gets, [buffer_ptr])
-    
-    # Return result
-    builder.ret(result)
-    
-    return readline_func
-
-def create_file_open_function(module):
-    # Create file_open function type
-    file_open_type = ir.FunctionType(
-        ir.PointerType(ir.IntType(8)),
-        [ir.PointerType(ir.IntType(8)), ir.PointerType(ir.IntType(8))]
-    )
-    
-    # Create file_open function
-    file_open_func = ir.Function(module, file_open_type, name="file_open")
-    
-    # Create entry block
-    block = file_open_func.append_basic_block(name="entry")
-    builder = ir.IRBuilder(block)
-    
-    # Get fopen function
-    fopen_type = ir.FunctionType(
-        ir.PointerType(ir.IntType(8)),
-        [ir.PointerType(ir.IntType(8)), ir.PointerType(ir.IntType(8))]
-    )
-    fopen = ir.Function(module, fopen_type, name="fopen")
-    
-    # Call fopen
-    result = builder.call(fopen, [file_open_func.args[0], file_open_func.args[1]])
-    
-    # Return result
-    builder.ret(result)
-    
-    return file_open_func
-
-def create_file_close_function(module):
-    # Create file_close function type
-    file_close_type = ir.FunctionType(ir.IntType(32), [ir.PointerType(ir.IntType(8))])
-    
-    # Create file_close function
-    file_close_func = ir.Function(module, file_close_type, name="file_close")
-    
-    # Create entry block
-    block = file_close_func.append_basic_block(name="entry")
-    builder = ir.IRBuilder(block)
-    
-    # Get fclose function
-    fclose_type = ir.FunctionType(ir.IntType(32), [ir.PointerType(ir.IntType(8))])
-    fclose = ir.Function(module, fclose_type, name="fclose")
-    
-    # Call fclose
-    result = builder.call(fclose, [file_close_func.args[0]])
-    
-    # Return result
-    builder.ret(result)
-    
-    return file_close_func
-
-def create_file_read_function(module):
-    # Create file_read function type
-    file_read_type = ir.FunctionType(
-        ir.IntType(32),
-        [ir.PointerType(ir.IntType(8)), ir.PointerType(ir.IntType(8)), ir.IntType(32)]
-    )
-    
-    # Create file_read function
-    file_read_func = ir.Function(module, file_read_type, name="file_read")
-    
-    # Create entry block
-    block = file_read_func.append_basic_block(name="entry")
-    builder = ir.IRBuilder(block)
-    
-    # Get fread function
-    fread_type = ir.FunctionType(
-        ir.IntType(32),
-        [ir.PointerType(ir.IntType(8)), ir.IntType(32), ir.IntType(32), ir.PointerType(ir.IntType(8))]
-    )
-    fread = ir.Function(module, fread_type, name="fread")
-    
-    # Call fread
-    result = builder.call(fread, [
-        file_read_func.args[1],  # buffer
-        ir.Constant(ir.IntType(32), 1),  # size
-        file_read_func.args[2],  # count
-        file_read_func.args[0]   # file
-    ])
-    
-    # Return result
-    builder.ret(result)
-    
-    return file_read_func
-
-def create_file_write_function(module):
-    # Create file_write function type
-    file_write_type = ir.FunctionType(
-        ir.IntType(32),
-        [ir.PointerType(ir.IntType(8)), ir.PointerType(ir.IntType(8)), ir.IntType(32)]
-    )
-    
-    # Create file_write function
-    file_write_func = ir.Function(module, file_write_type, name="file_write")
-    
-    # Create entry block
-    block = file_write_func.append_basic_block(name="entry")
-    builder = ir.IRBuilder(block)
-    
-    # Get fwrite function
-    fwrite_type = ir.FunctionType(
-        ir.IntType(32),
-        [ir.PointerType(ir.IntType(8)), ir.IntType(32), ir.IntType(32), ir.PointerType(ir.IntType(8))]
-    )
-    fwrite = ir.Function(module, fwrite_type, name="fwrite")
-    
-    # Call fwrite
-    result = builder.call(fwrite, [
-        file_write_func.args[1],  # buffer
-        ir.Constant(ir.IntType(32), 1),  # size
-        file_write_func.args[2],  # count
-        file_write_func.args[0]   # file
-    ])
-    
-    # Return result
-    builder.ret(result)
-    
-    return file_write_func 
\ No newline at end of file
+
+_APPEND_VALUE = {
+    'int': ('speed.io.append.int', I64, _build_append_int),
+    'float': ('speed.io.append.float', DOUBLE, _build_append_float),
+}
+
+def _append_value(builder, kind, value):
+    symbol, value_type, build = _APPEND_VALUE[kind]
+    builder.call(linkonce_function(builder.module, symbol, _VOID, [value_type], build), [value])
+
+def _append_newline(builder):
+    buffer, used = _state(builder.module)
+    offset = builder.call(_reserve(builder.module), [ir.Constant(I64, 1)])
+    builder.store(ir.Constant(I8, ord('\n')), _at(builder, buffer, offset))
+    builder.store(builder.add(offset, ir.Constant(I64, 1)), used)
+
+def _build_end_line(func, builder):
+    # Whether stdout is a terminal is asked once: -1 until then
+    module = func.module
+    tty = linkonce_global(module, 'speed.io.tty', I32, -1)
+    state = builder.load(tty)
+    with builder.if_then(builder.icmp_signed('<', state, ir.Constant(I32, 0)), likely=False):
+        isatty = libc(module, 'isatty', I32, [I32])
+        answer = builder.zext(builder.icmp_signed('!=', builder.call(isatty, [ir.Constant(I32, STDOUT)]),
+                                                  ir.Constant(I32, 0)), I32)
+        builder.store(answer, tty)
+    with builder.if_then(builder.icmp_signed('!=', builder.load(tty), ir.Constant(I32, 0))):
+        builder.call(_flush(module), [])
+    builder.ret_void()
+
+def _end_line(builder):
+    end_line = linkonce_function(builder.module, 'speed.io.end_line', _VOID, [], _build_end_line)
+    builder.call(end_line, [])
+
+def _build_print(kind):
+    def build(func, builder):
+        if kind in TEXT:
+            _append_text(builder, func.args[0])
+        else:
+            _append_value(builder, kind, func.args[0])
+        _append_newline(builder)
+        _end_line(builder)
+        builder.ret_void()
+    return build
+
+def _build_write(kind):
+    def build(func, builder):
+        if kind not in TEXT:
+            _append_value(builder, kind, func.args[0])
+            builder.ret_void()
+            return
+        data, size = _append_text(builder, func.args[0])
+        memchr = libc(func.module, 'memchr', BYTES, [BYTES, I32, I64])
+        newline = builder.call(memchr, [data, ir.Constant(I32, ord('\n')), size])
+        with builder.if_then(builder.not_(builder.icmp_unsigned('==', newline, ir.Constant(BYTES, None)))):
+            _end_line(builder)
+        builder.ret_void()
+    return build
+
+def _build_write_lines(func, builder):
+    data, count = array_parts(builder, func.args[0])
+    def step(builder, i, values):
+        _append_text(builder, builder.load(builder.gep(data, [i], inbounds=True)))
+        _append_newline(builder)
+        return []
+    loop(builder, count, [], step, vectorize=False)
+    _end_line(builder)
+    builder.ret_void()
+
+_EMPTY = ir.Constant(VIEW, [ir.Constant(BYTES, None), ir.Constant(I64, 0)])
+
+def _build_map_file(func, builder):
+    # The file is mapped read-only and the descriptor closed straight away;
+    # a file that cannot be opened or mapped (or is empty) gives an empty view
+    module = func.module
+    path, = func.args
+    close = libc(module, 'close', I32, [I32])
+    open_ = libc(module, 'open', I32, [BYTES, I32], var_arg=True)
+    fd = with_c_string(builder, path, lambda c_path: builder.call(
+        open_, [c_path, ir.Constant(I32, O_RDONLY)]))
+    with builder.if_then(builder.icmp_signed('<', fd, ir.Constant(I32, 0)), likely=False):
+        builder.ret(_EMPTY)
+    lseek = libc(module, 'lseek', I64, [I32, I64, I32])
+    size = builder.call(lseek, [fd, ir.Constant(I64, 0), ir.Constant(I32, SEEK_END)])
+    with builder.if_then(builder.icmp_signed('<=', size, ir.Constant(I64, 0)), likely=False):
+        builder.call(close, [fd])
+        builder.ret(_EMPTY)
+    mmap = libc(module, 'mmap', BYTES, [BYTES, I64, I32, I32, I32, I64])
+    data = builder.call(mmap, [
+        ir.Constant(BYTES, None), size, ir.Constant(I32, PROT_READ),
+        ir.Constant(I32, MAP_PRIVATE), fd, ir.Constant(I64, 0)])
+    builder.call(close, [fd])
+    failed = builder.icmp_signed('==', builder.ptrtoint(data, I64), ir.Constant(I64, -1))
+    with builder.if_then(failed, likely=False):
+        builder.ret(_EMPTY)
+    # Scans run front to back, so the kernel can read ahead aggressively
+    madvise = libc(module, 'madvise', I32, [BYTES, I64, I32])
+    builder.call(madvise, [data, size, ir.Constant(I32, MADV_SEQUENTIAL)])
+    builder.ret(view(builder, data, size))
+
+def _build_read_file(func, builder):
+    # The whole file copied through stdio into anonymous memory, so that
+    # unmap releases these views as well
+    module = func.module
+    path, = func.args
+    fopen = libc(module, 'fopen', BYTES, [BYTES, BYTES])
+    mode = c_string(builder, 'speed.io.read_mode', 'rb')
+    stream = with_c_string(builder, path, lambda c_path: builder.call(fopen, [c_path, mode]))
+    with builder.if_then(builder.icmp_unsigned('==', stream, ir.Constant(BYTES, None)), likely=False):
+        builder.ret(_EMPTY)
+    fseek = libc(module, 'fseek', I32, [BYTES, I64, I32])
+    fclose = libc(module, 'fclose', I32, [BYTES])
+    builder.call(fseek, [stream, ir.Constant(I64, 0), ir.Constant(I32, SEEK_END)])
+    size = builder.call(libc(module, 'ftell', I64, [BYTES]), [stream])
+    with builder.if_then(builder.icmp_signed('<=', size, ir.Constant(I64, 0)), likely=False):
+        builder.call(fclose, [stream])
+        builder.ret(_EMPTY)
+    builder.call(fseek, [stream, ir.Constant(I64, 0), ir.Constant(I32, SEEK_SET)])
+    data = builder.call(libc(module, 'mmap', BYTES, [BYTES, I64, I32, I32, I32, I64]), [
+        ir.Constant(BYTES, None), size, ir.Constant(I32, PROT_READ | PROT_WRITE),
+        ir.Constant(I32, MAP_PRIVATE | MAP_ANONYMOUS), ir.Constant(I32, -1), ir.Constant(I64, 0)])
+    failed = builder.icmp_signed('==', builder.ptrtoint(data, I64), ir.Constant(I64, -1))
+    with builder.if_then(failed, likely=False):
+        builder.call(fclose, [stream])
+        builder.ret(_EMPTY)
+    fread = libc(module, 'fread', I64, [BYTES, I64, I64, BYTES])
+    read = builder.call(fread, [data, ir.Constant(I64, 1), size, stream])
+    builder.call(fclose, [stream])
+    builder.ret(view(builder, data, read))
+
+def _build_unmap(func, builder):
+    data, size = array_parts(builder, func.args[0])
+    with builder.if_then(builder.icmp_unsigned('!=', data, ir.Constant(BYTES, None))):
+        builder.call(libc(func.module, 'munmap', I32, [BYTES, I64]), [data, size])
+    builder.ret_void()
+
+def _build_line_end(func, builder):
+    # Where the line starting at `start` ends: its newline, or the end
+    data, size = array_parts(builder, func.args[0])
+    start = func.args[1]
+    start = clamp(builder, start, ir.Constant(I64, 0), size)
+    memchr = libc(func.module, 'memchr', BYTES, [BYTES, I32, I64])
+    found = builder.call(memchr, [builder.gep(data, [start], inbounds=True),
+                                  ir.Constant(I32, ord('\n')), builder.sub(size, start)])
+    with builder.if_then(builder.icmp_unsigned('==', found, ir.Constant(BYTES, None))):
+        builder.ret(size)
+    builder.ret(builder.sub(builder.ptrtoint(found, I64), builder.ptrtoint(data, I64)))
+
+def _line_end(module):
+    line_end = IO_FUNCTIONS['line_end'][0][0]
+    return linkonce_function(module, line_end, I64, [VIEW, I64], _build_line_end)
+
+def _build_chunk_end(func, builder):
+    # At least `length` bytes from `start`, extended to a whole line
+    source, start, length = func.args
+    size = builder.extract_value(source, 1)
+    target = builder.add(clamp(builder, start, ir.Constant(I64, 0), size), length)
+    with builder.if_then(builder.icmp_signed('>=', target, size)):
+        builder.ret(size)
+    end = builder.call(_line_end(func.module), [source, target])
+    builder.ret(clamp(builder, builder.add(end, ir.Constant(I64, 1)), target, size))
+
+def _build_slice(func, builder):
+    builder.ret(slice_view(builder, *func.args))
+
+def _build_count(func, builder):
+    data, size = array_parts(builder, func.args[0])
+    byte = func.args[1]
+    target = builder.trunc(byte, I8)
+    def step(builder, i, values):
+        match = builder.icmp_unsigned('==', builder.load(builder.gep(data, [i], inbounds=True)), target)
+        return [builder.add(values[0], builder.zext(match, I64))]
+    total, = loop(builder, size, [ir.Constant(I64, 0)], step)
+    builder.ret(total)
+
+# Body builders by symbol. The helpers they call (speed.io.append and so
+# on) are generated along with them.
+IO_BODIES = {
+    'speed.io.flush': _build_flush,
+    'speed.io.print': _build_print('string'),
+    'speed.io.print.int': _build_print('int'),
+    'speed.io.print.float': _build_print('float'),
+    'speed.io.write': _build_write('string'),
+    'speed.io.write.int': _build_write('int'),
+    'speed.io.write.float': _build_write('float'),
+    'speed.io.write_lines': _build_write_lines,
+    'speed.io.print.bytes': _build_print('bytes'),
+    'speed.io.write.bytes': _build_write('bytes'),
+    'speed.io.map_file': _build_map_file,
+    'speed.io.read_file': _build_read_file,
+    'speed.io.unmap': _build_unmap,
+    'speed.io.line_end': _build_line_end,
+    'speed.io.chunk_end': _build_chunk_end,
+    'speed.io.slice': _build_slice,
+    'speed.io.count': _build_count,
+}
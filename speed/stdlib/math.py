@@ -1,136 +1,176 @@
+import math
 from llvmlite import ir
+from .runtime import DOUBLE, I64, array_parts, libc, loop
 
-def create_math_functions(module):
-    # Create math function types
-    math_types = {
-        'sin': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'cos': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'tan': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'sqrt': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'pow': ir.FunctionType(ir.FloatType(), [ir.FloatType(), ir.FloatType()]),
-        'abs': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'floor': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'ceil': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'round': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'min': ir.FunctionType(ir.FloatType(), [ir.FloatType(), ir.FloatType()]),
-        'max': ir.FunctionType(ir.FloatType(), [ir.FloatType(), ir.FloatType()]),
-        'exp': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'log': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'log10': ir.FunctionType(ir.FloatType(), [ir.FloatType()]),
-        'pi': ir.FloatType(),
-        'e': ir.FloatType(),
-    }
-    
-    # Create math functions
-    math_funcs = {}
-    
-    for name, func_type in math_types.items():
-        if isinstance(func_type, ir.FunctionType):
-            # Create function
-            func = ir.Function(module, func_type, name=f"math_{name}")
-            
-            # Create entry block
-            block = func.append_basic_block(name="entry")
-            builder = ir.IRBuilder(block)
-            
-            # Get corresponding C math function
-            c_func_type = func_type
-            c_func = ir.Function(module, c_func_type, name=name)
-            
-            # Call C math function
-            result = builder.call(c_func, func.args)
-            
-            # Return result
-            builder.ret(result)
-            
-            math_funcs[name] = func
-        else:
-            # Create constant
-            if name == 'pi':
-                value = 3.14159265358979323846
-            else:  # e
-                value = 2.71828182845904523536
-            const = ir.GlobalVariable(module, func_type, name=f"math_{name}")
-            const.global_constant = True
-            const.initializer = ir.Constant(func_type, value)
-            math_funcs[name] = const
-    
-    return math_funcs
-
-def create_random_functions(module):
-    # Create random function types
-    random_types = {
-        'random': ir.FunctionType(ir.FloatType(), []),
-        'random_int': ir.FunctionType(ir.IntType(32), [ir.IntType(32), ir.IntType(32)]),
-        'random_float': ir.FunctionType(ir.FloatType(), [ir.FloatType(), ir.FloatType()]),
-        'seed': ir.FunctionType(ir.VoidType(), [ir.IntType(32)]),
-    }
-    
-    # Create random functions
-    random_funcs = {}
-    
-    for name, func_type in random_types.items():
-        # Create function
-        func = ir.Function(module, func_type, name=f"random_{name}")
-        
-        # Create entry block
-        block = func.append_basic_block(name="entry")
-        builder = ir.IRBuilder(block)
-        
-        if name == 'random':
-            # Get rand function
-            rand_type = ir.FunctionType(ir.IntType(32), [])
-            rand = ir.Function(module, rand_type, name="rand")
-            
-            # Call rand and convert to float
-            rand_result = builder.call(rand, [])
-            float_result = builder.sitofp(rand_result, ir.FloatType())
-            result = builder.fdiv(float_result, ir.Constant(ir.FloatType(), 32767.0))
-            
-            builder.ret(result)
-            
-        elif name == 'random_int':
-            # Get rand function
-            rand_type = ir.FunctionType(ir.IntType(32), [])
-            rand = ir.Function(module, rand_type, name="rand")
-            
-            # Calculate range
-            range_val = builder.sub(func.args[1], func.args[0])
-            range_val = builder.add(range_val, ir.Constant(ir.IntType(32), 1))
-            
-            # Generate random number in range
-            rand_result = builder.call(rand, [])
-            result = builder.srem(rand_result, range_val)
-            result = builder.add(result, func.args[0])
-            
-            builder.ret(result)
-            
-        elif name == 'random_float':
-            # Get rand function
-            rand_type = ir.FunctionType(ir.IntType(32), [])
-            rand = ir.Function(module, rand_type, name="rand")
-            
-            # Calculate range
-            range_val = builder.fsub(func.args[1], func.args[0])
-            
-            # Generate random number in range
-            rand_result = builder.call(rand, [])
-            float_result = builder.sitofp(rand_result, ir.FloatType())
-            normalized = builder.fdiv(float_result, ir.Constant(ir.FloatType(), 32767.0))
-            result = builder.fmul(normalized, range_val)
-            result = builder.fadd(result, func.args[0])
-            
-            builder.ret(result)
-            
-        elif name == 'seed':
-            # Get srand function
-            srand_type = ir.FunctionType(ir.VoidType(), [ir.IntType(32)])
-            srand = ir.Function(module, srand_type, name="srand")
-            
-            # Call srand
-            builder.call(srand, [func.args[0]])
-            builder.ret_void()
-        
-        random_funcs[name] = func
-    
-    return random_funcs 
\ No newline at end of file
+# Every scalar math function is an LLVM intrinsic on doubles, so calls are
+# not opaque: LLVM folds them on constants, hoists them out of loops and
+# vectorizes them. The table maps the imported name to its overloads: the
+# symbol, the return type and the parameter types, in Speed type names.
+# llvm.tan only exists from LLVM 19 on, one reason llvmlite 0.50 is required.
+MATH_FUNCTIONS = {
+    'sqrt': [('llvm.sqrt.f64', 'float', ['float'])],
+    'sin': [('llvm.sin.f64', 'float', ['float'])],
+    'cos': [('llvm.cos.f64', 'float', ['float'])],
+    'tan': [('llvm.tan.f64', 'float', ['float'])],
+    'pow': [('llvm.pow.f64', 'float', ['float', 'float'])],
+    'exp': [('llvm.exp.f64', 'float', ['float'])],
+    'log': [('llvm.log.f64', 'float', ['float'])],
+    'log10': [('llvm.log10.f64', 'float', ['float'])],
+    'floor': [('llvm.floor.f64', 'float', ['float'])],
+    'ceil': [('llvm.ceil.f64', 'float', ['float'])],
+    'round': [('llvm.round.f64', 'float', ['float'])],
+    'abs': [('llvm.fabs.f64', 'float', ['float'])],
+    'min': [('llvm.minnum.f64', 'float', ['float', 'float'])],
+    'max': [('llvm.maxnum.f64', 'float', ['float', 'float'])],
+}
+
+# Batched versions over float[]: f(xs) returns a new array, f_into(xs, out)
+# writes into an existing one, plus reductions and an allocator. Their
+# bodies are loops generated into each module that calls them (see
+# MATH_BODIES), marked for vectorization where that pays off. Nothing frees
+# the arrays f(xs) and zeros return, so loops should reuse one through f_into.
+ELEMENTWISE = ('sqrt', 'sin', 'cos', 'tan', 'exp', 'log', 'log10',
+               'floor', 'ceil', 'round', 'abs')
+# Those with vector instructions; forcing vectorization of the others would
+# only split libm calls out of and back into vector registers
+VECTOR_ELEMENTWISE = ('sqrt', 'floor', 'ceil', 'round', 'abs')
+
+for _name in ELEMENTWISE:
+    MATH_FUNCTIONS[_name].append((f'speed.math.{_name}.array', 'float[]', ['float[]']))
+    MATH_FUNCTIONS[f'{_name}_into'] = [(f'speed.math.{_name}_into', 'void', ['float[]', 'float[]'])]
+MATH_FUNCTIONS['min'].append(('speed.math.min.array', 'float', ['float[]']))
+MATH_FUNCTIONS['max'].append(('speed.math.max.array', 'float', ['float[]']))
+MATH_FUNCTIONS['sum'] = [('speed.math.sum', 'float', ['float[]'])]
+MATH_FUNCTIONS['dot'] = [('speed.math.dot', 'float', ['float[]', 'float[]'])]
+MATH_FUNCTIONS['zeros'] = [('speed.math.zeros', 'float[]', ['int'])]
+
+# Pseudo-random numbers from the C library's drand48 generator: random() is
+# uniform in [0, 1), random_float(lo, hi) in [lo, hi), random_int(lo, hi)
+# in lo..hi inclusive, and seed(n) restarts the sequence
+MATH_FUNCTIONS['random'] = [('speed.math.random', 'float', [])]
+MATH_FUNCTIONS['random_float'] = [('speed.math.random_float', 'float', ['float', 'float'])]
+MATH_FUNCTIONS['random_int'] = [('speed.math.random_int', 'int', ['int', 'int'])]
+MATH_FUNCTIONS['seed'] = [('speed.math.seed', 'void', ['int'])]
+
+# Compile-time constants: uses are replaced by the literal value
+MATH_CONSTANTS = {
+    'pi': math.pi,
+    'e': math.e,
+}
+
+# Reductions may be reordered, which is what lets them use vector lanes
+_REDUCTION_FLAGS = ('reassoc', 'nsz')
+
+def _intrinsic(module, name, arity=1):
+    symbol = f'llvm.{name}.f64'
+    func = module.globals.get(symbol)
+    if func is None:
+        func = ir.Function(module, ir.FunctionType(DOUBLE, [DOUBLE] * arity), name=symbol)
+    return func
+
+def _shorter(builder, a, b):
+    return builder.select(builder.icmp_signed('<', a, b), a, b)
+
+def _map_loop(builder, name, source, target, count):
+    intrinsic = _intrinsic(builder.module, 'fabs' if name == 'abs' else name)
+    def step(builder, i, values):
+        x = builder.load(builder.gep(source, [i], inbounds=True))
+        builder.store(builder.call(intrinsic, [x]), builder.gep(target, [i], inbounds=True))
+        return []
+    loop(builder, count, [], step, vectorize=name in VECTOR_ELEMENTWISE)
+
+def _build_map(name):
+    def build(func, builder):
+        data, length = array_parts(builder, func.args[0])
+        malloc = libc(func.module, 'malloc', ir.IntType(8).as_pointer(), [I64])
+        raw = builder.call(malloc, [builder.mul(length, ir.Constant(I64, 8))])
+        out = builder.bitcast(raw, DOUBLE.as_pointer())
+        _map_loop(builder, name, data, out, length)
+        result = ir.Constant(func.function_type.return_type, ir.Undefined)
+        result = builder.insert_value(result, out, 0)
+        builder.ret(builder.insert_value(result, length, 1))
+    return build
+
+def _build_map_into(name):
+    def build(func, builder):
+        data, length = array_parts(builder, func.args[0])
+        out, out_length = array_parts(builder, func.args[1])
+        _map_loop(builder, name, data, out, _shorter(builder, length, out_length))
+        builder.ret_void()
+    return build
+
+def _build_sum(func, builder):
+    data, length = array_parts(builder, func.args[0])
+    def step(builder, i, values):
+        x = builder.load(builder.gep(data, [i], inbounds=True))
+        return [builder.fadd(values[0], x, flags=_REDUCTION_FLAGS)]
+    total, = loop(builder, length, [ir.Constant(DOUBLE, 0.0)], step)
+    builder.ret(total)
+
+def _build_dot(func, builder):
+    xs, x_length = array_parts(builder, func.args[0])
+    ys, y_length = array_parts(builder, func.args[1])
+    def step(builder, i, values):
+        x = builder.load(builder.gep(xs, [i], inbounds=True))
+        y = builder.load(builder.gep(ys, [i], inbounds=True))
+        product = builder.fmul(x, y, flags=('contract',))
+        return [builder.fadd(values[0], product, flags=_REDUCTION_FLAGS + ('contract',))]
+    total, = loop(builder, _shorter(builder, x_length, y_length), [ir.Constant(DOUBLE, 0.0)], step)
+    builder.ret(total)
+
+def _build_extremum(name, start):
+    def build(func, builder):
+        data, length = array_parts(builder, func.args[0])
+        intrinsic = _intrinsic(func.module, name, 2)
+        def step(builder, i, values):
+            x = builder.load(builder.gep(data, [i], inbounds=True))
+            return [builder.call(intrinsic, [values[0], x], fastmath=_REDUCTION_FLAGS)]
+        result, = loop(builder, length, [ir.Constant(DOUBLE, start)], step)
+        builder.ret(result)
+    return build
+
+def _build_zeros(func, builder):
+    length = func.args[0]
+    calloc = libc(func.module, 'calloc', ir.IntType(8).as_pointer(), [I64, I64])
+    raw = builder.call(calloc, [length, ir.Constant(I64, 8)])
+    result = ir.Constant(func.function_type.return_type, ir.Undefined)
+    result = builder.insert_value(result, builder.bitcast(raw, DOUBLE.as_pointer()), 0)
+    builder.ret(builder.insert_value(result, length, 1))
+
+def _drand48(builder):
+    return builder.call(libc(builder.module, 'drand48', DOUBLE, []), [])
+
+def _build_random(func, builder):
+    builder.ret(_drand48(builder))
+
+def _build_random_float(func, builder):
+    low, high = func.args
+    scaled = builder.fmul(_drand48(builder), builder.fsub(high, low))
+    builder.ret(builder.fadd(low, scaled))
+
+def _build_random_int(func, builder):
+    low, high = func.args
+    count = builder.add(builder.sub(high, low), ir.Constant(I64, 1))
+    offset = builder.fptosi(builder.fmul(_drand48(builder), builder.sitofp(count, DOUBLE)), I64)
+    builder.ret(builder.add(low, offset))
+
+def _build_seed(func, builder):
+    builder.call(libc(func.module, 'srand48', ir.VoidType(), [I64]), [func.args[0]])
+    builder.ret_void()
+
+# Body builders for the functions above that are not intrinsics, by symbol.
+# Arrays returned by them are heap allocated and never freed.
+MATH_BODIES = {
+    'speed.math.sum': _build_sum,
+    'speed.math.dot': _build_dot,
+    'speed.math.min.array': _build_extremum('minnum', math.inf),
+    'speed.math.max.array': _build_extremum('maxnum', -math.inf),
+    'speed.math.zeros': _build_zeros,
+    'speed.math.random': _build_random,
+    'speed.math.random_float': _build_random_float,
+    'speed.math.random_int': _build_random_int,
+    'speed.math.seed': _build_seed,
+}
+for _name in ELEMENTWISE:
+    MATH_BODIES[f'speed.math.{_name}.array'] = _build_map(_name)
+    MATH_BODIES[f'speed.math.{_name}_into'] = _build_map_into(_name)
@@ -0,0 +1,248 @@
+from llvmlite import ir
+from .runtime import BYTES, I64, libc, linkonce_function, linkonce_global
+
+# Objects made with `new` come from speed.mem.alloc. Outside of an arena
+# block that is malloc; inside one, objects are bump-allocated from chunks
+# the arena owns. Arenas nest: entering one marks how far the chunks are
+# used, and leaving it frees whatever was allocated after the mark - every
+# chunk taken since, and the rest of the one it was in is reused - so
+# leaving the outermost arena frees them all. One freed chunk is kept as a
+# spare, so a loop around an arena block does not call malloc at all once
+# it has run.
+#
+# Every object starts with its reference count. Objects from malloc start
+# with a count of 1 and are freed when it drops to 0. Arena objects, which
+# the arena frees, have a count of 0 that retain and release leave alone.
+ARENA_CHUNK_SIZE = 1 << 16
+# Every object starts on a boundary malloc would also give it
+ALIGNMENT = 16
+# A chunk starts with the chunk before it and its own size in bytes
+CHUNK_HEADER = 16
+
+_VOID = ir.VoidType()
+_CHUNK = ir.LiteralStructType([BYTES, I64])
+
+def _state(module):
+    """How many arenas are active, the newest chunk, and the free part of
+    it, from next up to limit; all null with no arena active."""
+    depth = linkonce_global(module, 'speed.arena.depth', I64, 0)
+    chunk = linkonce_global(module, 'speed.arena.chunk', BYTES, None)
+    next_free = linkonce_global(module, 'speed.arena.next', BYTES, None)
+    limit = linkonce_global(module, 'speed.arena.limit', BYTES, None)
+    return depth, chunk, next_free, limit
+
+def _spare(module):
+    return linkonce_global(module, 'speed.arena.spare', BYTES, None)
+
+def _header(builder, chunk):
+    header = builder.bitcast(chunk, _CHUNK.as_pointer())
+    zero = ir.Constant(ir.IntType(32), 0)
+    previous = builder.gep(header, [zero, ir.Constant(ir.IntType(32), 0)], inbounds=True)
+    size = builder.gep(header, [zero, ir.Constant(ir.IntType(32), 1)], inbounds=True)
+    return previous, size
+
+def _address(builder, pointer):
+    return builder.ptrtoint(pointer, I64)
+
+def _zero(builder, memory, size):
+    memset = libc(builder.module, 'memset', BYTES, [BYTES, ir.IntType(32), I64])
+    builder.call(memset, [memory, ir.Constant(ir.IntType(32), 0), size])
+
+def _build_alloc(func, builder):
+    # The fast path, small enough to be inlined at every `new`
+    size, = func.args
+    _, _, next_free, limit = _state(func.module)
+    mask = ir.Constant(I64, ~(ALIGNMENT - 1))
+    rounded = builder.and_(builder.add(size, ir.Constant(I64, ALIGNMENT - 1)), mask)
+    # Empty objects still get an address of their own
+    is_empty = builder.icmp_unsigned('==', rounded, ir.Constant(I64, 0))
+    rounded = builder.select(is_empty, ir.Constant(I64, ALIGNMENT), rounded)
+    start = builder.load(next_free)
+    available = builder.sub(_address(builder, builder.load(limit)), _address(builder, start))
+    with builder.if_then(builder.icmp_unsigned('>', rounded, available), likely=False):
+        builder.ret(builder.call(_grow(func.module), [rounded]))
+    builder.store(builder.gep(start, [rounded], inbounds=True), next_free)
+    _zero(builder, start, rounded)
+    builder.ret(start)
+
+def alloc(module):
+    """speed.mem.alloc(size): zeroed memory for one object, from the current
+    arena if there is one and from malloc otherwise, its count set to match."""
+    return linkonce_function(module, 'speed.mem.alloc', BYTES, [I64], _build_alloc)
+
+def _build_grow(func, builder):
+    # The current chunk is full (or there is no arena): start a new chunk
+    size, = func.args
+    module = func.module
+    depth, chunk, next_free, limit = _state(module)
+    spare = _spare(module)
+    malloc = libc(module, 'malloc', BYTES, [I64])
+    func.attributes.add('noinline')
+    func.attributes.add('cold')
+    with builder.if_then(builder.icmp_unsigned('==', builder.load(depth), ir.Constant(I64, 0))):
+        calloc = libc(module, 'calloc', BYTES, [I64, I64])
+        memory = builder.call(calloc, [ir.Constant(I64, 1), size])
+        builder.store(ir.Constant(I64, 1), builder.bitcast(memory, I64.as_pointer()))
+        builder.ret(memory)
+
+    needed = builder.add(size, ir.Constant(I64, CHUNK_HEADER))
+    default = ir.Constant(I64, ARENA_CHUNK_SIZE)
+    needed = builder.select(builder.icmp_unsigned('>', needed, default), needed, default)
+    kept = builder.load(spare)
+    reuse_block = func.append_basic_block('reuse')
+    fresh_block = func.append_basic_block('fresh')
+    linked = func.append_basic_block('linked')
+    has_spare = builder.icmp_unsigned('!=', kept, ir.Constant(BYTES, None))
+    builder.cbranch(has_spare, reuse_block, fresh_block)
+
+    builder.position_at_end(reuse_block)
+    _, spare_size = _header(builder, kept)
+    spare_size = builder.load(spare_size)
+    fits = builder.icmp_unsigned('>=', spare_size, needed)
+    reuse = func.append_basic_block('reuse.take')
+    builder.cbranch(fits, reuse, fresh_block)
+    builder.position_at_end(reuse)
+    builder.store(ir.Constant(BYTES, None), spare)
+    builder.branch(linked)
+
+    builder.position_at_end(fresh_block)
+    fresh = builder.call(malloc, [needed])
+    builder.branch(linked)
+
+    builder.position_at_end(linked)
+    new_chunk = builder.phi(BYTES)
+    new_chunk.add_incoming(kept, reuse)
+    new_chunk.add_incoming(fresh, fresh_block)
+    chunk_size = builder.phi(I64)
+    chunk_size.add_incoming(spare_size, reuse)
+    chunk_size.add_incoming(needed, fresh_block)
+    previous, own_size = _header(builder, new_chunk)
+    builder.store(builder.load(chunk), previous)
+    builder.store(chunk_size, own_size)
+    builder.store(new_chunk, chunk)
+    start = builder.gep(new_chunk, [ir.Constant(I64, CHUNK_HEADER)], inbounds=True)
+    builder.store(builder.gep(start, [size], inbounds=True), next_free)
+    builder.store(builder.gep(new_chunk, [chunk_size], inbounds=True), limit)
+    _zero(builder, start, size)
+    builder.ret(start)
+
+def _grow(module):
+    return linkonce_function(module, 'speed.arena.grow', BYTES, [I64], _build_grow)
+
+def _build_enter(func, builder):
+    depth, _, next_free, _ = _state(func.module)
+    builder.store(builder.add(builder.load(depth), ir.Constant(I64, 1)), depth)
+    builder.ret(builder.load(next_free))
+
+def arena_enter(module):
+    """speed.arena.enter(): start an arena block, returning its mark."""
+    return linkonce_function(module, 'speed.arena.enter', BYTES, [], _build_enter)
+
+def _build_release_chunk(func, builder):
+    # Keep the largest chunk given back as the spare; free the others
+    released, = func.args
+    module = func.module
+    spare = _spare(module)
+    free = libc(module, 'free', _VOID, [BYTES])
+    kept = builder.load(spare)
+    with builder.if_then(builder.icmp_unsigned('==', kept, ir.Constant(BYTES, None))):
+        builder.store(released, spare)
+        builder.ret_void()
+    _, kept_size = _header(builder, kept)
+    _, released_size = _header(builder, released)
+    larger = builder.icmp_unsigned('>', builder.load(released_size), builder.load(kept_size))
+    with builder.if_then(larger):
+        builder.store(released, spare)
+        builder.call(free, [kept])
+        builder.ret_void()
+    builder.call(free, [released])
+    builder.ret_void()
+
+def _release_chunk(module):
+    return linkonce_function(module, 'speed.arena.release', _VOID, [BYTES], _build_release_chunk)
+
+def _build_exit(func, builder):
+    # Give back the chunks taken since the mark, newest first, stopping at
+    # the one the mark is in; a null mark (the outermost arena) frees all
+    mark, = func.args
+    module = func.module
+    depth, chunk, next_free, limit = _state(module)
+    newest = builder.load(chunk)
+    entry = builder.block
+    header = func.append_basic_block('header')
+    check = func.append_basic_block('check')
+    release_block = func.append_basic_block('release')
+    done = func.append_basic_block('done')
+    builder.branch(header)
+
+    builder.position_at_end(header)
+    current = builder.phi(BYTES)
+    current.add_incoming(newest, entry)
+    builder.cbranch(builder.icmp_unsigned('==', current, ir.Constant(BYTES, None)), done, check)
+
+    builder.position_at_end(check)
+    previous, size = _header(builder, current)
+    first = _address(builder, builder.gep(current, [ir.Constant(I64, CHUNK_HEADER)], inbounds=True))
+    end = builder.add(_address(builder, current), builder.load(size))
+    position = _address(builder, mark)
+    inside = builder.and_(builder.icmp_unsigned('>=', position, first),
+                          builder.icmp_unsigned('<=', position, end))
+    builder.cbranch(inside, done, release_block)
+
+    builder.position_at_end(release_block)
+    earlier = builder.load(previous)
+    builder.call(_release_chunk(module), [current])
+    current.add_incoming(earlier, release_block)
+    builder.branch(header)
+
+    builder.position_at_end(done)
+    builder.store(current, chunk)
+    has_chunk = builder.icmp_unsigned('!=', current, ir.Constant(BYTES, None))
+    with builder.if_else(has_chunk) as (then, otherwise):
+        with then:
+            _, size = _header(builder, current)
+            builder.store(mark, next_free)
+            builder.store(builder.gep(current, [builder.load(size)], inbounds=True), limit)
+        with otherwise:
+            builder.store(ir.Constant(BYTES, None), next_free)
+            builder.store(ir.Constant(BYTES, None), limit)
+    builder.store(builder.sub(builder.load(depth), ir.Constant(I64, 1)), depth)
+    builder.ret_void()
+
+def arena_exit(module):
+    """speed.arena.exit(mark): free what the arena block allocated."""
+    return linkonce_function(module, 'speed.arena.exit', _VOID, [BYTES], _build_exit)
+
+def _count(builder, memory):
+    """The object's reference count and where it is kept."""
+    pointer = builder.bitcast(memory, I64.as_pointer())
+    return builder.load(pointer), pointer
+
+def _build_retain(func, builder):
+    memory, = func.args
+    with builder.if_then(builder.icmp_unsigned('==', memory, ir.Constant(BYTES, None))):
+        builder.ret_void()
+    count, pointer = _count(builder, memory)
+    with builder.if_then(builder.icmp_unsigned('!=', count, ir.Constant(I64, 0))):
+        builder.store(builder.add(count, ir.Constant(I64, 1)), pointer)
+    builder.ret_void()
+
+def rc_retain(module):
+    """speed.rc.retain(object): count one more reference to it."""
+    return linkonce_function(module, 'speed.rc.retain', _VOID, [BYTES], _build_retain)
+
+def _build_release(func, builder):
+    memory, = func.args
+    with builder.if_then(builder.icmp_unsigned('==', memory, ir.Constant(BYTES, None))):
+        builder.ret(ir.Constant(ir.IntType(1), False))
+    count, pointer = _count(builder, memory)
+    with builder.if_then(builder.icmp_unsigned('==', count, ir.Constant(I64, 0))):
+        builder.ret(ir.Constant(ir.IntType(1), False))
+    remaining = builder.sub(count, ir.Constant(I64, 1))
+    builder.store(remaining, pointer)
+    builder.ret(builder.icmp_unsigned('==', remaining, ir.Constant(I64, 0)))
+
+def rc_release(module):
+    """speed.rc.release(object): count one reference fewer, returning
+    whether that was the last and the object is to be destroyed."""
+    return linkonce_function(module, 'speed.rc.release', ir.IntType(1), [BYTES], _build_release)
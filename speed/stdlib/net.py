@@ -0,0 +1,231 @@
+from llvmlite import ir
+from .runtime import BYTES, I32, I64, I8, VIEW, array_parts, libc, view, with_c_string
+from .tasks import EPOLLIN, EPOLLOUT, Coroutine, wait
+
+# TCP sockets for async fns. Every socket is non-blocking: an operation that
+# would block registers the task with the event loop and suspends it until
+# the socket is ready, so one thread serves any number of connections.
+# Failures give -1 (an empty string for recv), as does a closed peer for
+# send; recv gives an empty string at the end of the stream.
+
+# The imported name's overloads, as in IO_FUNCTIONS
+NET_FUNCTIONS = {
+    'listen': [('speed.net.listen', 'int', ['int'])],
+    'port': [('speed.net.port', 'int', ['int'])],
+    'accept': [('speed.net.accept', 'task<int>', ['int'])],
+    'connect': [('speed.net.connect', 'task<int>', ['string', 'int'])],
+    'recv': [('speed.net.recv', 'task<string>', ['int', 'int'])],
+    'send': [('speed.net.send', 'task<int>', ['int', 'string'])],
+    'close': [('speed.net.close', 'void', ['int'])],
+}
+
+# socket(2) constants, as on Linux
+AF_INET = 2
+SOCK_STREAM = 1
+SOCK_NONBLOCK = 0o4000
+SOCK_CLOEXEC = 0o2000000
+SOL_SOCKET = 1
+SO_REUSEADDR = 2
+SO_ERROR = 4
+MSG_NOSIGNAL = 0x4000
+EAGAIN = 11
+EINPROGRESS = 115
+# Connections a listening socket queues before they are accepted
+BACKLOG = 4096
+
+# struct sockaddr_in: family, then the port and address in network order
+_ADDRESS = ir.LiteralStructType([ir.IntType(16), ir.ArrayType(I8, 2), ir.ArrayType(I8, 4),
+                                  ir.ArrayType(I8, 8)])
+_ADDRESS_SIZE = 16
+
+def _field(builder, pointer, *indices):
+    return builder.gep(pointer, [ir.Constant(I32, index) for index in (0, *indices)], inbounds=True)
+
+def _errno(builder):
+    location = libc(builder.module, '__errno_location', I32.as_pointer(), [])
+    return builder.load(builder.call(location, []))
+
+def _socket(builder):
+    socket = libc(builder.module, 'socket', I32, [I32, I32, I32])
+    kind = SOCK_STREAM | SOCK_NONBLOCK | SOCK_CLOEXEC
+    return builder.call(socket, [ir.Constant(I32, AF_INET), ir.Constant(I32, kind), ir.Constant(I32, 0)])
+
+def _close(builder, fd):
+    builder.call(libc(builder.module, 'close', I32, [I32]), [fd])
+
+def _address(builder, address, port):
+    """Fill in a sockaddr_in for an int port, on any address."""
+    builder.store(ir.Constant(_ADDRESS, None), address)
+    builder.store(ir.Constant(ir.IntType(16), AF_INET), _field(builder, address, 0))
+    high = builder.trunc(builder.lshr(port, ir.Constant(I64, 8)), I8)
+    builder.store(high, _field(builder, address, 1, 0))
+    builder.store(builder.trunc(port, I8), _field(builder, address, 1, 1))
+
+def _sockaddr(builder, address):
+    return builder.bitcast(address, BYTES)
+
+def _build_listen(func, builder):
+    port, = func.args
+    module = func.module
+    address = builder.alloca(_ADDRESS)
+    one = builder.alloca(I32)
+    fd = _socket(builder)
+    with builder.if_then(builder.icmp_signed('<', fd, ir.Constant(I32, 0)), likely=False):
+        builder.ret(ir.Constant(I64, -1))
+    # A restarted server can take its port back straight away
+    builder.store(ir.Constant(I32, 1), one)
+    setsockopt = libc(module, 'setsockopt', I32, [I32, I32, I32, BYTES, I32])
+    builder.call(setsockopt, [fd, ir.Constant(I32, SOL_SOCKET), ir.Constant(I32, SO_REUSEADDR),
+                              builder.bitcast(one, BYTES), ir.Constant(I32, 4)])
+    _address(builder, address, port)
+    bind = libc(module, 'bind', I32, [I32, BYTES, I32])
+    bound = builder.call(bind, [fd, _sockaddr(builder, address), ir.Constant(I32, _ADDRESS_SIZE)])
+    listen = libc(module, 'listen', I32, [I32, I32])
+    listening = builder.call(listen, [fd, ir.Constant(I32, BACKLOG)])
+    failed = builder.or_(builder.icmp_signed('!=', bound, ir.Constant(I32, 0)),
+                         builder.icmp_signed('!=', listening, ir.Constant(I32, 0)))
+    with builder.if_then(failed, likely=False):
+        _close(builder, fd)
+        builder.ret(ir.Constant(I64, -1))
+    builder.ret(builder.sext(fd, I64))
+
+def _build_port(func, builder):
+    # The port a socket is bound to, such as the one listen(0) picked
+    fd, = func.args
+    address = builder.alloca(_ADDRESS)
+    size = builder.alloca(I32)
+    builder.store(ir.Constant(I32, _ADDRESS_SIZE), size)
+    getsockname = libc(func.module, 'getsockname', I32, [I32, BYTES, size.type])
+    named = builder.call(getsockname, [builder.trunc(fd, I32), _sockaddr(builder, address), size])
+    with builder.if_then(builder.icmp_signed('!=', named, ir.Constant(I32, 0)), likely=False):
+        builder.ret(ir.Constant(I64, -1))
+    high = builder.zext(builder.load(_field(builder, address, 1, 0)), I64)
+    low = builder.zext(builder.load(_field(builder, address, 1, 1)), I64)
+    builder.ret(builder.or_(builder.shl(high, ir.Constant(I64, 8)), low))
+
+def _retry(builder, attempt):
+    """Emit a loop around attempt(again), which either finishes the task or
+    calls again(fd, events, coroutine) to wait for the socket and retry, or
+    again() to retry straight away."""
+    func = builder.function
+    header = func.append_basic_block('attempt')
+    builder.branch(header)
+    builder.position_at_end(header)
+    def again(fd=None, events=None, coroutine=None):
+        if coroutine is not None:
+            builder.call(wait(func.module), [fd, ir.Constant(I32, events), coroutine.handle])
+            coroutine.suspend(builder)
+        builder.branch(header)
+    attempt(again)
+
+def _would_block(builder):
+    return builder.icmp_signed('==', _errno(builder), ir.Constant(I32, EAGAIN))
+
+def _build_accept(func, builder):
+    fd, = func.args
+    coroutine = Coroutine(builder, I64)
+    accept4 = libc(func.module, 'accept4', I32, [I32, BYTES, BYTES, I32])
+    def attempt(again):
+        flags = ir.Constant(I32, SOCK_NONBLOCK | SOCK_CLOEXEC)
+        null = ir.Constant(BYTES, None)
+        accepted = builder.call(accept4, [builder.trunc(fd, I32), null, null, flags])
+        with builder.if_then(builder.icmp_signed('>=', accepted, ir.Constant(I32, 0))):
+            coroutine.finish(builder, builder.sext(accepted, I64))
+        with builder.if_then(builder.not_(_would_block(builder)), likely=False):
+            coroutine.finish(builder, ir.Constant(I64, -1))
+        again(fd, EPOLLIN, coroutine)
+    _retry(builder, attempt)
+
+def _build_connect(func, builder):
+    host, port = func.args
+    module = func.module
+    address = builder.alloca(_ADDRESS)
+    error = builder.alloca(I32)
+    size = builder.alloca(I32)
+    coroutine = Coroutine(builder, I64)
+    fd = _socket(builder)
+    with builder.if_then(builder.icmp_signed('<', fd, ir.Constant(I32, 0)), likely=False):
+        coroutine.finish(builder, ir.Constant(I64, -1))
+    _address(builder, address, port)
+    inet_pton = libc(module, 'inet_pton', I32, [I32, BYTES, BYTES])
+    target = builder.bitcast(_field(builder, address, 2), BYTES)
+    parsed = with_c_string(builder, host, lambda text: builder.call(
+        inet_pton, [ir.Constant(I32, AF_INET), text, target]))
+    with builder.if_then(builder.icmp_signed('!=', parsed, ir.Constant(I32, 1)), likely=False):
+        _close(builder, fd)
+        coroutine.finish(builder, ir.Constant(I64, -1))
+    connect = libc(module, 'connect', I32, [I32, BYTES, I32])
+    started = builder.call(connect, [fd, _sockaddr(builder, address), ir.Constant(I32, _ADDRESS_SIZE)])
+    with builder.if_then(builder.icmp_signed('==', started, ir.Constant(I32, 0))):
+        coroutine.finish(builder, builder.sext(fd, I64))
+    in_progress = builder.icmp_signed('==', _errno(builder), ir.Constant(I32, EINPROGRESS))
+    with builder.if_then(builder.not_(in_progress), likely=False):
+        _close(builder, fd)
+        coroutine.finish(builder, ir.Constant(I64, -1))
+    # Writable once connected, or once connecting failed
+    builder.call(wait(module), [builder.sext(fd, I64), ir.Constant(I32, EPOLLOUT), coroutine.handle])
+    coroutine.suspend(builder)
+    builder.store(ir.Constant(I32, 0), error)
+    builder.store(ir.Constant(I32, 4), size)
+    getsockopt = libc(module, 'getsockopt', I32, [I32, I32, I32, BYTES, size.type])
+    builder.call(getsockopt, [fd, ir.Constant(I32, SOL_SOCKET), ir.Constant(I32, SO_ERROR),
+                              builder.bitcast(error, BYTES), size])
+    with builder.if_then(builder.icmp_signed('!=', builder.load(error), ir.Constant(I32, 0)),
+                         likely=False):
+        _close(builder, fd)
+        coroutine.finish(builder, ir.Constant(I64, -1))
+    coroutine.finish(builder, builder.sext(fd, I64))
+
+def _build_recv(func, builder):
+    fd, size = func.args
+    module = func.module
+    coroutine = Coroutine(builder, VIEW)
+    buffer = builder.call(libc(module, 'malloc', BYTES, [I64]), [size])
+    read = libc(module, 'read', I64, [I32, BYTES, I64])
+    def attempt(again):
+        received = builder.call(read, [builder.trunc(fd, I32), buffer, size])
+        with builder.if_then(builder.icmp_signed('>=', received, ir.Constant(I64, 0))):
+            coroutine.finish(builder, view(builder, buffer, received))
+        with builder.if_then(builder.not_(_would_block(builder)), likely=False):
+            coroutine.finish(builder, view(builder, buffer, ir.Constant(I64, 0)))
+        again(fd, EPOLLIN, coroutine)
+    _retry(builder, attempt)
+
+def _build_send(func, builder):
+    # Everything is sent, over as many writes as it takes
+    fd, data = func.args
+    module = func.module
+    sent = builder.alloca(I64)
+    coroutine = Coroutine(builder, I64)
+    start, size = array_parts(builder, data)
+    send = libc(module, 'send', I64, [I32, BYTES, I64, I32])
+    builder.store(ir.Constant(I64, 0), sent)
+    def attempt(again):
+        offset = builder.load(sent)
+        with builder.if_then(builder.icmp_signed('>=', offset, size)):
+            coroutine.finish(builder, size)
+        written = builder.call(send, [builder.trunc(fd, I32), builder.gep(start, [offset], inbounds=True),
+                                      builder.sub(size, offset), ir.Constant(I32, MSG_NOSIGNAL)])
+        with builder.if_then(builder.icmp_signed('>=', written, ir.Constant(I64, 0))):
+            builder.store(builder.add(offset, written), sent)
+            again()
+        with builder.if_then(builder.not_(_would_block(builder)), likely=False):
+            coroutine.finish(builder, ir.Constant(I64, -1))
+        again(fd, EPOLLOUT, coroutine)
+    _retry(builder, attempt)
+
+def _build_close(func, builder):
+    fd, = func.args
+    _close(builder, builder.trunc(fd, I32))
+    builder.ret_void()
+
+# Body builders by symbol, as in IO_BODIES
+NET_BODIES = {
+    'speed.net.listen': _build_listen,
+    'speed.net.port': _build_port,
+    'speed.net.accept': _build_accept,
+    'speed.net.connect': _build_connect,
+    'speed.net.recv': _build_recv,
+    'speed.net.send': _build_send,
+    'speed.net.close': _build_close,
+}
@@ -0,0 +1,118 @@
+from llvmlite import ir
+
+# IR building blocks shared by the stdlib modules whose functions are
+# generated into the program (see STDLIB_BODIES in the code generator)
+
+I8 = ir.IntType(8)
+I32 = ir.IntType(32)
+I64 = ir.IntType(64)
+DOUBLE = ir.DoubleType()
+BYTES = I8.as_pointer()
+# Strings and bytes views: the data and its length, not NUL-terminated
+VIEW = ir.LiteralStructType([BYTES, I64])
+# How floats are formatted wherever they are turned into text
+FLOAT_FORMAT = '%.15g'
+
+def libc(module, name, return_type, param_types, var_arg=False):
+    """Declare a C library function in a module, once."""
+    func = module.globals.get(name)
+    if func is None:
+        func_type = ir.FunctionType(return_type, param_types, var_arg=var_arg)
+        func = ir.Function(module, func_type, name=name)
+    return func
+
+def linkonce_function(module, name, return_type, param_types, build):
+    """A runtime helper every module that uses it gets a copy of; the
+    linker keeps one. build(func, builder) emits the body."""
+    func = module.globals.get(name)
+    if func is None:
+        func = ir.Function(module, ir.FunctionType(return_type, param_types), name=name)
+        func.linkage = 'linkonce_odr'
+        build(func, ir.IRBuilder(func.append_basic_block('entry')))
+    return func
+
+def linkonce_global(module, name, value_type, initializer):
+    """Runtime state shared by every module that declares it."""
+    variable = module.globals.get(name)
+    if variable is None:
+        variable = ir.GlobalVariable(module, value_type, name=name)
+        variable.linkage = 'linkonce_odr'
+        variable.initializer = ir.Constant(value_type, initializer)
+    return variable
+
+def c_string(builder, name, text):
+    """An i8* to a NUL-terminated constant shared by every module."""
+    data = bytearray(text.encode() + b'\0')
+    variable = linkonce_global(builder.module, name, ir.ArrayType(I8, len(data)), data)
+    variable.global_constant = True
+    return builder.bitcast(variable, BYTES)
+
+def view(builder, data, size):
+    """A (data, length) string or bytes view."""
+    value = ir.Constant(VIEW, ir.Undefined)
+    return builder.insert_value(builder.insert_value(value, data, 0), size, 1)
+
+def with_c_string(builder, string, use):
+    """Call use(i8*) with a NUL-terminated copy of a string, for the C
+    library, and free the copy afterwards; returns what use returns."""
+    data, size = array_parts(builder, string)
+    copy = builder.call(libc(builder.module, 'strndup', BYTES, [BYTES, I64]), [data, size])
+    result = use(copy)
+    builder.call(libc(builder.module, 'free', ir.VoidType(), [BYTES]), [copy])
+    return result
+
+def clamp(builder, value, low, high):
+    value = builder.select(builder.icmp_signed('<', value, low), low, value)
+    return builder.select(builder.icmp_signed('>', value, high), high, value)
+
+def slice_view(builder, source, start, end):
+    """The part of a view from start to end, clamped to it; nothing is copied."""
+    data, size = array_parts(builder, source)
+    end = clamp(builder, end, ir.Constant(I64, 0), size)
+    start = clamp(builder, start, ir.Constant(I64, 0), end)
+    return view(builder, builder.gep(data, [start], inbounds=True), builder.sub(end, start))
+
+def vectorize_hint(module):
+    enable = module.add_metadata(['llvm.loop.vectorize.enable', ir.Constant(ir.IntType(1), True)])
+    loop_id = ir.values.MDValue(module, [], name=str(len(module.metadata)))
+    loop_id.operands = (loop_id, enable)
+    return loop_id
+
+def array_parts(builder, array):
+    return builder.extract_value(array, 0), builder.extract_value(array, 1)
+
+def loop(builder, count, initial, step, vectorize=True):
+    """Emit `for i in 0..count`, threading values through the iterations.
+
+    step(builder, i, values) emits the body and returns the next values;
+    the values after the last iteration are returned.
+    """
+    func = builder.function
+    preheader = builder.block
+    header = func.append_basic_block('loop.header')
+    body = func.append_basic_block('loop.body')
+    exit_block = func.append_basic_block('loop.exit')
+    builder.branch(header)
+
+    builder.position_at_end(header)
+    index = builder.phi(I64, name='i')
+    index.add_incoming(ir.Constant(I64, 0), preheader)
+    values = []
+    for value in initial:
+        phi = builder.phi(value.type)
+        phi.add_incoming(value, preheader)
+        values.append(phi)
+    builder.cbranch(builder.icmp_signed('<', index, count), body, exit_block)
+
+    builder.position_at_end(body)
+    updated = step(builder, index, values)
+    latch = builder.block
+    index.add_incoming(builder.add(index, ir.Constant(I64, 1), flags=['nsw']), latch)
+    for phi, value in zip(values, updated):
+        phi.add_incoming(value, latch)
+    backedge = builder.branch(header)
+    if vectorize:
+        backedge.set_metadata('llvm.loop', vectorize_hint(func.module))
+
+    builder.position_at_end(exit_block)
+    return values
@@ -1 +1,270 @@
- 
\ No newline at end of file
+from llvmlite import ir
+from .runtime import (
+    BYTES, FLOAT_FORMAT, I32, I64, VIEW, array_parts, c_string, libc,
+    linkonce_function, loop, slice_view, view,
+)
+
+# Strings are (data, length) pairs, so length is O(1) and a substring or a
+# split part is a view into the original rather than a copy. Strings are
+# never modified in place: concat and join allocate a new one, and a
+# StringBuilder collects appends into one growing buffer. Nothing frees
+# what concat, join and split allocate; a builder that is cleared and read
+# with contents reuses its buffer instead, which is how loops build strings.
+#
+# The imported name's overloads: symbol, return type and parameter types,
+# in Speed type names. Their bodies are generated into the modules that
+# call them (see STRING_BODIES).
+STRING_FUNCTIONS = {
+    'length': [
+        ('speed.string.length', 'int', ['string']),
+        ('speed.string.builder_length', 'int', ['StringBuilder']),
+    ],
+    'concat': [('speed.string.concat', 'string', ['string', 'string'])],
+    'substring': [('speed.string.substring', 'string', ['string', 'int', 'int'])],
+    'find': [('speed.string.find', 'int', ['string', 'string', 'int'])],
+    'equals': [('speed.string.equals', 'bool', ['string', 'string'])],
+    'split': [('speed.string.split', 'string[]', ['string', 'string'])],
+    'join': [('speed.string.join', 'string', ['string[]', 'string'])],
+    'builder': [('speed.string.builder', 'StringBuilder', [])],
+    'append': [
+        ('speed.string.append', 'void', ['StringBuilder', 'string']),
+        ('speed.string.append.int', 'void', ['StringBuilder', 'int']),
+        ('speed.string.append.float', 'void', ['StringBuilder', 'float']),
+    ],
+    'finish': [('speed.string.finish', 'string', ['StringBuilder'])],
+    'contents': [('speed.string.contents', 'string', ['StringBuilder'])],
+    'clear': [('speed.string.clear', 'void', ['StringBuilder'])],
+}
+
+# What a StringBuilder points to: its data, length and capacity
+STRING_BUILDER = ir.LiteralStructType([BYTES, I64, I64])
+# Capacity of a builder's first buffer; it doubles from there
+BUILDER_CAPACITY = 64
+# Room reserved in a builder for one formatted number
+NUMBER_WIDTH = 32
+
+_VOID = ir.VoidType()
+
+def _field(builder, pointer, index):
+    return builder.gep(pointer, [ir.Constant(I32, 0), ir.Constant(I32, index)], inbounds=True)
+
+def _memcpy(builder, target, source, size):
+    memcpy = libc(builder.module, 'memcpy', BYTES, [BYTES, BYTES, I64])
+    builder.call(memcpy, [target, source, size])
+
+def _malloc(builder, size):
+    return builder.call(libc(builder.module, 'malloc', BYTES, [I64]), [size])
+
+def _build_length(func, builder):
+    builder.ret(builder.extract_value(func.args[0], 1))
+
+def _build_concat(func, builder):
+    # Strings are immutable, so an empty side needs no copy
+    left, right = func.args
+    left_data, left_size = array_parts(builder, left)
+    right_data, right_size = array_parts(builder, right)
+    zero = ir.Constant(I64, 0)
+    with builder.if_then(builder.icmp_signed('==', right_size, zero)):
+        builder.ret(left)
+    with builder.if_then(builder.icmp_signed('==', left_size, zero)):
+        builder.ret(right)
+    data = _malloc(builder, builder.add(left_size, right_size))
+    _memcpy(builder, data, left_data, left_size)
+    _memcpy(builder, builder.gep(data, [left_size]), right_data, right_size)
+    builder.ret(view(builder, data, builder.add(left_size, right_size)))
+
+def _build_substring(func, builder):
+    builder.ret(slice_view(builder, *func.args))
+
+def _build_find(func, builder):
+    # Offset of the first occurrence at or after start, or -1
+    text, needle, start = func.args
+    data, size = array_parts(builder, text)
+    needle_data, needle_size = array_parts(builder, needle)
+    start = builder.select(builder.icmp_signed('<', start, ir.Constant(I64, 0)),
+                           ir.Constant(I64, 0), start)
+    with builder.if_then(builder.icmp_signed('>', start, size)):
+        builder.ret(ir.Constant(I64, -1))
+    with builder.if_then(builder.icmp_signed('==', needle_size, ir.Constant(I64, 0))):
+        builder.ret(start)
+    memmem = libc(func.module, 'memmem', BYTES, [BYTES, I64, BYTES, I64])
+    found = builder.call(memmem, [builder.gep(data, [start], inbounds=True),
+                                  builder.sub(size, start), needle_data, needle_size])
+    with builder.if_then(builder.icmp_unsigned('==', found, ir.Constant(BYTES, None))):
+        builder.ret(ir.Constant(I64, -1))
+    builder.ret(builder.sub(builder.ptrtoint(found, I64), builder.ptrtoint(data, I64)))
+
+def _find(builder, text, needle, start):
+    find = STRING_FUNCTIONS['find'][0][0]
+    func = linkonce_function(builder.module, find, I64, [VIEW, VIEW, I64], _build_find)
+    return builder.call(func, [text, needle, start])
+
+def _build_equals(func, builder):
+    left_data, left_size = array_parts(builder, func.args[0])
+    right_data, right_size = array_parts(builder, func.args[1])
+    with builder.if_then(builder.icmp_signed('!=', left_size, right_size)):
+        builder.ret(ir.Constant(ir.IntType(1), False))
+    memcmp = libc(func.module, 'memcmp', I32, [BYTES, BYTES, I64])
+    difference = builder.call(memcmp, [left_data, right_data, left_size])
+    builder.ret(builder.icmp_signed('==', difference, ir.Constant(I32, 0)))
+
+def _build_split(func, builder):
+    # The parts are views into the string; only the array is allocated
+    text, separator = func.args
+    size = builder.extract_value(text, 1)
+    separator_size = builder.extract_value(separator, 1)
+    # Count the separators first; an empty one splits nothing
+    splitting = builder.icmp_signed('!=', separator_size, ir.Constant(I64, 0))
+    entry = builder.block
+    header = func.append_basic_block('count.header')
+    body = func.append_basic_block('count.body')
+    counted = func.append_basic_block('count.done')
+    builder.branch(header)
+    builder.position_at_end(header)
+    position = builder.phi(I64)
+    count = builder.phi(I64)
+    position.add_incoming(ir.Constant(I64, 0), entry)
+    count.add_incoming(ir.Constant(I64, 1), entry)
+    found = _find(builder, text, separator, position)
+    more = builder.and_(splitting, builder.icmp_signed('>=', found, ir.Constant(I64, 0)))
+    builder.cbranch(more, body, counted)
+    builder.position_at_end(body)
+    position.add_incoming(builder.add(found, separator_size), body)
+    count.add_incoming(builder.add(count, ir.Constant(I64, 1)), body)
+    builder.branch(header)
+
+    builder.position_at_end(counted)
+    parts = builder.bitcast(_malloc(builder, builder.mul(count, ir.Constant(I64, 16))),
+                            VIEW.as_pointer())
+    def step(builder, i, values):
+        start, = values
+        end = _find(builder, text, separator, start)
+        builder.store(slice_view(builder, text, start, end), builder.gep(parts, [i], inbounds=True))
+        return [builder.add(end, separator_size)]
+    last = builder.sub(count, ir.Constant(I64, 1))
+    start, = loop(builder, last, [ir.Constant(I64, 0)], step, vectorize=False)
+    builder.store(slice_view(builder, text, start, size), builder.gep(parts, [last], inbounds=True))
+    result = ir.Constant(func.function_type.return_type, ir.Undefined)
+    result = builder.insert_value(result, parts, 0)
+    builder.ret(builder.insert_value(result, count, 1))
+
+def _build_join(func, builder):
+    # Sized exactly up front, so the result is one allocation and one copy
+    parts, count = array_parts(builder, func.args[0])
+    separator_data, separator_size = array_parts(builder, func.args[1])
+    def measure(builder, i, values):
+        part_size = builder.extract_value(builder.load(builder.gep(parts, [i], inbounds=True)), 1)
+        return [builder.add(values[0], part_size)]
+    total, = loop(builder, count, [ir.Constant(I64, 0)], measure)
+    separators = builder.sub(count, ir.Constant(I64, 1))
+    separators = builder.select(builder.icmp_signed('<', separators, ir.Constant(I64, 0)),
+                                ir.Constant(I64, 0), separators)
+    total = builder.add(total, builder.mul(separators, separator_size))
+    data = _malloc(builder, total)
+    def copy(builder, i, values):
+        offset, = values
+        part_data, part_size = array_parts(builder, builder.load(builder.gep(parts, [i], inbounds=True)))
+        _memcpy(builder, builder.gep(data, [offset]), part_data, part_size)
+        offset = builder.add(offset, part_size)
+        # Every part but the last is followed by the separator
+        between = builder.select(builder.icmp_signed('<', i, separators),
+                                 separator_size, ir.Constant(I64, 0))
+        _memcpy(builder, builder.gep(data, [offset]), separator_data, between)
+        return [builder.add(offset, between)]
+    loop(builder, count, [ir.Constant(I64, 0)], copy, vectorize=False)
+    builder.ret(view(builder, data, total))
+
+def _build_builder(func, builder):
+    state = builder.bitcast(_malloc(builder, ir.Constant(I64, 24)), STRING_BUILDER.as_pointer())
+    builder.store(ir.Constant(STRING_BUILDER, [ir.Constant(BYTES, None), ir.Constant(I64, 0),
+                                               ir.Constant(I64, 0)]), state)
+    builder.ret(state)
+
+def _build_builder_length(func, builder):
+    builder.ret(builder.load(_field(builder, func.args[0], 1)))
+
+def _build_reserve(func, builder):
+    # Where the next `extra` bytes go, growing the buffer geometrically
+    state, extra = func.args
+    data_field = _field(builder, state, 0)
+    size = builder.load(_field(builder, state, 1))
+    capacity_field = _field(builder, state, 2)
+    capacity = builder.load(capacity_field)
+    needed = builder.add(size, extra)
+    with builder.if_then(builder.icmp_signed('>', needed, capacity), likely=False):
+        doubled = builder.mul(capacity, ir.Constant(I64, 2))
+        grown = builder.select(builder.icmp_signed('>', doubled, needed), doubled, needed)
+        minimum = ir.Constant(I64, BUILDER_CAPACITY)
+        grown = builder.select(builder.icmp_signed('<', grown, minimum), minimum, grown)
+        realloc = libc(func.module, 'realloc', BYTES, [BYTES, I64])
+        builder.store(builder.call(realloc, [builder.load(data_field), grown]), data_field)
+        builder.store(grown, capacity_field)
+    builder.ret(builder.gep(builder.load(data_field), [size]))
+
+def _reserve(builder, state, extra):
+    func = linkonce_function(builder.module, 'speed.string.reserve', BYTES,
+                             [STRING_BUILDER.as_pointer(), I64], _build_reserve)
+    return builder.call(func, [state, extra])
+
+def _grow(builder, state, size):
+    size_field = _field(builder, state, 1)
+    builder.store(builder.add(builder.load(size_field), size), size_field)
+
+def _build_append(func, builder):
+    state, text = func.args
+    data, size = array_parts(builder, text)
+    _memcpy(builder, _reserve(builder, state, size), data, size)
+    _grow(builder, state, size)
+    builder.ret_void()
+
+def _build_append_number(name, format_text):
+    def build(func, builder):
+        state, value = func.args
+        target = _reserve(builder, state, ir.Constant(I64, NUMBER_WIDTH))
+        snprintf = libc(func.module, 'snprintf', I32, [BYTES, I64, BYTES], var_arg=True)
+        format_string = c_string(builder, name, format_text)
+        size = builder.call(snprintf, [target, ir.Constant(I64, NUMBER_WIDTH), format_string, value])
+        _grow(builder, state, builder.sext(size, I64))
+        builder.ret_void()
+    return build
+
+def _build_finish(func, builder):
+    # The string takes over the buffer and the builder starts again empty
+    state, = func.args
+    data_field = _field(builder, state, 0)
+    size_field = _field(builder, state, 1)
+    result = view(builder, builder.load(data_field), builder.load(size_field))
+    builder.store(ir.Constant(BYTES, None), data_field)
+    builder.store(ir.Constant(I64, 0), size_field)
+    builder.store(ir.Constant(I64, 0), _field(builder, state, 2))
+    builder.ret(result)
+
+def _build_contents(func, builder):
+    # A view of the buffer, valid until the next append or clear
+    state, = func.args
+    builder.ret(view(builder, builder.load(_field(builder, state, 0)),
+                     builder.load(_field(builder, state, 1))))
+
+def _build_clear(func, builder):
+    # Empty, but the buffer is kept for the next appends
+    builder.store(ir.Constant(I64, 0), _field(builder, func.args[0], 1))
+    builder.ret_void()
+
+# Body builders by symbol
+STRING_BODIES = {
+    'speed.string.length': _build_length,
+    'speed.string.builder_length': _build_builder_length,
+    'speed.string.concat': _build_concat,
+    'speed.string.substring': _build_substring,
+    'speed.string.find': _build_find,
+    'speed.string.equals': _build_equals,
+    'speed.string.split': _build_split,
+    'speed.string.join': _build_join,
+    'speed.string.builder': _build_builder,
+    'speed.string.append': _build_append,
+    'speed.string.append.int': _build_append_number('speed.int_format', '%lld'),
+    'speed.string.append.float': _build_append_number('speed.float_format', FLOAT_FORMAT),
+    'speed.string.finish': _build_finish,
+    'speed.string.contents': _build_contents,
+    'speed.string.clear': _build_clear,
+}
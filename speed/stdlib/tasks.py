@@ -0,0 +1,556 @@
+import platform
+from llvmlite import ir
+from .runtime import BYTES, I32, I64, I8, c_string, libc, linkonce_function, linkonce_global, loop
+
+# An `async fn` compiles to an LLVM coroutine (the switch-resumed kind): the
+# coroutine passes split it into a function that runs the body up to its
+# first suspension and a frame on the heap holding the rest of its state.
+# Calling one starts it straight away, and what the call returns once it
+# first suspends is the frame, the task. The part of the frame shared with
+# whoever awaits the task, its promise, holds the task waiting for it, its
+# state and, when it is done, its result.
+#
+# Suspended tasks are resumed by one event loop per process, which runs
+# while the program awaits a task outside any async fn. Tasks that can go
+# on are resumed in the order they became ready; when there are none, the
+# loop sleeps in epoll(7) until a socket a task waits for is ready or the
+# earliest timer is due. The loop is Linux-only.
+
+# Task states, as bits
+TASK_DONE = 1
+# Nobody will await the task, which frees itself when it is done
+TASK_DETACHED = 2
+# What the promise is aligned to, in every coroutine and every awaiter
+PROMISE_ALIGNMENT = 8
+# Ready-queue and timer-heap entries made room for at first
+INITIAL_CAPACITY = 64
+# Events taken from epoll_wait(2) at once
+EVENT_BATCH = 64
+
+# epoll(7) and clock_gettime(2) constants
+EPOLLIN = 0x001
+EPOLLOUT = 0x004
+EPOLLONESHOT = 1 << 30
+EPOLL_CTL_ADD = 1
+EPOLL_CTL_MOD = 3
+EPOLL_CLOEXEC = 0o2000000
+CLOCK_MONOTONIC = 1
+
+_VOID = ir.VoidType()
+_I1 = ir.IntType(1)
+_NULL = ir.Constant(BYTES, None)
+_TASKS = BYTES.as_pointer()
+# The start of every promise: the task awaiting this one, and the state
+_HEADER = [BYTES, I64]
+# A timer: when it is due, in nanoseconds of the monotonic clock, and the
+# task it wakes
+_TIMER = ir.LiteralStructType([I64, BYTES])
+# struct epoll_event, which glibc packs on x86-64 only
+_EVENT = ir.LiteralStructType([I32, I64], packed=platform.machine() in ('x86_64', 'AMD64'))
+# A TaskGroup points to: its tasks, how many there are, and room for how many
+TASK_GROUP = ir.LiteralStructType([_TASKS, I64, I64])
+
+# The imported name's overloads, as in IO_FUNCTIONS. A `task` parameter
+# takes a task of any result type.
+TASKS_FUNCTIONS = {
+    'sleep': [('speed.tasks.sleep', 'task<void>', ['int'])],
+    'group': [('speed.tasks.group', 'TaskGroup', [])],
+    'spawn': [('speed.tasks.spawn', 'void', ['TaskGroup', 'task'])],
+    'gather': [('speed.tasks.gather', 'task<int>', ['TaskGroup'])],
+}
+
+class _Token(ir.Type):
+    """LLVM's token type, which llvmlite does not have."""
+
+    def _to_string(self):
+        return 'token'
+
+TOKEN = _Token()
+_NO_TOKEN = ir.FormattedConstant(TOKEN, 'none')
+
+def _intrinsic(module, name, return_type, param_types):
+    return libc(module, name, return_type, param_types)
+
+def promise_type(result_type):
+    """The promise of a task with a result of an LLVM type (None for void)."""
+    return ir.LiteralStructType(_HEADER + ([] if result_type is None else [result_type]))
+
+def _field(builder, pointer, index):
+    return builder.gep(pointer, [ir.Constant(I32, 0), ir.Constant(I32, index)], inbounds=True)
+
+def _promise(builder, task, result_type=None):
+    promise = _intrinsic(builder.module, 'llvm.coro.promise', BYTES, [BYTES, I32, _I1])
+    pointer = builder.call(promise, [task, ir.Constant(I32, PROMISE_ALIGNMENT), ir.Constant(_I1, False)])
+    return builder.bitcast(pointer, promise_type(result_type).as_pointer())
+
+def _is_done(builder, promise):
+    state = builder.load(_field(builder, promise, 1))
+    return builder.icmp_unsigned('!=', builder.and_(state, ir.Constant(I64, TASK_DONE)), ir.Constant(I64, 0))
+
+class CoroutineAttributes(ir.FunctionAttributes):
+    """Function attributes that also take presplitcoroutine.
+
+    LLVM's coroutine passes only split functions that carry it, and
+    llvmlite rejects attributes missing from its own list.
+    """
+
+    _known = ir.FunctionAttributes._known | {'presplitcoroutine'}
+
+class Coroutine:
+    """Lowers the function being built to a coroutine returning its task.
+
+    Made first thing in the function's entry block, which its allocas may
+    come before; the function returns i8*. suspend() and finish() emit the
+    points where the body gives control back.
+    """
+
+    def __init__(self, builder, result_type):
+        func = builder.function
+        module = func.module
+        func.attributes = CoroutineAttributes(func.attributes)
+        func.attributes.add('presplitcoroutine')
+        self.result_type = result_type
+        self.promise = builder.alloca(promise_type(result_type), name='promise')
+        self.promise.align = PROMISE_ALIGNMENT
+        coro_id = _intrinsic(module, 'llvm.coro.id', TOKEN, [I32, BYTES, BYTES, BYTES])
+        self.id = builder.call(coro_id, [ir.Constant(I32, 0), builder.bitcast(self.promise, BYTES),
+                                         _NULL, _NULL])
+        size = builder.call(_intrinsic(module, 'llvm.coro.size.i64', I64, []), [])
+        frame = builder.call(libc(module, 'malloc', BYTES, [I64]), [size])
+        begin = _intrinsic(module, 'llvm.coro.begin', BYTES, [TOKEN, BYTES])
+        self.handle = builder.call(begin, [self.id, frame])
+        builder.store(_NULL, _field(builder, self.promise, 0))
+        self.begun = builder.store(ir.Constant(I64, 0), _field(builder, self.promise, 1))
+
+        # Destroying the task frees its frame
+        self.cleanup = func.append_basic_block('task.cleanup')
+        self.end = func.append_basic_block('task.end')
+        self.done = func.append_basic_block('task.done')
+        tail = ir.IRBuilder(self.cleanup)
+        free = _intrinsic(module, 'llvm.coro.free', BYTES, [TOKEN, BYTES])
+        memory = tail.call(free, [self.id, self.handle])
+        tail.call(libc(module, 'free', _VOID, [BYTES]), [memory])
+        tail.branch(self.end)
+        tail.position_at_end(self.end)
+        tail.call(_intrinsic(module, 'llvm.coro.end', _VOID, [BYTES, _I1, TOKEN]),
+                  [self.handle, ir.Constant(_I1, False), _NO_TOKEN])
+        tail.ret(self.handle)
+
+        # Every finish() comes here: a coroutine has one final suspension,
+        # where it waits to be destroyed by whoever awaits it
+        tail.position_at_end(self.done)
+        state_pointer = _field(tail, self.promise, 1)
+        state = tail.load(state_pointer)
+        tail.store(tail.or_(state, ir.Constant(I64, TASK_DONE)), state_pointer)
+        waiter = tail.load(_field(tail, self.promise, 0))
+        with tail.if_then(tail.icmp_unsigned('!=', waiter, _NULL)):
+            tail.call(schedule(module), [waiter])
+        detached = tail.and_(state, ir.Constant(I64, TASK_DETACHED))
+        final = func.append_basic_block('task.final')
+        tail.cbranch(tail.icmp_unsigned('!=', detached, ir.Constant(I64, 0)), self.cleanup, final)
+        tail.position_at_end(final)
+        self._suspend(tail, True, self.cleanup)
+
+    def _suspend(self, builder, final, resume):
+        suspend = _intrinsic(builder.module, 'llvm.coro.suspend', I8, [TOKEN, _I1])
+        outcome = builder.call(suspend, [_NO_TOKEN, ir.Constant(_I1, final)])
+        switch = builder.switch(outcome, self.end)
+        switch.add_case(ir.Constant(I8, 0), resume)
+        switch.add_case(ir.Constant(I8, 1), self.cleanup)
+
+    def suspend(self, builder):
+        """Give control back until the task is resumed, and go on there."""
+        resume = builder.function.append_basic_block('task.resume')
+        self._suspend(builder, False, resume)
+        builder.position_at_end(resume)
+
+    def finish(self, builder, value=None):
+        """Complete the task with its result, waking the task awaiting it."""
+        if value is not None:
+            builder.store(value, _field(builder, self.promise, 2))
+        builder.branch(self.done)
+
+def await_task(builder, task, result_type, coroutine=None):
+    """The result of a task (None for void) once it is done, destroying it.
+
+    In a coroutine, the coroutine waits for the task; anywhere else the
+    event loop runs until the task is done.
+    """
+    promise = _promise(builder, task, result_type)
+    if coroutine is None:
+        builder.call(run(builder.module), [task])
+    else:
+        with builder.if_then(builder.not_(_is_done(builder, promise))):
+            builder.store(coroutine.handle, _field(builder, promise, 0))
+            coroutine.suspend(builder)
+    result = None
+    if result_type is not None:
+        result = builder.load(_field(builder, promise, 2))
+    builder.call(_intrinsic(builder.module, 'llvm.coro.destroy', _VOID, [BYTES]), [task])
+    return result
+
+def _build_detach(func, builder):
+    task, = func.args
+    promise = _promise(builder, task)
+    with builder.if_then(_is_done(builder, promise)):
+        builder.call(_intrinsic(func.module, 'llvm.coro.destroy', _VOID, [BYTES]), [task])
+        builder.ret_void()
+    state_pointer = _field(builder, promise, 1)
+    state = builder.load(state_pointer)
+    builder.store(builder.or_(state, ir.Constant(I64, TASK_DETACHED)), state_pointer)
+    builder.ret_void()
+
+def detach(module):
+    """speed.task.detach(task): let a task nobody awaits free itself."""
+    return linkonce_function(module, 'speed.task.detach', _VOID, [BYTES], _build_detach)
+
+def _queue(module):
+    """The ready tasks, a ring buffer: the buffer, where the first is, how
+    many there are and room for how many (a power of two)."""
+    return (linkonce_global(module, 'speed.loop.queue', _TASKS, None),
+            linkonce_global(module, 'speed.loop.head', I64, 0),
+            linkonce_global(module, 'speed.loop.count', I64, 0),
+            linkonce_global(module, 'speed.loop.capacity', I64, 0))
+
+def _timers(module):
+    """The timers, a binary min-heap on when they are due: the heap, how
+    many there are and room for how many."""
+    return (linkonce_global(module, 'speed.loop.timers', _TIMER.as_pointer(), None),
+            linkonce_global(module, 'speed.loop.timer_count', I64, 0),
+            linkonce_global(module, 'speed.loop.timer_capacity', I64, 0))
+
+def _waiting(module):
+    """How many tasks wait for a socket."""
+    return linkonce_global(module, 'speed.loop.waiting', I64, 0)
+
+def _build_schedule(func, builder):
+    task, = func.args
+    module = func.module
+    queue, head, count, capacity = _queue(module)
+    size = builder.load(count)
+    room = builder.load(capacity)
+    with builder.if_then(builder.icmp_unsigned('==', size, room), likely=False):
+        # Copy the tasks into a buffer twice the size, first at the start
+        larger = builder.select(builder.icmp_unsigned('==', room, ir.Constant(I64, 0)),
+                                ir.Constant(I64, INITIAL_CAPACITY), builder.shl(room, ir.Constant(I64, 1)))
+        memory = builder.call(libc(module, 'malloc', BYTES, [I64]),
+                              [builder.mul(larger, ir.Constant(I64, 8))])
+        grown = builder.bitcast(memory, _TASKS)
+        old = builder.load(queue)
+        first = builder.load(head)
+        mask = builder.sub(room, ir.Constant(I64, 1))
+        def step(builder, i, values):
+            at = builder.and_(builder.add(first, i), mask)
+            moved = builder.load(builder.gep(old, [at], inbounds=True))
+            builder.store(moved, builder.gep(grown, [i], inbounds=True))
+            return []
+        loop(builder, size, [], step, vectorize=False)
+        builder.call(libc(module, 'free', _VOID, [BYTES]), [builder.bitcast(old, BYTES)])
+        builder.store(grown, queue)
+        builder.store(ir.Constant(I64, 0), head)
+        builder.store(larger, capacity)
+    mask = builder.sub(builder.load(capacity), ir.Constant(I64, 1))
+    at = builder.and_(builder.add(builder.load(head), size), mask)
+    builder.store(task, builder.gep(builder.load(queue), [at], inbounds=True))
+    builder.store(builder.add(size, ir.Constant(I64, 1)), count)
+    builder.ret_void()
+
+def schedule(module):
+    """speed.loop.schedule(task): resume a task once those ready before it ran."""
+    return linkonce_function(module, 'speed.loop.schedule', _VOID, [BYTES], _build_schedule)
+
+def _build_now(func, builder):
+    timespec = builder.alloca(ir.LiteralStructType([I64, I64]))
+    clock_gettime = libc(func.module, 'clock_gettime', I32, [I32, timespec.type])
+    builder.call(clock_gettime, [ir.Constant(I32, CLOCK_MONOTONIC), timespec])
+    seconds = builder.load(_field(builder, timespec, 0))
+    nanoseconds = builder.load(_field(builder, timespec, 1))
+    builder.ret(builder.add(builder.mul(seconds, ir.Constant(I64, 1_000_000_000)), nanoseconds))
+
+def now(module):
+    """speed.loop.now(): the monotonic clock, in nanoseconds."""
+    return linkonce_function(module, 'speed.loop.now', I64, [], _build_now)
+
+def _timer_at(builder, heap, index):
+    return builder.gep(heap, [index], inbounds=True)
+
+def _swap_timers(builder, heap, a, b):
+    first = builder.load(_timer_at(builder, heap, a))
+    second = builder.load(_timer_at(builder, heap, b))
+    builder.store(second, _timer_at(builder, heap, a))
+    builder.store(first, _timer_at(builder, heap, b))
+
+def _build_add_timer(func, builder):
+    deadline, task = func.args
+    module = func.module
+    timers, count, capacity = _timers(module)
+    size = builder.load(count)
+    room = builder.load(capacity)
+    with builder.if_then(builder.icmp_unsigned('==', size, room), likely=False):
+        larger = builder.select(builder.icmp_unsigned('==', room, ir.Constant(I64, 0)),
+                                ir.Constant(I64, INITIAL_CAPACITY), builder.shl(room, ir.Constant(I64, 1)))
+        realloc = libc(module, 'realloc', BYTES, [BYTES, I64])
+        memory = builder.call(realloc, [builder.bitcast(builder.load(timers), BYTES),
+                                        builder.mul(larger, ir.Constant(I64, 16))])
+        builder.store(builder.bitcast(memory, _TIMER.as_pointer()), timers)
+        builder.store(larger, capacity)
+    heap = builder.load(timers)
+    timer = ir.Constant(_TIMER, ir.Undefined)
+    timer = builder.insert_value(builder.insert_value(timer, deadline, 0), task, 1)
+    builder.store(timer, _timer_at(builder, heap, size))
+    builder.store(builder.add(size, ir.Constant(I64, 1)), count)
+
+    # Sift up: swap with the parent while it is due later
+    entry = builder.block
+    header = func.append_basic_block('up')
+    swap = func.append_basic_block('up.swap')
+    done = func.append_basic_block('done')
+    builder.branch(header)
+    builder.position_at_end(header)
+    index = builder.phi(I64)
+    index.add_incoming(size, entry)
+    parent = builder.lshr(builder.sub(index, ir.Constant(I64, 1)), ir.Constant(I64, 1))
+    at_root = builder.icmp_unsigned('==', index, ir.Constant(I64, 0))
+    with builder.if_then(at_root):
+        builder.branch(done)
+    parent_due = builder.load(_field(builder, _timer_at(builder, heap, parent), 0))
+    builder.cbranch(builder.icmp_signed('>', parent_due, deadline), swap, done)
+    builder.position_at_end(swap)
+    _swap_timers(builder, heap, index, parent)
+    index.add_incoming(parent, swap)
+    builder.branch(header)
+    builder.position_at_end(done)
+    builder.ret_void()
+
+def add_timer(module):
+    """speed.loop.timer(deadline, task): resume a task once the monotonic
+    clock reaches a deadline, in nanoseconds."""
+    return linkonce_function(module, 'speed.loop.timer', _VOID, [I64, BYTES], _build_add_timer)
+
+def _build_pop_timer(func, builder):
+    # The earliest timer's task; there is at least one timer
+    module = func.module
+    timers, count, _ = _timers(module)
+    heap = builder.load(timers)
+    task = builder.load(_field(builder, _timer_at(builder, heap, ir.Constant(I64, 0)), 1))
+    size = builder.sub(builder.load(count), ir.Constant(I64, 1))
+    builder.store(size, count)
+    last = builder.load(_timer_at(builder, heap, size))
+    builder.store(last, _timer_at(builder, heap, ir.Constant(I64, 0)))
+
+    # Sift down: swap with the earlier child while it is due sooner
+    entry = builder.block
+    header = func.append_basic_block('down')
+    swap = func.append_basic_block('down.swap')
+    done = func.append_basic_block('done')
+    builder.branch(header)
+    builder.position_at_end(header)
+    index = builder.phi(I64)
+    index.add_incoming(ir.Constant(I64, 0), entry)
+    left = builder.add(builder.shl(index, ir.Constant(I64, 1)), ir.Constant(I64, 1))
+    right = builder.add(left, ir.Constant(I64, 1))
+    with builder.if_then(builder.icmp_unsigned('>=', left, size)):
+        builder.branch(done)
+    def due(at):
+        return builder.load(_field(builder, _timer_at(builder, heap, at), 0))
+    has_right = builder.icmp_unsigned('<', right, size)
+    # Only read past the left child when there is a right one
+    right_due = builder.select(has_right, due(builder.select(has_right, right, left)), due(left))
+    child = builder.select(builder.icmp_signed('<', right_due, due(left)), right, left)
+    builder.cbranch(builder.icmp_signed('<', due(child), due(index)), swap, done)
+    builder.position_at_end(swap)
+    _swap_timers(builder, heap, index, child)
+    index.add_incoming(child, swap)
+    builder.branch(header)
+    builder.position_at_end(done)
+    builder.ret(task)
+
+def _pop_timer(module):
+    return linkonce_function(module, 'speed.loop.pop_timer', BYTES, [], _build_pop_timer)
+
+def _build_poller(func, builder):
+    poller = linkonce_global(func.module, 'speed.loop.epoll', I32, -1)
+    fd = builder.load(poller)
+    with builder.if_then(builder.icmp_signed('<', fd, ir.Constant(I32, 0)), likely=False):
+        create = libc(func.module, 'epoll_create1', I32, [I32])
+        created = builder.call(create, [ir.Constant(I32, EPOLL_CLOEXEC)])
+        builder.store(created, poller)
+        builder.ret(created)
+    builder.ret(fd)
+
+def _poller(module):
+    return linkonce_function(module, 'speed.loop.poller', I32, [], _build_poller)
+
+def _build_wait(func, builder):
+    fd, events, task = func.args
+    module = func.module
+    ctl = libc(module, 'epoll_ctl', I32, [I32, I32, I32, _EVENT.as_pointer()])
+    event = builder.alloca(_EVENT)
+    builder.store(builder.or_(events, ir.Constant(I32, EPOLLONESHOT)), _field(builder, event, 0))
+    builder.store(builder.ptrtoint(task, I64), _field(builder, event, 1))
+    poller = builder.call(_poller(module), [])
+    descriptor = builder.trunc(fd, I32)
+    # A socket waited for before is still registered, only disarmed
+    changed = builder.call(ctl, [poller, ir.Constant(I32, EPOLL_CTL_MOD), descriptor, event])
+    with builder.if_then(builder.icmp_signed('!=', changed, ir.Constant(I32, 0))):
+        builder.call(ctl, [poller, ir.Constant(I32, EPOLL_CTL_ADD), descriptor, event])
+    waiting = _waiting(module)
+    builder.store(builder.add(builder.load(waiting), ir.Constant(I64, 1)), waiting)
+    builder.ret_void()
+
+def wait(module):
+    """speed.loop.wait(fd, events, task): resume a task once a file
+    descriptor is ready for the epoll events given."""
+    return linkonce_function(module, 'speed.loop.wait', _VOID, [I64, I32, BYTES], _build_wait)
+
+def _build_run(func, builder):
+    task, = func.args
+    module = func.module
+    queue, head, count, capacity = _queue(module)
+    timers, timer_count, _ = _timers(module)
+    waiting = _waiting(module)
+    events = linkonce_global(module, 'speed.loop.events', ir.ArrayType(_EVENT, EVENT_BATCH), None)
+    resume = _intrinsic(module, 'llvm.coro.resume', _VOID, [BYTES])
+    promise = _promise(builder, task)
+    # How long to sleep in epoll, in milliseconds; -1 is until woken
+    timeout = builder.alloca(I32)
+
+    header = func.append_basic_block('loop')
+    idle = func.append_basic_block('idle')
+    expire = func.append_basic_block('expire')
+    poll = func.append_basic_block('poll')
+    builder.branch(header)
+
+    builder.position_at_end(header)
+    with builder.if_then(_is_done(builder, promise)):
+        builder.ret_void()
+    ready = builder.load(count)
+    with builder.if_then(builder.icmp_unsigned('!=', ready, ir.Constant(I64, 0))):
+        first = builder.load(head)
+        next_task = builder.load(builder.gep(builder.load(queue), [first], inbounds=True))
+        mask = builder.sub(builder.load(capacity), ir.Constant(I64, 1))
+        builder.store(builder.and_(builder.add(first, ir.Constant(I64, 1)), mask), head)
+        builder.store(builder.sub(ready, ir.Constant(I64, 1)), count)
+        builder.call(resume, [next_task])
+        builder.branch(header)
+    builder.branch(idle)
+
+    # Nothing is ready: wake the tasks whose timers are due
+    builder.position_at_end(idle)
+    current = builder.call(now(module), [])
+    builder.branch(expire)
+    builder.position_at_end(expire)
+    pending = builder.load(timer_count)
+    has_timer = builder.icmp_unsigned('!=', pending, ir.Constant(I64, 0))
+    with builder.if_then(has_timer):
+        due = builder.load(_field(builder, builder.load(timers), 0))
+        with builder.if_then(builder.icmp_signed('<=', due, current)):
+            builder.call(schedule(module), [builder.call(_pop_timer(module), [])])
+            builder.branch(expire)
+    with builder.if_then(builder.icmp_unsigned('!=', builder.load(count), ir.Constant(I64, 0))):
+        builder.branch(header)
+    nothing = builder.and_(builder.not_(has_timer),
+                           builder.icmp_unsigned('==', builder.load(waiting), ir.Constant(I64, 0)))
+    with builder.if_then(nothing, likely=False):
+        # No task can ever wake the one awaited
+        message = "speed: awaited a task that can never finish\n"
+        write = libc(module, 'write', I64, [I32, BYTES, I64])
+        builder.call(write, [ir.Constant(I32, 2), c_string(builder, 'speed.loop.stuck', message),
+                             ir.Constant(I64, len(message))])
+        builder.call(libc(module, 'abort', _VOID, []), [])
+        builder.unreachable()
+    builder.store(ir.Constant(I32, -1), timeout)
+    builder.branch(poll)
+
+    # Sleep until a socket is ready or the next timer is due
+    builder.position_at_end(poll)
+    with builder.if_then(has_timer):
+        until_due = builder.sub(builder.load(_field(builder, builder.load(timers), 0)), current)
+        # Rounded up to whole milliseconds, so the timer is due on waking
+        milliseconds = builder.sdiv(builder.add(until_due, ir.Constant(I64, 999_999)),
+                                    ir.Constant(I64, 1_000_000))
+        builder.store(builder.trunc(milliseconds, I32), timeout)
+    epoll_wait = libc(module, 'epoll_wait', I32, [I32, _EVENT.as_pointer(), I32, I32])
+    batch = builder.gep(events, [ir.Constant(I32, 0), ir.Constant(I32, 0)], inbounds=True)
+    woken = builder.call(epoll_wait, [builder.call(_poller(module), []), batch,
+                                      ir.Constant(I32, EVENT_BATCH), builder.load(timeout)])
+    # Interrupted by a signal, it wakes nobody
+    woken = builder.sext(builder.select(builder.icmp_signed('<', woken, ir.Constant(I32, 0)),
+                                        ir.Constant(I32, 0), woken), I64)
+    def step(builder, i, values):
+        data = builder.load(_field(builder, builder.gep(batch, [i], inbounds=True), 1))
+        builder.call(schedule(module), [builder.inttoptr(data, BYTES)])
+        return []
+    loop(builder, woken, [], step, vectorize=False)
+    builder.store(builder.sub(builder.load(waiting), woken), waiting)
+    builder.branch(header)
+
+def run(module):
+    """speed.loop.run(task): run the event loop until a task is done."""
+    return linkonce_function(module, 'speed.loop.run', _VOID, [BYTES], _build_run)
+
+def _build_sleep(func, builder):
+    milliseconds, = func.args
+    module = func.module
+    coroutine = Coroutine(builder, None)
+    nanoseconds = builder.mul(milliseconds, ir.Constant(I64, 1_000_000))
+    deadline = builder.add(builder.call(now(module), []), nanoseconds)
+    builder.call(add_timer(module), [deadline, coroutine.handle])
+    coroutine.suspend(builder)
+    coroutine.finish(builder)
+
+def _build_group(func, builder):
+    malloc = libc(func.module, 'malloc', BYTES, [I64])
+    size = ir.Constant(TASK_GROUP.as_pointer(), None).gep([ir.Constant(I32, 1)])
+    group = builder.bitcast(builder.call(malloc, [size.ptrtoint(I64)]), TASK_GROUP.as_pointer())
+    builder.store(ir.Constant(TASK_GROUP, None), group)
+    builder.ret(group)
+
+def _build_spawn(func, builder):
+    group, task = func.args
+    tasks, count, capacity = (_field(builder, group, index) for index in range(3))
+    size = builder.load(count)
+    room = builder.load(capacity)
+    with builder.if_then(builder.icmp_unsigned('==', size, room), likely=False):
+        larger = builder.select(builder.icmp_unsigned('==', room, ir.Constant(I64, 0)),
+                                ir.Constant(I64, INITIAL_CAPACITY), builder.shl(room, ir.Constant(I64, 1)))
+        realloc = libc(func.module, 'realloc', BYTES, [BYTES, I64])
+        memory = builder.call(realloc, [builder.bitcast(builder.load(tasks), BYTES),
+                                        builder.mul(larger, ir.Constant(I64, 8))])
+        builder.store(builder.bitcast(memory, _TASKS), tasks)
+        builder.store(larger, capacity)
+    builder.store(task, builder.gep(builder.load(tasks), [size], inbounds=True))
+    builder.store(builder.add(size, ir.Constant(I64, 1)), count)
+    builder.ret_void()
+
+def _build_gather(func, builder):
+    # Await the group's tasks in turn; they all run meanwhile
+    group, = func.args
+    coroutine = Coroutine(builder, I64)
+    tasks, count = _field(builder, group, 0), _field(builder, group, 1)
+    entry = builder.block
+    header = func.append_basic_block('gather')
+    body = func.append_basic_block('gather.next')
+    done = func.append_basic_block('gather.done')
+    builder.branch(header)
+    builder.position_at_end(header)
+    index = builder.phi(I64)
+    index.add_incoming(ir.Constant(I64, 0), entry)
+    builder.cbranch(builder.icmp_unsigned('<', index, builder.load(count)), body, done)
+    builder.position_at_end(body)
+    task = builder.load(builder.gep(builder.load(tasks), [index], inbounds=True))
+    await_task(builder, task, None, coroutine)
+    index.add_incoming(builder.add(index, ir.Constant(I64, 1)), builder.block)
+    builder.branch(header)
+    builder.position_at_end(done)
+    # The group is empty again, for more tasks
+    builder.store(ir.Constant(I64, 0), count)
+    coroutine.finish(builder, index)
+
+# Body builders by symbol, as in IO_BODIES
+TASKS_BODIES = {
+    'speed.tasks.sleep': _build_sleep,
+    'speed.tasks.group': _build_group,
+    'speed.tasks.spawn': _build_spawn,
+    'speed.tasks.gather': _build_gather,
+}
@@ -1,8 +1,25 @@
+import ctypes
+import math
+import os
+import subprocess
+import sys
+import time
 import pytest
+import llvmlite.binding as llvm
+from llvmlite import ir
+from rply.errors import LexingError
 from speed.compiler.compiler import Compiler
 from speed.compiler.lexer import Lexer
 from speed.compiler.parser import Parser
 from speed.compiler.codegen import CodeGenerator
+from speed.compiler.backend import OPT_LEVELS, Backend, find_linker
+from speed.compiler.jit import JIT
+from speed.compiler.incremental import IncrementalCompiler, split_top_level
+from speed.compiler.build import Build, collect_sources
+from speed.compiler.visitor import NodeVisitor
+from speed.compiler.optimizer import ConstantFolder, Inliner
+from speed.compiler.typecheck import TypeChecker
+from speed.cli import main as cli_main
 from speed.compiler.ast import (
     FunctionDeclaration,
     Program,
@@ -13,7 +30,10 @@ from speed.compiler.ast import (
     Call,
     ReturnStatement,
     VariableDeclaration,
-    ClassDeclaration
+    ClassDeclaration,
+    ForStatement,
+    Assignment,
+    walk
 )
 
 def test_lexer():
@@ -59,8 +79,8 @@ def test_codegen():
     
     # Verify LLVM IR
     ir_str = str(module)
-    assert 'define i32 @add(i32 %a, i32 %b)' in ir_str
-    assert 'ret i32' in ir_str
+    assert 'define internal i64 @"add"(i64 %".1", i64 %".2")' in ir_str
+    assert 'add i64' in ir_str and 'ret i64' in ir_str
 
 def test_compiler_integration():
     compiler = Compiler()
@@ -76,11 +96,11 @@ def test_compiler_integration():
     
     # Verify LLVM IR
     ir_str = str(module)
-    assert 'define i32 @fibonacci(i32 %n)' in ir_str
-    assert 'icmp sle i32' in ir_str  # Less than or equal comparison
-    assert 'call i32 @fibonacci' in ir_str  # Recursive call
+    assert 'define internal i64 @"fibonacci"(i64 %".1")' in ir_str
+    assert 'icmp sle i64' in ir_str  # Less than or equal comparison
+    assert 'call i64 @"fibonacci"' in ir_str  # Recursive call
 
-def test_standard_library():
+def test_standard_library(capfd):
     compiler = Compiler()
     source_code = """
         import { print } from "io";
@@ -101,11 +121,19 @@ def test_standard_library():
     
     # Verify LLVM IR
     ir_str = str(module)
-    assert 'declare void @print' in ir_str
-    assert 'declare double @math_sin' in ir_str
-    assert 'declare double @math_cos' in ir_str
-    assert 'declare i32 @string_length' in ir_str
-    assert 'declare i8* @string_concat' in ir_str
+    assert 'define linkonce_odr void @"speed.io.print.float"(double' in ir_str
+    assert 'define linkonce_odr void @"speed.io.print"({i8*, i64}' in ir_str
+    assert 'declare double @"llvm.sin.f64"(double' in ir_str
+    assert 'declare double @"llvm.cos.f64"(double' in ir_str
+    assert 'define linkonce_odr {i8*, i64} @"speed.string.concat"' in ir_str
+    assert JIT(use_cache=False).run(source_code) == 0
+    out = capfd.readouterr().out.splitlines()
+    assert len(out) == 3
+    assert float(out[0]) == pytest.approx(math.sin(3.14))
+    assert float(out[1]) == pytest.approx(math.cos(3.14))
+    # Floats are printed with %.15g, one per line through the buffered writer
+    assert out[:2] == [f'{math.sin(3.14):.15g}', f'{math.cos(3.14):.15g}']
+    assert out[2] == 'HelloWorld'
 
 def test_error_handling():
     compiler = Compiler()
@@ -126,11 +154,11 @@ def test_error_handling():
             }
         """)
 
-def test_complex_program():
+def test_complex_program(capfd):
     compiler = Compiler()
     source_code = """
         import { print } from "io";
-        import { random } from "math";
+        import { random, sqrt } from "math";
         import { length, split, join } from "string";
         
         class Point {
@@ -164,7 +192,1573 @@ def test_complex_program():
     
     # Verify LLVM IR
     ir_str = str(module)
-    assert '%struct.Point' in ir_str
-    assert 'define double @Point_distance' in ir_str
-    assert 'call i8* @string_split' in ir_str
-    assert 'call i8* @string_join' in ir_str 
\ No newline at end of file
+    assert '%"struct.Point" = type {i64, double, double}' in ir_str
+    assert 'define internal double @"Point_distance"(%"struct.Point"* %".1", %"struct.Point"* %".2")' in ir_str
+    assert 'call double @"llvm.sqrt.f64"' in ir_str
+    assert 'call {{i8*, i64}*, i64} @"speed.string.split"' in ir_str
+    assert 'call {i8*, i64} @"speed.string.join"' in ir_str
+    assert JIT(use_cache=False).run(source_code) == 0
+    out = capfd.readouterr().out.splitlines()
+    assert len(out) == 2
+    # A whole float prints without a fraction
+    assert out[0] == '5'
+    # split keeps the space after the comma, and join adds another
+    assert out[1] == 'Hello  World!'
+
+def test_parser_tables_shared_between_instances():
+    assert Parser().get_parser() is Parser().get_parser()
+
+def test_parser_tables_cached_on_disk(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmp_path))
+    monkeypatch.setattr(Parser, '_shared_parser', None)
+    Parser().get_parser()
+    cache_files = list((tmp_path / 'rply').glob(f'{Parser.CACHE_ID}-*.json'))
+    assert len(cache_files) == 1
+
+    # A fresh process would load the tables instead of regenerating them
+    monkeypatch.setattr(Parser, '_shared_parser', None)
+    tokens = Lexer().get_lexer().lex("fn one(): int { return 1; }")
+    ast = Parser().get_parser().parse(tokens)
+    assert ast.statements[0].name == 'one'
+
+def test_lexer_backends_agree():
+    source = """
+        fn add(a: int, b: int): int {
+            // comment
+            return a + b;
+        }
+    """
+    regex_tokens = list(Lexer('regex').get_lexer().lex(source))
+    rply_tokens = list(Lexer('rply').get_lexer().lex(source))
+    assert regex_tokens == rply_tokens
+    assert [t.getsourcepos().lineno for t in regex_tokens] == \
+        [t.getsourcepos().lineno for t in rply_tokens]
+
+def test_regex_lexer_maximal_munch():
+    tokens = list(Lexer().get_lexer().lex('let fname = 3.14 <= intx == true;'))
+    assert [(t.gettokentype(), t.getstr()) for t in tokens] == [
+        ('LET', 'let'),
+        ('IDENTIFIER', 'fname'),
+        ('ASSIGN', '='),
+        ('FLOAT', '3.14'),
+        ('LESS_EQUALS', '<='),
+        ('IDENTIFIER', 'intx'),
+        ('EQUALS', '=='),
+        ('BOOLEAN', 'true'),
+        ('SEMICOLON', ';'),
+    ]
+
+def test_regex_lexer_errors():
+    with pytest.raises(LexingError):
+        list(Lexer().get_lexer().lex('let x = 1 @ 2;'))
+    with pytest.raises(ValueError):
+        Lexer('unknown')
+
+def test_compile_stats():
+    compiler = Compiler()
+    module, stats = compiler.compile("""
+        fn add(a: int, b: int): int {
+            return a + b;
+        }
+    """, stats=True)
+
+    assert module is compiler.codegen.module
+    assert set(stats.times) == {'lex', 'parse', 'check', 'inline', 'fold', 'codegen'}
+    assert stats.tokens == 20
+    assert stats.nodes > 0
+    assert stats.functions == 1
+    assert stats.instructions > 0
+    assert 'codegen' in stats.format()
+
+def test_compile_twice():
+    # Every compile() gets a module of its own
+    compiler = Compiler()
+    source = "fn add(a: int, b: int): int { return a + b; }"
+    first = str(compiler.compile(source))
+    second, _ = compiler.compile(source, stats=True)
+    assert str(second) == first
+    assert first.count('define') == 1
+    llvm.parse_assembly(first).verify()
+
+def test_compile_to_file_stats(tmp_path):
+    output_file = tmp_path / 'add.ll'
+    result, stats = Compiler().compile_to_file(
+        "fn add(a: int, b: int): int { return a + b; }", str(output_file), stats=True)
+    assert result == str(output_file)
+    assert 'emit' in stats.times
+    assert output_file.read_text().count('define') == 1
+
+def _parse_time(source, runs):
+    tokens = list(Lexer().get_lexer().lex(source))
+    parser = Parser().get_parser()
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        ast = parser.parse(iter(tokens))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return ast, best
+
+@pytest.mark.parametrize('template', [
+    '{body}',
+    'fn f(): int {{\n{body}return 0;\n}}\n',
+])
+def test_parser_scales_linearly(template):
+    times = []
+    for count, runs in ((1000, 5), (10000, 3), (100000, 1)):
+        source = template.format(body='let v = 1;\n' * count)
+        ast, elapsed = _parse_time(source, runs)
+        statements = ast.statements if len(ast.statements) > 1 else ast.statements[0].body
+        assert len(statements) >= count
+        times.append(elapsed)
+
+    # Each 10x step in size should cost about 10x the time; a quadratic
+    # builder would be ~100x per step.
+    assert times[1] / times[0] < 30
+    assert times[2] / times[1] < 30
+
+MAIN_SOURCE = """
+    fn main(argc: int): int {
+        let b = argc + argc;
+        return b * argc;
+    }
+"""
+
+@pytest.mark.parametrize('opt_level', OPT_LEVELS)
+def test_compile_to_object(tmp_path, opt_level):
+    output_file = tmp_path / 'main.o'
+    Compiler().compile_to_object(MAIN_SOURCE, str(output_file), opt_level=opt_level)
+    assert output_file.stat().st_size > 0
+
+def test_optimized_ir_promotes_locals(tmp_path):
+    output_file = tmp_path / 'main.ll'
+    Compiler().compile_to_file(MAIN_SOURCE, str(output_file), opt_level='2')
+    ir_str = output_file.read_text()
+    assert 'define i32 @main' in ir_str
+    assert 'alloca' not in ir_str
+
+def test_invalid_opt_level():
+    with pytest.raises(ValueError):
+        Backend('4')
+
+@pytest.mark.skipif(find_linker() is None, reason='no system linker')
+def test_compile_to_executable(tmp_path):
+    output_file = tmp_path / 'main'
+    Compiler().compile_to_executable(MAIN_SOURCE, str(output_file), opt_level='3')
+    # argc is 3 here, so main returns (3 + 3) * 3
+    result = subprocess.run([str(output_file), 'a', 'b'])
+    assert result.returncode == 18
+
+JIT_SOURCE = """
+    fn helper(a: int, b: int): int {
+        return a * b + a;
+    }
+    fn main(): int {
+        return helper(6, 7);
+    }
+"""
+
+def test_jit_run(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    assert JIT().run(JIT_SOURCE) == 48
+    assert len(list((tmp_path / 'jit').glob('*.o'))) == 1
+
+def test_jit_cache_skips_compilation(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    JIT().run(JIT_SOURCE)
+
+    def fail(*args, **kwargs):
+        raise AssertionError("cached program was recompiled")
+    monkeypatch.setattr(Compiler, 'compile', fail)
+    assert JIT().run(JIT_SOURCE) == 48
+
+    # A different optimization level is a different cache entry
+    with pytest.raises(AssertionError):
+        JIT(opt_level='0').run(JIT_SOURCE)
+    # and so are different compiler options
+    for options in ({'fold': False}, {'inline': False}, {'elide_retains': False},
+                    {'stack_objects': False}):
+        with pytest.raises(AssertionError):
+            JIT(compiler=Compiler(**options)).run(JIT_SOURCE)
+
+def test_jit_requires_main(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    with pytest.raises(ValueError):
+        JIT().run("fn helper(): int { return 1; }")
+    with pytest.raises(ValueError):
+        JIT(use_cache=False).run("fn main(argc: int): int { return argc; }")
+
+def test_cli_run(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    source_file = tmp_path / 'main.speed'
+    source_file.write_text(JIT_SOURCE)
+    assert cli_main(['run', str(source_file)]) == 48
+    assert cli_main(['run', '--no-cache', '-O0', str(source_file)]) == 48
+
+def test_cli_module_exit_status(tmp_path):
+    # python -m speed.cli exits with the program's status, or 1 on an error
+    source_file = tmp_path / 'main.speed'
+    source_file.write_text(JIT_SOURCE)
+    broken_file = tmp_path / 'broken.speed'
+    broken_file.write_text('fn main(): int {\n    return missing;\n}')
+    root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    env = {**os.environ, 'SPEED_CACHE_DIR': str(tmp_path), 'PYTHONPATH': root}
+    for path, status in ((source_file, 48), (broken_file, 1)):
+        result = subprocess.run([sys.executable, '-m', 'speed.cli', 'run', str(path)],
+                                capture_output=True, env=env)
+        assert result.returncode == status
+
+INCREMENTAL_SOURCE = """
+    import { print } from "io"
+    fn square(x: int): int {
+        return x * x;
+    }
+    fn area(w: int, h: int): int {
+        // braces in comments and strings do not matter: { "}"
+        let label = "{area}";
+        return w * h;
+    }
+    fn main(): int {
+        return square(area(2, 3));
+    }
+"""
+
+def test_split_top_level():
+    chunks = split_top_level(INCREMENTAL_SOURCE)
+    assert [chunk.split()[0] for chunk in chunks] == ['import', 'fn', 'fn', 'fn']
+    assert 'from "io"' in chunks[0]
+
+def test_incremental_rebuilds_only_changed_declarations(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    incremental = IncrementalCompiler(Compiler())
+    first = incremental.compile(INCREMENTAL_SOURCE)
+    assert incremental.rebuilt == ['square', 'area', 'main']
+    llvm.parse_assembly(first).verify()
+
+    edited = INCREMENTAL_SOURCE.replace('return w * h;', 'return w * h + w;')
+    second = incremental.compile(edited)
+    assert incremental.rebuilt == ['area']
+    assert incremental.reused == ['square', 'main']
+    llvm.parse_assembly(second).verify()
+
+    # A fresh compiler picks the pieces up from the disk cache
+    fresh = IncrementalCompiler(Compiler())
+    assert fresh.compile(edited) == second
+    assert fresh.rebuilt == []
+
+def test_incremental_signature_change_rebuilds_callers():
+    # Without inlining, so main calls square rather than containing its body
+    incremental = IncrementalCompiler(Compiler(inline=False), use_disk_cache=False)
+    incremental.compile(INCREMENTAL_SOURCE)
+
+    renamed = INCREMENTAL_SOURCE.replace('fn square(x: int)', 'fn square(y: int)').replace('x * x', 'y * y')
+    incremental.compile(renamed)
+    assert incremental.rebuilt == ['square']
+
+    widened = INCREMENTAL_SOURCE.replace('fn square(x: int)', 'fn square(x: float)').replace('x * x', '1')
+    ir_str = incremental.compile(widened)
+    assert sorted(incremental.rebuilt) == ['main', 'square']
+    # The caller converts its int argument for the new signature
+    assert 'sitofp i64' in ir_str
+    assert 'call i64 @"square"(double' in ir_str
+
+def test_incremental_inlines_like_a_full_compile():
+    source = INCREMENTAL_SOURCE.replace('return square(area(2, 3));',
+                                        'let a = area(2, 3);\n        return square(a);')
+    incremental = IncrementalCompiler(Compiler(), use_disk_cache=False)
+    ir_str = incremental.compile(source)
+    # square is expanded in main, as Compiler.compile does, so main no longer calls it
+    for output in (ir_str, str(Compiler().compile(source))):
+        assert '@"square"' not in output[output.index('@"main"'):]
+    # The inlined body is part of main's key: editing it rebuilds main too
+    incremental.compile(source.replace('return x * x;', 'return x * x + 1;'))
+    assert sorted(incremental.rebuilt) == ['main', 'square']
+    # area is too big to inline, so editing it leaves main alone
+    incremental.compile(source.replace('return w * h;', 'return w * h + w;'))
+    assert incremental.rebuilt == ['area']
+
+def test_cli_incremental(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    source_file = tmp_path / 'main.speed'
+    source_file.write_text(INCREMENTAL_SOURCE)
+    output_file = tmp_path / 'main.ll'
+    cli_main([str(source_file), '--incremental', '-o', str(output_file)])
+    cli_main([str(source_file), '--incremental', '-o', str(output_file)])
+    assert 'define i32 @"main"()' in output_file.read_text()
+
+def write_project(root, count):
+    (root / 'lib').mkdir()
+    for i in range(count):
+        (root / 'lib' / f'unit{i}.speed').write_text(
+            f'public fn scale{i}(x: int): int {{\n    return x * {i};\n}}\n'
+            f'public fn label{i}(): string {{\n    return "unit {i}";\n}}\n')
+    (root / 'main.speed').write_text('fn main(): int {\n    return 21;\n}\n')
+
+def test_collect_sources(tmp_path):
+    write_project(tmp_path, 3)
+    (tmp_path / 'notes.txt').write_text('not a source file')
+    sources = collect_sources([str(tmp_path)])
+    assert [os.path.relpath(path, tmp_path) for path in sources] == [
+        os.path.join('lib', 'unit0.speed'), os.path.join('lib', 'unit1.speed'),
+        os.path.join('lib', 'unit2.speed'), 'main.speed']
+    with pytest.raises(ValueError):
+        collect_sources([str(tmp_path / 'missing.speed')])
+
+def test_parallel_build_links_units(tmp_path):
+    write_project(tmp_path, 4)
+    serial = Build(jobs=1).build([str(tmp_path)])
+    units, linked = Build(jobs=2).build([str(tmp_path)])
+    assert [unit.path for unit in units] == [unit.path for unit in serial[0]]
+    assert all(unit.times['codegen'] > 0 for unit in units)
+    names = {func.name for func in linked.functions}
+    assert names == {'main'} | {f'{kind}{i}' for kind in ('scale', 'label') for i in range(4)}
+    # Every unit has a str_0; they must not clash once linked
+    assert len(list(linked.global_variables)) == 4
+
+def test_build_duplicate_definition(tmp_path):
+    write_project(tmp_path, 1)
+    (tmp_path / 'again.speed').write_text('fn main(): int {\n    return 1;\n}\n')
+    with pytest.raises(ValueError, match='main'):
+        Build(jobs=1).build([str(tmp_path)])
+
+def test_build_calls_between_files(tmp_path):
+    (tmp_path / 'lib.speed').write_text(
+        '// shared helpers\npublic fn helper(x: int): int {\n    return x * 2;\n}\n'
+        'fn hidden(): int {\n    return 1;\n}\n')
+    (tmp_path / 'main.speed').write_text('fn main(): int {\n    return helper(21);\n}\n')
+    for jobs in (1, 2):
+        _, linked = Build(jobs=jobs).build([str(tmp_path)])
+        assert not linked.get_function('helper').is_declaration
+        assert '@helper(i64 21)' in str(linked.get_function('main'))
+    if find_linker() is not None:
+        output_file = tmp_path / 'program'
+        Build(jobs=2).write_executable([str(tmp_path)], str(output_file))
+        assert subprocess.run([str(output_file)]).returncode == 42
+    # Functions that are not public stay out of reach
+    (tmp_path / 'main.speed').write_text('fn main(): int {\n    return hidden();\n}\n')
+    with pytest.raises(ValueError, match='main.speed: Function hidden not found'):
+        Build(jobs=1).build([str(tmp_path)])
+
+@pytest.mark.skipif(find_linker() is None, reason='no system linker')
+def test_cli_build_executable(tmp_path, capsys):
+    write_project(tmp_path, 2)
+    output_file = tmp_path / 'program'
+    assert cli_main(['build', str(tmp_path), '-O2', '-j', '2', '-o', str(output_file)]) == 0
+    out = capsys.readouterr().out
+    assert os.path.join('lib', 'unit1.speed') in out and 'link:' in out
+    assert subprocess.run([str(output_file)]).returncode == 21
+
+def test_string_literals_are_interned():
+    lets = '\n'.join(f'    let s{i} = "{"hello" if i % 2 else "world"}";' for i in range(500))
+    source = f'fn greet(): string {{\n{lets}\n    return "hello";\n}}'
+    module = Compiler().compile(source)
+    strings = [g for g in module.global_values if isinstance(g, ir.GlobalVariable)]
+    assert len(strings) == 2
+    for g in strings:
+        assert g.linkage == 'private' and g.unnamed_addr
+    ir_str = str(module)
+    # Strings carry their length, which does not count the terminator
+    assert 'ret {i8*, i64} {i8* getelementptr ([6 x i8], [6 x i8]* @"str_1", i32 0, i32 0), i64 5}' in ir_str
+    llvm.parse_assembly(ir_str).verify()
+
+class LiteralCounter(NodeVisitor):
+    def __init__(self):
+        self.literals = 0
+        self.expressions = 0
+
+    def visit_Literal(self, node):
+        self.literals += 1
+
+    def visit_Expression(self, node):
+        self.expressions += 1
+        self.generic_visit(node)
+
+def test_visitor_dispatch_table():
+    program = Compiler().parser.get_parser().parse(Compiler().lexer.get_lexer().lex(
+        "fn f(a: int): int {\n    let x = a + 1 * 2;\n    return x - 3;\n}"))
+    counter = LiteralCounter()
+    counter.visit(program)
+    assert counter.literals == 3
+    # BinaryOps and Identifiers fall back to the Expression handler
+    assert counter.expressions == 5
+    assert LiteralCounter._dispatch[Literal] is LiteralCounter.visit_Literal
+    assert LiteralCounter._dispatch[BinaryOp] is LiteralCounter.visit_Expression
+    # Each visitor class has a table of its own
+    assert Literal not in NodeVisitor._dispatch
+    assert CodeGenerator._dispatch.get(Literal) in (None, CodeGenerator.visit_Literal)
+
+def test_codegen_rejects_unknown_nodes():
+    with pytest.raises(ValueError, match='Unknown node type'):
+        CodeGenerator().generate(Parameter('a', Type('int')))
+
+def test_ast_nodes_are_slotted_and_carry_spans():
+    source = "fn f(a: int): int {\n    let x = (a + 1) * 2;\n    return x - 3;\n}"
+    compiler = Compiler()
+    program = compiler.parser.get_parser().parse(compiler.lexer.get_lexer().lex(source))
+    texts = {}
+    for node in walk(program):
+        assert not hasattr(node, '__dict__')
+        texts.setdefault(type(node).__name__, []).append(source[node.start:node.end])
+    assert texts['FunctionDeclaration'] == [source]
+    assert texts['VariableDeclaration'] == ['let x = (a + 1) * 2;']
+    assert texts['BinaryOp'] == ['(a + 1) * 2', '(a + 1)', 'x - 3']
+    assert texts['Identifier'] == ['a', 'x']
+    assert texts['Parameter'] == ['a: int']
+    assert Literal(1).span == (None, None)
+    assert BinaryOp._fields == ('op', 'left', 'right')
+
+def allocas_outside_entry(module):
+    """Allocas anywhere but the leading run of each function's entry block."""
+    misplaced = []
+    for func in module.functions:
+        if not func.blocks:
+            continue
+        entry, *rest = func.blocks
+        leading = 0
+        while leading < len(entry.instructions) and entry.instructions[leading].opname == 'alloca':
+            leading += 1
+        misplaced += [instr for instr in entry.instructions[leading:] if instr.opname == 'alloca']
+        misplaced += [instr for block in rest for instr in block.instructions if instr.opname == 'alloca']
+    return misplaced
+
+def test_locals_are_allocated_in_entry_block():
+    module = Compiler().compile("""
+        fn f(a: int, b: int): int {
+            let x = a * b;
+            let y: int = x + a;
+            return y - 1;
+        }
+    """)
+    assert allocas_outside_entry(module) == []
+    entry = module.get_global('f').entry_basic_block
+    assert [instr.name for instr in entry.instructions[:4]] == ['a', 'b', 'x', 'y']
+
+def test_entry_alloca_from_later_block():
+    codegen = CodeGenerator()
+    func = ir.Function(codegen.module, ir.FunctionType(ir.IntType(32), []), name='g')
+    codegen.function = func
+    codegen.builder = ir.IRBuilder(func.append_basic_block('entry'))
+    first = codegen.create_entry_alloca(ir.IntType(32), 'first')
+    body = func.append_basic_block('body')
+    codegen.builder.branch(body)
+    codegen.builder.position_at_end(body)
+    second = codegen.create_entry_alloca(ir.IntType(32), 'second')
+    codegen.builder.store(ir.Constant(ir.IntType(32), 1), second)
+    codegen.builder.ret(codegen.builder.load(second))
+    assert second.parent is func.entry_basic_block
+    assert func.entry_basic_block.instructions[:2] == [first, second]
+    assert allocas_outside_entry(codegen.module) == []
+    assert func.entry_basic_block.is_terminated and body.is_terminated
+
+@pytest.mark.parametrize('opt_level', OPT_LEVELS)
+def test_locals_promoted_to_registers(opt_level):
+    module = Compiler().compile("""
+        fn f(a: int, b: float): float {
+            let x = b * 2.0;
+            let y = x + b;
+            return y;
+        }
+    """)
+    optimized = str(Backend(opt_level).compile(module))
+    assert 'alloca' not in optimized
+    assert 'load' not in optimized and 'store' not in optimized
+
+LOOP_SOURCE = """
+public fn dot(n: int): float {
+    let sum = 0.0;
+    let x = 0.0;
+    #[vectorize]
+    #[unroll(4)]
+    for (let i = 0; i < n; i = i + 1) {
+        sum = sum + (x * 0.5) * (x * 0.25);
+        x = x + 1.0;
+    }
+    return sum;
+}
+
+fn collatz(start: int): int {
+    let n = start;
+    let steps = 0;
+    while (n != 1) {
+        if (n % 2 == 0) {
+            n = n / 2;
+        } else {
+            n = 3 * n + 1;
+        }
+        steps = steps + 1;
+    }
+    return steps;
+}
+
+fn main(): int {
+    let total = 0;
+    for (let k = 1; k <= 10; k = k + 1) {
+        total = total + collatz(k);
+    }
+    return total;
+}
+"""
+
+def test_loop_attributes_and_precedence():
+    compiler = Compiler()
+    program = compiler.parser.get_parser().parse(compiler.lexer.get_lexer().lex(LOOP_SOURCE))
+    loop = program.statements[0].body[2]
+    assert isinstance(loop, ForStatement)
+    assert [(attr.name, attr.arguments) for attr in loop.attributes] == [('vectorize', []), ('unroll', [4])]
+    # Comparisons bind looser than arithmetic
+    condition = program.statements[1].body[2].body[0].condition
+    assert condition.op == '==' and condition.left.op == '%'
+
+def test_loop_codegen_shape_and_metadata():
+    module = Compiler().compile(LOOP_SOURCE)
+    dot = module.get_global('dot')
+    assert [block.name for block in dot.blocks] == [
+        'entry', 'loop.preheader', 'loop.header', 'loop.body', 'loop.latch', 'loop.exit']
+    backedge = dot.blocks[4].terminator
+    assert 'llvm.loop' in backedge.metadata
+    ir_str = str(module)
+    assert '!"llvm.loop.vectorize.enable", i1 true' in ir_str
+    assert '!"llvm.loop.unroll.count", i32 4' in ir_str
+    assert 'fadd reassoc double' in ir_str
+    # Only the hinted loop carries metadata or reassociation
+    assert 'reassoc' not in str(module.get_global('collatz'))
+    assert allocas_outside_entry(module) == []
+    llvm.parse_assembly(ir_str).verify()
+
+def test_vectorize_hint_vectorizes_reduction():
+    module = Compiler().compile(LOOP_SOURCE)
+    optimized = str(Backend('3').compile(module))
+    assert 'x double>' in optimized
+    unhinted = Compiler().compile(LOOP_SOURCE.replace('#[vectorize]', ''))
+    assert 'x double>' not in str(Backend('3').compile(unhinted))
+
+@pytest.mark.parametrize('opt_level', ['0', '3'])
+def test_loops_run(opt_level):
+    # Collatz step counts for 1..10 add up to 67
+    assert JIT(opt_level=opt_level, use_cache=False).run(LOOP_SOURCE) == 67
+
+def test_unknown_loop_attribute():
+    with pytest.raises(ValueError, match='Unknown loop attribute: fast'):
+        Compiler().compile("fn f(n: int): int {\n    #[fast]\n    while (n > 0) { n = n - 1; }\n    return n;\n}")
+
+def test_incremental_renumbers_loop_metadata():
+    source = LOOP_SOURCE.replace('while (n != 1)', '#[unroll(2)]\n    while (n != 1)')
+    ir_str = IncrementalCompiler(Compiler(), use_disk_cache=False).compile(source)
+    llvm.parse_assembly(ir_str).verify()
+    assert '!"llvm.loop.unroll.count", i32 2' in ir_str
+
+def test_control_flow_without_parentheses():
+    source = LOOP_SOURCE.replace('while (n != 1)', 'while n != 1').replace(
+        'if (n % 2 == 0)', 'if n % 2 == 0').replace(
+        'for (let k = 1; k <= 10; k = k + 1)', 'for let k = 1; k <= 10; k = k + 1')
+    assert source.count('(') < LOOP_SOURCE.count('(')
+    assert JIT(use_cache=False).run(source) == 67
+
+FOLD_SOURCE = """
+fn f(a: int): int {
+    let seconds = 60 * 60 * 24;
+    let half = (0 - 7) / 2;
+    let rest = (0 - 7) % 2;
+    let ratio = 1.5 * 4.0;
+    let crash = a / 0;
+    if 2 > 3 {
+        a = a + 1;
+    } else {
+        a = a + seconds;
+    }
+    while 1 == 2 {
+        a = a - 1;
+    }
+    if a > 0 {
+        return a;
+    } else {
+        return half + rest;
+    }
+    a = a * 2;
+    return a;
+}
+"""
+
+def test_constant_folding():
+    folder = ConstantFolder()
+    program = folder.visit(Compiler().parser.get_parser().parse(
+        Compiler().lexer.get_lexer().lex(FOLD_SOURCE)))
+    body = program.statements[0].body
+    values = [stmt.initializer.value for stmt in body[:4]]
+    # Integer division truncates toward zero like sdiv
+    assert values == [86400, -3, -1, 6.0]
+    # Division by zero is left to run time
+    assert isinstance(body[4].initializer, BinaryOp)
+    # The else branch of the constant if is spliced in; the loop and the
+    # statements after the terminating if/else are gone
+    assert isinstance(body[5], Assignment) and body[5].value.right.name == 'seconds'
+    assert len(body) == 7 and body[6].else_branch
+    assert folder.folded == 9
+    assert folder.removed == 4
+
+def test_constant_folding_shrinks_ir():
+    folded = Compiler().compile(FOLD_SOURCE, stats=True)[1]
+    unfolded = Compiler(fold=False).compile(FOLD_SOURCE, stats=True)[1]
+    assert folded.instructions < unfolded.instructions
+    assert 'ret i64 10' in str(Compiler().compile("fn f(): int {\n    return 2 * 3 + 4;\n}"))
+
+def test_folded_programs_behave_the_same():
+    assert JIT(use_cache=False, compiler=Compiler(fold=False)).run(LOOP_SOURCE) == 67
+    assert JIT(use_cache=False).run(LOOP_SOURCE) == 67
+
+TYPED_SOURCE = """
+fn mean(total: float, count: int): float {
+    return total / count;
+}
+fn big(): int {
+    let x = 3000000000;
+    return x * 4 / 8;
+}
+fn main(): int {
+    let half: float = 1;
+    let m = mean(7, 2) + half;
+    if m == 4.5 {
+        return big() % 256;
+    }
+    return 0;
+}
+"""
+
+def test_type_inference():
+    checker = TypeChecker()
+    program = checker.visit(Compiler().parser.get_parser().parse(
+        Compiler().lexer.get_lexer().lex(TYPED_SOURCE)))
+    mean, big, main = program.statements
+    division = mean.body[0].expression
+    assert division.type == 'float'
+    # The int operand is converted explicitly; literals are converted in place
+    assert type(division.right).__name__ == 'Cast' and division.right.expression.type == 'int'
+    assert main.body[0].initializer.value == 1.0 and main.body[0].initializer.type == 'float'
+    assert [arg.type for arg in main.body[1].initializer.left.arguments] == ['float', 'int']
+    assert main.body[2].condition.type == 'bool'
+    assert big.body[1].expression.type == 'int'
+    assert checker.conversions == 3
+    # Inferred types are annotations, not child fields
+    assert BinaryOp._fields == ('op', 'left', 'right')
+
+def test_typed_codegen_is_unboxed_and_sized():
+    ir_str = str(Compiler().compile(TYPED_SOURCE))
+    assert 'define internal double @"mean"(double %".1", i64 %".2")' in ir_str
+    assert 'sitofp i64' in ir_str
+    assert 'fdiv double' in ir_str
+    assert 'mul i64' in ir_str
+    # main stays a C int
+    assert 'define i32 @"main"()' in ir_str
+    # 3000000000 * 4 overflows i32 but not i64: (12000000000 / 8) % 256 == 0,
+    # while mean(7, 2) + 1.0 == 4.5 only holds with float division
+    assert JIT(use_cache=False).run(TYPED_SOURCE) == 1500000000 % 256
+
+@pytest.mark.parametrize('source, message', [
+    ('fn f(): int { return 1.5; }', 'Cannot convert float to int'),
+    ('fn f(): int { let s = "a"; return s + 1; }', 'Unsupported operand types for +'),
+    ('fn f(x: int): int { return f(1, 2); }', 'takes 1 arguments but 2 were given'),
+    ('fn f(): int { return g(); }', 'Function g not found'),
+    ('fn f(): int { return y; }', 'Undefined variable: y'),
+    ('fn f(): int { if "yes" { return 1; } return 0; }', 'condition of if'),
+    ('fn f(x: any): int { return 1; }', 'needs a static type'),
+])
+def test_type_errors(source, message):
+    with pytest.raises(ValueError, match=message):
+        Compiler().compile(source)
+
+INLINE_SOURCE = """
+fn square(x: int): int {
+    return x * x;
+}
+fn next(): int {
+    return 3;
+}
+#[noinline]
+fn twice(x: int): int {
+    return x + x;
+}
+#[inline]
+fn clamp(x: int): int {
+    if x > 100 {
+        return 100;
+    }
+    return x;
+}
+fn fact(n: int): int {
+    if n <= 1 {
+        return 1;
+    }
+    return n * fact(n - 1);
+}
+public fn main(): int {
+    let a = square(4) + square(next());
+    let b = square(a + 1) + twice(a);
+    return clamp(a + b) + fact(3);
+}
+"""
+
+def function_ir(module, name):
+    return str(module.get_global(name))
+
+def test_inliner_expands_small_functions():
+    inliner = Inliner()
+    program = inliner.visit(TypeChecker().visit(Compiler().parser.get_parser().parse(
+        Compiler().lexer.get_lexer().lex(INLINE_SOURCE))))
+    main = program.statements[-1]
+    calls = sorted(node.function for node in walk(main) if isinstance(node, Call))
+    # next() and then square(4) and square(3) are inlined; square(a + 1)
+    # would evaluate a + 1 twice, twice is #[noinline], clamp is not a
+    # single return and fact is recursive
+    assert calls == ['clamp', 'fact', 'square', 'twice']
+    assert inliner.inlined == 3
+    # A call in an argument is never duplicated
+    checker = TypeChecker()
+    program = Inliner().visit(checker.visit(Compiler().parser.get_parser().parse(
+        Compiler().lexer.get_lexer().lex(INLINE_SOURCE.replace('square(next())', 'square(fact(2))')))))
+    assert 'square' in [node.function for node in walk(program.statements[-1]) if isinstance(node, Call)]
+
+def test_inlined_code_and_function_attributes():
+    module = Compiler().compile(INLINE_SOURCE)
+    main = function_ir(module, 'main')
+    assert 'mul i64 4, 4' not in main and '@"square"(i64 4)' not in main
+    assert 'call i64 @"twice"' in main
+    assert module.get_global('square').linkage == 'internal'
+    assert module.get_global('main').linkage == ''
+    assert 'noinline' in module.get_global('twice').attributes
+    assert 'alwaysinline' in module.get_global('clamp').attributes
+    # alwaysinline is honoured without the optimization pipeline
+    promoted = Backend('0').compile(module)
+    assert 'call i64 @clamp' not in str(promoted.get_function('main'))
+    # 16 + 9 = 25; 26 * 26 + 50 = 726 clamps to 100; 100 + 6 = 106
+    assert JIT(opt_level='0', use_cache=False).run(INLINE_SOURCE) == 106
+    assert JIT(use_cache=False, compiler=Compiler(inline=False)).run(INLINE_SOURCE) == 106
+
+def test_unknown_function_attribute():
+    with pytest.raises(ValueError, match='Unknown function attribute: hot'):
+        Compiler().compile("#[hot]\nfn f(): int {\n    return 1;\n}")
+
+MATH_SOURCE = """
+import { sqrt, pow, floor, abs, min, max, pi } from "math"
+fn hypot(a: float, b: float): float {
+    return sqrt(pow(a, 2) + b * b);
+}
+fn main(): float {
+    let h = hypot(3, 4);
+    let area = floor(pi * h * h);
+    return max(min(area, 100), abs(0 - 1.5));
+}
+"""
+
+def test_math_lowers_to_intrinsics():
+    module = Compiler().compile(MATH_SOURCE)
+    ir_str = str(module)
+    for intrinsic in ('sqrt', 'pow', 'floor', 'fabs', 'minnum', 'maxnum'):
+        assert f'declare double @"llvm.{intrinsic}.f64"(double' in ir_str
+    assert 'math_' not in ir_str
+    # pi is an immediate double, not a global to load
+    assert '0x400921fb54442d18' in ir_str
+    # Calls on constants fold away once the pipeline runs
+    optimized = str(Backend('2').compile(Compiler().compile(
+        'import { sqrt } from "math"\npublic fn f(): float {\n    return sqrt(16.0);\n}')))
+    assert 'ret double 4.0' in optimized
+
+@pytest.mark.parametrize('opt_level', ['0', '2'])
+def test_math_runs(opt_level):
+    # floor(pi * 25) = 78, min(78, 100) = 78
+    program = JIT(opt_level=opt_level, use_cache=False).load(MATH_SOURCE)
+    assert program.main() == 78.0
+
+@pytest.mark.parametrize('opt_level', ['0', '2'])
+def test_math_tan_runs(opt_level):
+    # llvm.tan is lowered to the libm call on targets without an instruction
+    source = """
+import { tan, tan_into, zeros } from "math"
+fn main(): float {
+    let xs = zeros(2);
+    xs[0] = 0.5;
+    xs[1] = 1;
+    let out = zeros(2);
+    tan_into(xs, out);
+    return tan(0.25) + out[0] + out[1];
+}
+"""
+    assert 'declare double @"llvm.tan.f64"(double' in str(Compiler().compile(source))
+    program = JIT(opt_level=opt_level, use_cache=False).load(source)
+    assert program.main() == pytest.approx(math.tan(0.25) + math.tan(0.5) + math.tan(1))
+
+RANDOM_SOURCE = """
+import { random, random_int, random_float, seed } from "math"
+fn main(): int {
+    seed(42);
+    let first = random();
+    for (let i = 0; i < 1000; i = i + 1) {
+        let r = random_int(1, 6);
+        if (r < 1) {
+            return 1;
+        }
+        if (r > 6) {
+            return 1;
+        }
+        let f = random_float(2, 3);
+        if (f < 2) {
+            return 1;
+        }
+        if (f >= 3) {
+            return 1;
+        }
+    }
+    seed(42);
+    if (random() != first) {
+        return 2;
+    }
+    return 0;
+}
+"""
+
+def test_math_random():
+    # In range, and the same sequence again after seeding
+    assert JIT(use_cache=False).run(RANDOM_SOURCE) == 0
+    ir_str = str(Compiler().compile(RANDOM_SOURCE))
+    assert 'define linkonce_odr double @"speed.math.random_float"(double %".1", double %".2")' in ir_str
+    assert 'random_random' not in ir_str and 'float ' not in ir_str
+
+ARRAY_SOURCE = """
+import { zeros, sin, sin_into, sum, dot, min, max, sqrt } from "math"
+fn fill(n: int): float[] {
+    let xs = zeros(n);
+    for (let i = 0; i < n; i = i + 1) {
+        xs[i] = i + 1;
+    }
+    return xs;
+}
+fn main(): float {
+    let xs = fill(8);
+    let ys = sin(xs);
+    sin_into(xs, ys);
+    let total = sum(xs) + dot(xs, xs) + min(xs) + max(xs) + min(1, 2.5) + xs.length;
+    return total + ys[0] * 0 + sqrt(4);
+}
+"""
+
+def test_array_math_overloads():
+    module = Compiler().compile(ARRAY_SOURCE)
+    assert module.get_global('speed.math.sum').linkage == 'linkonce_odr'
+    assert module.get_global('llvm.minnum.f64').is_declaration
+    # Array functions are only generated when called
+    assert 'speed.math.cos.array' not in module.globals
+    fill = str(module.get_global('fill'))
+    assert '{double*, i64}' in fill and 'sitofp i64' in fill
+    # 36 + 204 + 1 + 8 + 1 + 8 + 2
+    for opt_level in ('0', '2'):
+        assert JIT(opt_level=opt_level, use_cache=False).load(ARRAY_SOURCE).main() == 260.0
+    # Units calling the same kernel share one copy
+    ir_str = IncrementalCompiler(Compiler(), use_disk_cache=False).compile(
+        ARRAY_SOURCE + 'fn other(xs: float[]): float {\n    return sum(xs);\n}\n')
+    llvm.parse_assembly(ir_str).verify()
+
+SCRATCH_SOURCE = """
+import { zeros, sqrt_into, sum } from "math"
+fn l1_norm(xs: float[], squares: float[]): float {
+    for let i = 0; i < xs.length; i = i + 1 {
+        squares[i] = xs[i] * xs[i];
+    }
+    sqrt_into(squares, squares);
+    return sum(squares);
+}
+fn main(): float {
+    let xs = zeros(1000);
+    let squares = zeros(xs.length);
+    let total = 0.0;
+    for let round = 0; round < 100; round = round + 1 {
+        xs[round] = 0 - 1;
+        total = total + l1_norm(xs, squares);
+    }
+    return total;
+}
+"""
+
+def test_into_variants_reuse_arrays():
+    # The loop allocates nothing: both arrays are made once, before it
+    module = Compiler().compile(SCRATCH_SOURCE)
+    for name in ('l1_norm', 'speed.math.sqrt_into', 'speed.math.sum'):
+        assert 'alloc"(' not in str(module.get_global(name))
+    assert str(module.get_global('main')).count('@"speed.math.zeros"') == 2
+    program = JIT(use_cache=False).load(SCRATCH_SOURCE)
+    assert program.main() == 5050.0
+
+@pytest.mark.parametrize('call', ['sum(xs)', 'dot(xs, xs)', 'max(xs)', 'sum(sqrt(xs))'])
+def test_array_kernels_vectorize(call):
+    source = f'import {{ sum, dot, max, sqrt }} from "math"\npublic fn k(xs: float[]): float {{\n    return {call};\n}}'
+    assert 'x double>' in str(Backend('2').compile(Compiler().compile(source)))
+
+@pytest.mark.parametrize('source, message', [
+    ('fn f(x: int): int { return x[0]; }', 'Cannot index int'),
+    ('import { sum } from "math"\nfn f(): float { return sum(1.0); }', r'No overload of sum takes \(float\)'),
+    ('fn f(xs: float[]): int { xs[0] = "a"; return 0; }', 'Cannot convert string to float'),
+])
+def test_array_type_errors(source, message):
+    with pytest.raises(ValueError, match=message):
+        Compiler().compile(source)
+
+@pytest.mark.parametrize('source, message', [
+    ('import { nosuch } from "io"\nfn main(): int { return 0; }', 'Module io has no nosuch'),
+    ('import { print, tau } from "math"\nfn main(): int { return 0; }', 'Module math has no print'),
+    ('import { print } from "nosuch"\nfn main(): int { return 0; }', 'Unknown module: nosuch'),
+])
+def test_import_errors(source, message):
+    with pytest.raises(ValueError, match=message):
+        Compiler().compile(source)
+
+def test_import_semicolon(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    source = 'import { print } from "io";\nfn main(): int {\n    print("hi");\n    return 0;\n}\n'
+    # The semicolon stays with its import rather than becoming a statement
+    chunks = split_top_level(source)
+    assert [chunk.split()[0] for chunk in chunks] == ['import', 'fn']
+    assert chunks[0].rstrip().endswith('";')
+    without = source.replace('";', '"')
+    assert str(Compiler().compile(source)) == str(Compiler().compile(without))
+    llvm.parse_assembly(IncrementalCompiler(Compiler()).compile(source)).verify()
+
+@pytest.mark.parametrize('name, last_line', [
+    ('hello.speed', '1'),
+    ('async_network.speed', '3'),
+])
+def test_examples_run(name, last_line, capfd):
+    examples = os.path.join(os.path.dirname(__file__), '..', '..', 'examples')
+    with open(os.path.join(examples, name)) as f:
+        source = f.read()
+    assert JIT(use_cache=False).run(source) == 0
+    assert capfd.readouterr().out.splitlines()[-1] == last_line
+
+PRINT_SOURCE = """
+import { print, write, flush } from "io"
+fn main(): int {
+    print("start");
+    write("partial ");
+    write(0 - 9223372036854775807 - 1);
+    print(2.5);
+    for (let i = 0; i < %d; i = i + 1) {
+        print(i);
+    }
+    flush();
+    write("end");
+    return 0;
+}
+"""
+
+def _expected_print_output(lines):
+    body = ''.join(f'{i}\n' for i in range(lines))
+    return f'start\npartial -92233720368547758082.5\n{body}end'
+
+def test_print_buffered_jit(capfd):
+    # The JIT flushes the buffer after main returns
+    assert JIT(use_cache=False).run(PRINT_SOURCE % 3) == 0
+    assert capfd.readouterr().out == _expected_print_output(3)
+
+@pytest.mark.skipif(find_linker() is None, reason='no system linker')
+def test_print_buffered_executable(tmp_path):
+    # More output than the buffer holds, and the tail is written at exit
+    output_file = tmp_path / 'main'
+    Compiler().compile_to_executable(PRINT_SOURCE % 20000, str(output_file), opt_level='2')
+    result = subprocess.run([str(output_file)], capture_output=True, text=True)
+    assert result.stdout == _expected_print_output(20000)
+
+def test_print_runtime_is_shared_between_units():
+    ir_str = IncrementalCompiler(Compiler(), use_disk_cache=False).compile(
+        PRINT_SOURCE % 1 + 'fn other(x: float): void {\n    print(x);\n}\n')
+    module = llvm.parse_assembly(ir_str)
+    module.verify()
+    assert module.get_global_variable('speed.io.buffer').linkage.name == 'linkonce_odr'
+
+MAP_SOURCE = """
+import { print, map_file, read_file, unmap, line_end, chunk_end, slice, count } from "io"
+fn errors(data: bytes): int {
+    let found = 0;
+    let pos = 0;
+    while (pos < data.length) {
+        let end = line_end(data, pos);
+        let line = slice(data, pos, end);
+        if (line.length > 0) {
+            if (line[0] == 69) {
+                found = found + 1;
+                print(line);
+            }
+        }
+        pos = end + 1;
+    }
+    return found;
+}
+fn main(): int {
+    let mapped = map_file("%(path)s");
+    let copied = read_file("%(path)s");
+    let missing = map_file("%(path)s.missing");
+    let total = errors(mapped) * 1000 + count(copied, 10) * 100 + chunk_end(mapped, 2, 3) + missing.length;
+    unmap(mapped);
+    unmap(copied);
+    return total;
+}
+"""
+
+def test_map_file_scans_lines(tmp_path, capfd):
+    log = tmp_path / 'service.log'
+    log.write_bytes(b'INFO up\nERROR disk\n\nWARN slow\nERROR net')
+    source = MAP_SOURCE % {'path': log}
+    for opt_level in ('0', '2'):
+        program = JIT(opt_level=opt_level, use_cache=False).load(source)
+        # 2 errors, 4 newlines, and the chunk from 2 runs to the end of line 1
+        assert program.main() == 2408
+        program.flush()
+        assert capfd.readouterr().out == 'ERROR disk\nERROR net\n'
+
+def test_bytes_are_read_only():
+    with pytest.raises(ValueError, match='Cannot assign to an element of bytes'):
+        Compiler().compile('fn f(b: bytes): int {\n    b[0] = 1;\n    return b[0];\n}')
+
+def test_count_vectorizes():
+    source = 'import { count } from "io"\npublic fn k(b: bytes): int {\n    return count(b, 10);\n}'
+    assert 'x i8>' in str(Backend('2').compile(Compiler().compile(source)))
+
+STRING_SOURCE = """
+import { print, write_lines } from "io"
+import { length, concat, substring, find, equals, split, join, builder, append, finish } from "string"
+fn main(): int {
+    let csv = "id,name,,score";
+    let fields = split(csv, ",");
+    write_lines(fields);
+    print(join(fields, " | "));
+    print(concat(substring(csv, 3, 7), "!"));
+    let sb = builder();
+    for (let i = 0; i < 100; i = i + 1) {
+        append(sb, i);
+        append(sb, " ");
+    }
+    append(sb, 0.25);
+    let numbers = finish(sb);
+    print(substring(numbers, 281, 1000));
+    if (equals(fields[1], "name")) {
+        print(find(csv, ",,", 0));
+    }
+    return length(numbers) + csv.length * 1000 + csv[0] * 100000 + length(sb);
+}
+"""
+
+def test_string_runtime(capfd):
+    for opt_level in ('0', '2'):
+        program = JIT(opt_level=opt_level, use_cache=False).load(STRING_SOURCE)
+        # 290 digits and spaces plus "0.25", 14 bytes, and "i" is 105
+        assert program.main() == 294 + 14000 + 10500000
+        program.flush()
+        assert capfd.readouterr().out == (
+            'id\nname\n\nscore\nid | name |  | score\nname!\n97 98 99 0.25\n7\n')
+
+BUILDER_LOOP_SOURCE = """
+import { print } from "io"
+import { builder, append, clear, contents, length } from "string"
+fn main(): int {
+    let sb = builder();
+    for let i = 0; i < 1000; i = i + 1 {
+        clear(sb);
+        append(sb, "line ");
+        append(sb, i);
+        if (i > 997) {
+            print(contents(sb));
+        }
+    }
+    return length(sb);
+}
+"""
+
+def test_string_builder_reuse(capfd):
+    # clear keeps the buffer and contents does not copy it, so the loop
+    # allocates only while the buffer first grows
+    module = Compiler().compile(BUILDER_LOOP_SOURCE)
+    for name in ('speed.string.clear', 'speed.string.contents'):
+        assert 'alloc"(' not in str(module.get_global(name))
+    program = JIT(use_cache=False).load(BUILDER_LOOP_SOURCE)
+    assert program.main() == len('line 999')
+    program.flush()
+    assert capfd.readouterr().out == 'line 998\nline 999\n'
+
+def test_strings_are_read_only():
+    with pytest.raises(ValueError, match='Cannot assign to an element of string'):
+        Compiler().compile('fn f(s: string): int {\n    s[0] = 1;\n    return 0;\n}')
+
+ARENA_SOURCE = """
+import { print } from "io"
+class Point {
+    x: float;
+    y: float;
+    fn init(x: float, y: float) {
+        this.x = x;
+        this.y = y;
+    }
+    fn dot(other: Point): float {
+        return this.x * other.x + this.y * other.y;
+    }
+}
+class Link { value: int; next: Link; }
+fn chain(n: int): int {
+    let head = new Link();
+    for (let i = 1; i <= n; i = i + 1) {
+        head = new Link(i, head);
+    }
+    let sum = 0;
+    while (head.value > 0) {
+        sum = sum + head.value;
+        head = head.next;
+    }
+    return sum;
+}
+fn inner(n: int): int {
+    arena {
+        let link = new Link(n, new Link());
+        arena {
+            link.value = link.value + chain(n);
+            return link.value;
+        }
+    }
+    return 0;
+}
+fn main(): int {
+    let p = new Point(3, 4);
+    print(p.dot(p));
+    let total = 0;
+    for (let round = 0; round < 50; round = round + 1) {
+        arena {
+            total = total + chain(10000) + inner(100);
+        }
+    }
+    print(total);
+    return new Link(7, new Link()).value;
+}
+"""
+
+def test_arena_runtime(capfd):
+    for opt_level in ('0', '2'):
+        program = JIT(opt_level=opt_level, use_cache=False).load(ARENA_SOURCE)
+        assert program.main() == 7
+        program.flush()
+        # Each round: 10000 * 10001 / 2, then 100 plus 100 * 101 / 2
+        assert capfd.readouterr().out == f'25\n{50 * (50005000 + 100 + 5050)}\n'
+        # Every arena was left, and the chunks given back but the spare
+        engine = program.engine
+        for name in ('depth', 'chunk', 'next', 'limit'):
+            address = engine.get_global_value_address(f'speed.arena.{name}')
+            assert ctypes.c_int64.from_address(address).value == 0
+        spare = engine.get_global_value_address('speed.arena.spare')
+        assert ctypes.c_int64.from_address(spare).value != 0
+
+def test_incremental_classes(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    incremental = IncrementalCompiler(Compiler(), use_disk_cache=False)
+    llvm.parse_assembly(incremental.compile(ARENA_SOURCE)).verify()
+    # A method body is the class's own: only the class is rebuilt
+    incremental.compile(ARENA_SOURCE.replace('this.y = y;', 'this.y = y + 0;'))
+    assert incremental.rebuilt == ['Point']
+    # A new field changes the layout, so everything using Point is rebuilt
+    # but the functions that only use Link are not
+    ir_str = incremental.compile(ARENA_SOURCE.replace('    y: float;\n', '    y: float;\n    z: int;\n'))
+    assert incremental.rebuilt == ['Point', 'main']
+    assert '%"struct.Point" = type {i64, double, double, i64}' in ir_str
+    if find_linker() is not None:
+        output_file = tmp_path / 'main'
+        Compiler(incremental=True).compile_to_executable(ARENA_SOURCE, str(output_file))
+        result = subprocess.run([str(output_file)], capture_output=True, text=True)
+        assert result.returncode == 7
+        assert result.stdout == f'25\n{50 * (50005000 + 100 + 5050)}\n'
+
+def test_new_allocates_through_the_runtime():
+    module = Compiler().compile(ARENA_SOURCE)
+    chain = module.get_global('chain')
+    calls = [instr.callee.name for block in chain.blocks for instr in block.instructions
+             if isinstance(instr, ir.CallInstr)]
+    assert calls.count('speed.mem.alloc') == 2
+    inner = module.get_global('inner')
+    calls = [instr.callee.name for block in inner.blocks for instr in block.instructions
+             if isinstance(instr, ir.CallInstr)]
+    # Both arenas are left on the return inside them
+    assert calls.count('speed.arena.enter') == 2
+    assert calls.count('speed.arena.exit') == 2
+    assert 'define internal double @"Point_dot"(%"struct.Point"* %".1", %"struct.Point"* %".2")' \
+        in str(module)
+
+ARC_SOURCE = """
+class Point {
+    x: float;
+    y: float;
+    fn init(x: float, y: float) {
+        this.x = x;
+        this.y = y;
+    }
+    fn plus(other: Point): Point {
+        return new Point(this.x + other.x, this.y + other.y);
+    }
+}
+class Link { value: int; next: Link; }
+fn walk(n: int): int {
+    let head = new Link();
+    for (let i = 1; i <= n; i = i + 1) {
+        head = new Link(i, head);
+    }
+    let sum = 0;
+    let node = head;
+    while (node.value > 0) {
+        sum = sum + node.value;
+        node = node.next;
+    }
+    return sum;
+}
+fn same(p: Point): Point {
+    let q = p;
+    return q;
+}
+public fn churn(n: int): float {
+    let total = new Point(0, 0);
+    for (let i = 0; i < n; i = i + 1) {
+        let step = new Point(i, 1);
+        total = total.plus(same(step)).plus(new Point(0, 0));
+        new Point(1, 1);
+    }
+    return total.x + total.y + walk(100000);
+}
+public fn make(): Point {
+    return new Point(1, 2);
+}
+public fn share(p: Point): Link {
+    let link = new Link(1, new Link());
+    link.next = new Link(2, link.next);
+    return link;
+}
+fn main(): int {
+    return 0;
+}
+"""
+
+class MallInfo(ctypes.Structure):
+    _fields_ = [(name, ctypes.c_size_t) for name in (
+        'arena', 'ordblks', 'smblks', 'hblks', 'hblkhd', 'usmblks', 'fsmblks',
+        'uordblks', 'fordblks', 'keepcost')]
+
+def heap_in_use():
+    libc = ctypes.CDLL(None)
+    libc.mallinfo2.restype = MallInfo
+    return libc.mallinfo2().uordblks
+
+def test_reference_counting():
+    for elide_retains in (False, True):
+        for opt_level in ('0', '2'):
+            compiler = Compiler(elide_retains=elide_retains)
+            program = JIT(compiler=compiler, opt_level=opt_level, use_cache=False).load(ARC_SOURCE)
+            engine = program.engine
+            churn = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+                engine.get_function_address('churn'))
+            churn(100)
+            before = heap_in_use()
+            # The sum of 0..n-1, plus n, plus the 100000-link chain
+            assert churn(10000) == 49995000 + 10000 + 5000050000
+            # Every object made was freed again, the long chain included;
+            # leaking them would take megabytes, the rest is Python's own
+            assert heap_in_use() - before < 1 << 16
+            # What a caller gets back it owns: one reference each
+            make = ctypes.CFUNCTYPE(ctypes.c_void_p)(engine.get_function_address('make'))
+            point = make()
+            assert ctypes.c_int64.from_address(point).value == 1
+            share = ctypes.CFUNCTYPE(ctypes.c_void_p, ctypes.c_void_p)(
+                engine.get_function_address('share'))
+            link = share(point)
+            assert ctypes.c_int64.from_address(link).value == 1
+            # {count, value, next}: the first Link is owned only by the second
+            second = ctypes.c_void_p.from_address(link + 16).value
+            assert ctypes.c_int64.from_address(second).value == 1
+            first = ctypes.c_void_p.from_address(second + 16).value
+            assert ctypes.c_int64.from_address(first).value == 1
+            assert ctypes.c_int64.from_address(point).value == 1
+
+def test_retain_elision():
+    counts = {}
+    for elide_retains in (False, True):
+        module, stats = Compiler(elide_retains=elide_retains).compile(ARC_SOURCE, stats=True)
+        counts[elide_retains] = stats.rc_operations
+        assert 'rc operations' in stats.format()
+        # Neither the parameter of same nor its alias is counted when elided
+        same = module.get_global('same')
+        calls = [instr.callee.name for block in same.blocks for instr in block.instructions
+                 if isinstance(instr, ir.CallInstr)]
+        assert ('speed.release.Point' in calls) != elide_retains
+    assert 0 < counts[True] < counts[False]
+
+def test_incremental_keyed_on_retain_elision(tmp_path, monkeypatch):
+    # Pieces cached with retains elided are not reused without elision
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    elided = IncrementalCompiler(Compiler()).compile(ARC_SOURCE)
+    incremental = IncrementalCompiler(Compiler(elide_retains=False))
+    counted = incremental.compile(ARC_SOURCE)
+    assert incremental.reused == []
+    llvm.parse_assembly(counted).verify()
+    full = str(Compiler(elide_retains=False).compile(ARC_SOURCE))
+    assert counted.count('speed.rc.retain"(') == full.count('speed.rc.retain"(')
+    assert counted.count('speed.rc.retain"(') > elided.count('speed.rc.retain"(')
+
+ESCAPE_SOURCE = """
+class Point {
+    x: float;
+    y: float;
+    fn init(x: float, y: float) {
+        this.x = x;
+        this.y = y;
+    }
+    fn dot(other: Point): float {
+        return this.x * other.x + this.y * other.y;
+    }
+}
+class Box { point: Point; }
+#[noinline]
+fn keep(p: Point): Point {
+    return p;
+}
+#[noinline]
+fn depth(p: Point, n: int): float {
+    if (n == 0) {
+        return p.x;
+    }
+    return depth(p, n - 1);
+}
+#[noinline]
+fn store(box: Box, p: Point): int {
+    box.point = p;
+    return 0;
+}
+public fn local(n: int): float {
+    let total = 0.0;
+    for (let i = 0; i < n; i = i + 1) {
+        let p = new Point(i, 1);
+        p.y = p.y + 1;
+        total = total + p.dot(new Point(1, 0)) + depth(new Point(2, 0), 3) + p.y;
+    }
+    return total;
+}
+public fn escaping(n: int): float {
+    let kept = new Point(0, 0);
+    let box = new Box(new Point(1, 1));
+    for (let i = 0; i < n; i = i + 1) {
+        kept = keep(new Point(i, 0));
+        store(box, new Point(i, 1));
+    }
+    return kept.x + box.point.y;
+}
+fn main(): int {
+    return 0;
+}
+"""
+
+def allocations(module, name):
+    function = module.get_global(name)
+    return sum(1 for block in function.blocks for instr in block.instructions
+               if isinstance(instr, ir.CallInstr) and instr.callee.name == 'speed.mem.alloc')
+
+def test_escape_analysis():
+    module, stats = Compiler().compile(ESCAPE_SOURCE, stats=True)
+    # p, both temporaries (dot and the recursive depth only read them)
+    assert allocations(module, 'local') == 0
+    assert stats.stack_allocated == 3
+    assert 'stack objects: 3' in stats.format()
+    # Kept by a variable that is reassigned, returned, stored in a field,
+    # or in a class with object fields: all stay on the heap
+    assert allocations(module, 'escaping') == 5
+    assert allocations(Compiler(stack_objects=False).compile(ESCAPE_SOURCE), 'local') == 3
+    for stack_objects in (False, True):
+        for opt_level in ('0', '2'):
+            compiler = Compiler(stack_objects=stack_objects)
+            program = JIT(compiler=compiler, opt_level=opt_level, use_cache=False).load(ESCAPE_SOURCE)
+            engine = program.engine
+            local = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+                engine.get_function_address('local'))
+            escaping = ctypes.CFUNCTYPE(ctypes.c_double, ctypes.c_int64)(
+                engine.get_function_address('escaping'))
+            local(10)
+            before = heap_in_use()
+            # i, then 2, then 2 for each i
+            assert local(1000) == 499500 + 1000 * 4
+            assert escaping(1000) == 999 + 1
+            assert heap_in_use() - before < 1 << 16
+
+STACK_UNIT_SOURCE = """
+class P {
+    x: int;
+    fn init(x: int) {
+        this.x = x;
+    }
+}
+fn main(): int {
+    let p = new P(3);
+    return p.x;
+}
+"""
+
+def test_incremental_escape_analysis(tmp_path, monkeypatch):
+    monkeypatch.setenv('SPEED_CACHE_DIR', str(tmp_path))
+    _, full = Compiler().compile(STACK_UNIT_SOURCE, stats=True)
+    _, stats = Compiler(incremental=True).compile_to_file(
+        STACK_UNIT_SOURCE, str(tmp_path / 'p.ll'), stats=True)
+    ir_str = (tmp_path / 'p.ll').read_text()
+    assert stats.stack_allocated == full.stack_allocated == 1
+    assert 'speed.mem.alloc"(' not in ir_str
+    assert 'alloca %"struct.P"' in ir_str
+    assert JIT(compiler=Compiler(incremental=True), use_cache=False).run(STACK_UNIT_SOURCE) == 3
+
+    # Pieces cached with objects on the stack are not reused without
+    incremental = IncrementalCompiler(Compiler(stack_objects=False))
+    assert 'speed.mem.alloc"(' in incremental.compile(STACK_UNIT_SOURCE)
+    assert incremental.reused == []
+
+    # An init that lets the object escape puts it back on the heap
+    escaping = STACK_UNIT_SOURCE.replace('this.x = x;', 'this.x = x;\n        let alias = this;')
+    incremental = IncrementalCompiler(Compiler())
+    ir_str = incremental.compile(escaping)
+    assert 'main' in incremental.rebuilt
+    assert 'speed.mem.alloc"(' in ir_str
+    assert str(Compiler().compile(escaping)).count('speed.mem.alloc"(') == ir_str.count('speed.mem.alloc"(')
+
+ASYNC_SOURCE = """
+import { listen, port, accept, connect, recv, send, close } from "net"
+import { group, spawn, gather, sleep } from "tasks"
+
+class Point {
+    x: int;
+    y: int;
+}
+
+async fn handle(fd: int) {
+    let request = await recv(fd, 1024);
+    await send(fd, request);
+    close(fd);
+}
+
+async fn serve(server: int, clients: int): int {
+    let handlers = group();
+    for (let i = 0; i < clients; i = i + 1) {
+        let fd = await accept(server);
+        spawn(handlers, handle(fd));
+    }
+    return await gather(handlers);
+}
+
+async fn client(to: int, text: string): int {
+    let fd = await connect("127.0.0.1", to);
+    if (fd < 0) {
+        return 0;
+    }
+    await send(fd, text);
+    let reply = await recv(fd, 100);
+    close(fd);
+    return reply.length;
+}
+
+async fn call(to: int, received: Point) {
+    let bytes = await client(to, "ping");
+    received.x = received.x + bytes;
+}
+
+public fn echo(clients: int): int {
+    let server = listen(0);
+    let served = serve(server, clients);
+    let received = new Point(0, 0);
+    let replies = group();
+    for (let i = 0; i < clients; i = i + 1) {
+        spawn(replies, call(port(server), received));
+    }
+    let connected = await gather(replies);
+    let handled = await served;
+    close(server);
+    return received.x * 1000 + connected + handled;
+}
+
+async fn tick(log: Point, id: int, delay: int) {
+    await sleep(delay);
+    log.x = log.x * 10 + id;
+}
+
+public fn timers(): int {
+    let log = new Point(0, 0);
+    let ticks = group();
+    spawn(ticks, tick(log, 3, 30));
+    spawn(ticks, tick(log, 1, 0));
+    spawn(ticks, tick(log, 2, 10));
+    // Left to finish on its own, before the group's last tick
+    tick(log, 4, 20);
+    await gather(ticks);
+    return log.x;
+}
+
+async fn scaled(p: Point, k: int): Point {
+    await sleep(0);
+    return new Point(p.x * k, p.y * k);
+}
+
+public fn churn(n: int): int {
+    let total = 0;
+    for (let i = 0; i < n; i = i + 1) {
+        let p = await scaled(new Point(i, 1), 2);
+        total = total + p.x + p.y;
+    }
+    return total;
+}
+
+fn main(): int {
+    return 0;
+}
+"""
+
+@pytest.mark.parametrize('opt_level', ['0', '2'])
+def test_async_tasks(opt_level):
+    program = JIT(opt_level=opt_level, use_cache=False).load(ASYNC_SOURCE)
+    engine = program.engine
+    echo = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64)(engine.get_function_address('echo'))
+    # Every client got its 4 bytes back, and every task ran
+    assert echo(50) == 50 * 4 * 1000 + 50 + 50
+    timers = ctypes.CFUNCTYPE(ctypes.c_int64)(engine.get_function_address('timers'))
+    assert timers() == 1243
+    churn = ctypes.CFUNCTYPE(ctypes.c_int64, ctypes.c_int64)(engine.get_function_address('churn'))
+    churn(100)
+    before = heap_in_use()
+    assert churn(10000) == 2 * 49995000 + 2 * 10000
+    # Task frames and the objects passed to and returned by them are freed
+    assert heap_in_use() - before < 1 << 16
+
+def test_async_lowering():
+    module = Compiler().compile(ASYNC_SOURCE)
+    # An async fn returns its task, and is split into coroutine parts
+    assert isinstance(module.get_global('scaled').function_type.return_type, ir.PointerType)
+    assert 'presplitcoroutine' in str(module.get_global('scaled').attributes)
+    optimized = Backend('0').compile(module)
+    names = {function.name for function in optimized.functions}
+    assert 'scaled.resume' in names and 'scaled.destroy' in names
+    # A task nobody awaits is detached
+    timers = module.get_global('timers')
+    calls = [instr.callee.name for block in timers.blocks for instr in block.instructions
+             if isinstance(instr, ir.CallInstr)]
+    assert calls.count('speed.task.detach') == 1
+
+@pytest.mark.parametrize('source, message', [
+    ('fn f(): int {\n    return await 1;\n}', 'Cannot await int'),
+    ('async fn main(): int {\n    return 0;\n}', 'main cannot be async'),
+    ('async fn g(): int {\n    return 1;\n}\nfn f(): int {\n    let x = g();\n    return x;\n}',
+     'Cannot convert task<int> to int'),
+    ('import { sleep } from "tasks"\nasync fn f() {\n    arena {\n        await sleep(1);\n    }\n}',
+     'Cannot await inside an arena block'),
+])
+def test_async_errors(source, message):
+    with pytest.raises(ValueError, match=message):
+        Compiler().compile(source)
+
+def test_class_errors():
+    with pytest.raises(ValueError, match='Unknown class: Missing'):
+        Compiler().compile('fn f(): int {\n    let m = new Missing();\n    return 0;\n}')
+    with pytest.raises(ValueError, match='Method not found: scale'):
+        Compiler().compile(
+            'class P { x: int; }\nfn f(p: P): int {\n    return p.scale(2);\n}')
+    with pytest.raises(ValueError, match='takes 1 arguments but 2 were given'):
+        Compiler().compile('class P { x: int; }\nfn f(): int {\n    return new P(1, 2).x;\n}')
+    with pytest.raises(ValueError, match='Cannot assign to length of int\\[\\]'):
+        Compiler().compile('fn f(a: int[]): int {\n    a.length = 1;\n    return 0;\n}')